@@ -0,0 +1,93 @@
+"""Read latency while a bulk import is running, per connection profile
+
+    python benchmarks/profile_latency.py [--rows 200000] [--profiles default wal fast]
+
+For every profile a fresh database is filled by a writer thread in batches through a pooled
+dbManager, while the main thread keeps running an as-of position query on a reader connection.
+Reads that give up on a lock (busy_timeout exceeded) are counted as errors.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import connections  # noqa: E402
+from tools import dbtools  # noqa: E402
+from tools.request_builder import SessionManager  # noqa: E402
+
+READ_SQL = "SELECT sec_id, SUM(quantity) FROM transactions WHERE acc_id = ? AND date <= ? GROUP BY sec_id"
+
+
+def transaction_rows(count: int, accounts: int, securities: int) -> list:
+    return [[random.randint(1, securities), random.randint(1, accounts),
+             f"20{random.randint(10, 24)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}T00:00:00",
+             "buy", random.randint(-100, 100), random.random() * 100, "EUR"] for _ in range(count)]
+
+
+def run_profile(name: str, profile: dict, rows: list, batch_size: int, accounts: int, securities: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench_db")
+        session_mgr = SessionManager(db_path, use_pool=True, connection_profile=profile)
+        session_mgr.initiate_db()
+        session_mgr.add_entry("accounts", [{"id": acc_id} for acc_id in range(1, accounts + 1)])
+        session_mgr.add_entry("securities", [{"sec_id": sec_id} for sec_id in range(1, securities + 1)])
+        pool = session_mgr.pool
+        writer = dbtools.dbManager(db_path, pool=pool)
+        done = threading.Event()
+
+        def bulk_import() -> None:
+            writer.insert_many("transactions", ["sec_id", "acc_id", "date", "type", "quantity", "unit_price",
+                                                "currency"], rows, batch_size=batch_size)
+            done.set()
+
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        thread = threading.Thread(target=bulk_import)
+        thread.start()
+        with pool.reader() as reader:
+            while not done.is_set():
+                began = time.perf_counter()
+                try:
+                    reader.execute(READ_SQL, [random.randint(1, accounts), "2020-01-01"]).fetchall()
+                    latencies.append(time.perf_counter() - began)
+                except sqlite3.OperationalError:
+                    errors += 1
+        thread.join()
+        import_seconds = time.perf_counter() - start
+        session_mgr.close()
+    latencies.sort()
+    return {"profile": name, "import_s": import_seconds, "reads": len(latencies), "errors": errors,
+            "p50_ms": statistics.median(latencies) * 1000 if latencies else float("nan"),
+            "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float("nan"),
+            "max_ms": latencies[-1] * 1000 if latencies else float("nan")}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--securities", type=int, default=500)
+    parser.add_argument("--config", default=os.path.join("config", "default_db.yaml"))
+    parser.add_argument("--profiles", nargs="+", default=["default", "wal", "fast"])
+    args = parser.parse_args()
+
+    random.seed(0)
+    rows = transaction_rows(args.rows, args.accounts, args.securities)
+    print(f"{'profile':<10}{'import s':>10}{'reads':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name in args.profiles:
+        result = run_profile(name, connections.load_profile(args.config, name), rows, args.batch_size,
+                             args.accounts, args.securities)
+        print(f"{result['profile']:<10}{result['import_s']:>10.2f}{result['reads']:>8}{result['errors']:>8}"
+              f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['max_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Timings of the hot paths on synthetic databases of several sizes
+
+    python benchmarks/run_benchmarks.py [--scales small medium] [--output results.json] [--no-startup]
+                                        [--compare baseline.json] [--tolerance 1.25] [--min-delta-ms 1]
+
+Every scale point (see tools/synthetic.SCALES) gets a fresh, seeded database. Each benchmark runs
+--repeat times and the fastest run is kept, which is the least noisy estimate on a busy machine.
+Results are written as JSON; with --compare they are checked against an earlier result file and the
+run exits with status 1 when a benchmark got slower than tolerance times its baseline.
+
+The "startup" entry times the cold start of the streamlit app, every run in a fresh interpreter:
+importing the modules of tools/ui_st.py, and the first script run (imports, opening and checking
+the database, rendering the menu) through streamlit's AppTest against an empty database.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tools import synthetic  # noqa: E402
+from tools.request_builder import SessionManager  # noqa: E402
+
+
+def benchmarks(session_mgr: SessionManager, scale: synthetic.Scale) -> dict:
+    """{name: callable} of the hot paths, each callable does one complete operation"""
+    db_manager = session_mgr.db_manager
+    mid_date = pd.Timestamp(scale.start) + (pd.Timestamp(scale.end) - pd.Timestamp(scale.start)) / 2
+    end_date = pd.Timestamp(scale.end).to_pydatetime()
+    acc_ids = iter(range(1, 10 ** 9))
+
+    def next_acc_id() -> int:
+        return (next(acc_ids) - 1) % scale.accounts + 1
+
+    def table_attributes() -> dict:
+        # uncached, what every schema change costs
+        session_mgr._schema_cache = {"version": None}
+        return session_mgr.communicate_table_attributes()
+
+    return {
+        "read_table_account": lambda: db_manager.read_table("transactions", filters={"acc_id": next_acc_id()}),
+        "read_table_typed": lambda: session_mgr.read("transactions", filters={"acc_id": next_acc_id()}, typed=True),
+        "read_table_sorted_limit": lambda: db_manager.read_table("prices", order_by=["-date"], limit=1000),
+        "read_page": lambda: db_manager.read_page("transactions", order_by="date", page_size=100),
+        "update_table": lambda: db_manager.update_table("types", ["bench", "option", "value"],
+                                                        ["category", "option", "value"]),
+        "insert_many_10k": lambda: db_manager.insert_many(
+            "types", ["category", "option", "value"], [["bench", f"option{i}", "value"] for i in range(10000)]),
+        "communicate_table_attributes": table_attributes,
+        "update_positions": lambda: session_mgr.update_positions(next_acc_id(), end_date),
+        "refresh_positions": lambda: session_mgr.refresh_positions(next_acc_id(), end_date),
+        "positions_at": lambda: session_mgr.positions_at(end_date),
+        "aggregate_accounts": lambda: session_mgr.aggregate_accounts(end_date),
+        "get_holdings": lambda: session_mgr.get_holdings(end_date, refresh=True),
+        "value_history_year": lambda: session_mgr.value_history(mid_date, mid_date + pd.Timedelta(days=365)),
+    }
+
+
+def time_call(function, repeat: int) -> float:
+    runs = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - began)
+    return min(runs)
+
+
+def run_scale(name: str, scale: synthetic.Scale, seed: int, repeat: int, only: list) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench_db")
+        session_mgr = SessionManager(db_path, init_db_manager=False)
+        session_mgr.initiate_db(db_path)
+        began = time.perf_counter()
+        counts = synthetic.generate(session_mgr, scale, seed)
+        result = {"rows": counts, "generate_s": time.perf_counter() - began, "seconds": {}}
+        session_mgr.optimize(analyze=True)
+        for benchmark, function in benchmarks(session_mgr, scale).items():
+            if only and benchmark not in only:
+                continue
+            result["seconds"][benchmark] = time_call(function, repeat)
+            print(f"{name:<8}{benchmark:<32}{result['seconds'][benchmark] * 1000:>12.2f} ms")
+        session_mgr.close()
+    return result
+
+
+STARTUP_SCRIPTS = {
+    "import_app": "import time\n"
+                  "began = time.perf_counter()\n"
+                  "import tools.util, tools.request_builder\n"
+                  "print(time.perf_counter() - began)\n",
+    "first_paint": "import time\n"
+                   "from streamlit.testing.v1 import AppTest\n"
+                   "began = time.perf_counter()\n"
+                   "app = AppTest.from_file({app!r}, default_timeout=60).run()\n"
+                   "assert not app.exception, app.exception\n"
+                   "print(time.perf_counter() - began)\n",
+}
+
+
+def run_startup(repeat: int, only: list) -> dict:
+    """Cold start timings, each run in a new interpreter with an empty database in a scratch directory"""
+    result = {"seconds": {}}
+    app = os.path.join(ROOT, "tools", "ui_st.py")
+    for benchmark, script in STARTUP_SCRIPTS.items():
+        if only and benchmark not in only:
+            continue
+        runs = []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                # the app finds its config and database relative to the working directory
+                os.symlink(os.path.join(ROOT, "config"), os.path.join(tmp_dir, "config"))
+                os.mkdir(os.path.join(tmp_dir, "db"))
+                output = subprocess.run([sys.executable, "-c", script.format(app=app)], cwd=tmp_dir, check=True,
+                                        capture_output=True, text=True, env={**os.environ, "PYTHONPATH": ROOT})
+                runs.append(float(output.stdout.split()[-1]))
+        result["seconds"][benchmark] = min(runs)
+        print(f"{'startup':<8}{benchmark:<32}{result['seconds'][benchmark] * 1000:>12.2f} ms")
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float = 0.001) -> list:
+    """(scale, benchmark, baseline s, current s) of every benchmark slower than tolerance times its baseline
+
+    Differences below min_delta seconds are timer noise and never count.
+    """
+    regressions = []
+    for scale, result in results["scales"].items():
+        for benchmark, seconds in result["seconds"].items():
+            before = baseline.get("scales", {}).get(scale, {}).get("seconds", {}).get(benchmark)
+            if before:
+                print(f"{scale:<8}{benchmark:<32}{before * 1000:>12.2f} ms{seconds * 1000:>12.2f} ms"
+                      f"{seconds / before:>8.2f}x")
+                if seconds > before * tolerance and seconds - before > min_delta:
+                    regressions.append((scale, benchmark, before, seconds))
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"], choices=list(synthetic.SCALES))
+    parser.add_argument("--benchmarks", nargs="*", default=[], help="run only these benchmarks")
+    parser.add_argument("--startup", action=argparse.BooleanOptionalAction, default=True,
+                        help="time the cold start of the app")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=f"benchmark_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument("--compare", help="earlier result file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument("--min-delta-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    results = {"meta": {"created": datetime.datetime.now().isoformat(), "seed": args.seed, "repeat": args.repeat,
+                        "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                        "pandas": pd.__version__, "platform": platform.platform()},
+               "scales": {}}
+    if args.startup:
+        results["scales"]["startup"] = run_startup(args.repeat, args.benchmarks)
+    for name in args.scales:
+        results["scales"][name] = run_scale(name, synthetic.SCALES[name], args.seed, args.repeat, args.benchmarks)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms / 1000)
+        for scale, benchmark, before, seconds in regressions:
+            print(f"Regression: {scale} {benchmark} {before * 1000:.2f} ms -> {seconds * 1000:.2f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
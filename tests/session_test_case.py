@@ -0,0 +1,25 @@
+import os
+import tempfile
+import unittest
+
+from tools import request_builder
+
+
+class SessionTestCase(unittest.TestCase):
+    """A SessionManager (self.session_mgr) on a database created from the yaml schema in a temporary
+    directory, closed through SessionManager.close after the test; db_name None skips it"""
+    db_name = "test_db"
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # cleanups run last in, first out: the sessions are closed before the directory goes
+        self.addCleanup(self.tmp_dir.cleanup)
+        if self.db_name:
+            self.session_mgr = self.open_session(self.db_name)
+
+    def open_session(self, name: str) -> request_builder.SessionManager:
+        """SessionManager on a new database called name in the temporary directory, closed after the test"""
+        session_mgr = request_builder.SessionManager(init_db_manager=False)
+        session_mgr.initiate_db(os.path.join(self.tmp_dir.name, name))
+        self.addCleanup(session_mgr.close)
+        return session_mgr
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import time
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from tools.apis import apiHandler, FakeProvider, RateLimiter, ProviderError
+from tools import cache
+from tools.cache import QuoteCache
+from tests.session_test_case import SessionTestCase
+
+
+class TestApiHandler(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("securities", [{"sec_id": sec_id, "isin_or_fx": f"ISIN{sec_id:04d}"}
+                                                  for sec_id in range(1, 1001)])
+        # securities without a symbol are not requested
+        self.session_mgr.add_entry("securities", {"sec_id": 1001})
+
+    def test_get_price_batched_and_concurrent(self):
+        provider = FakeProvider(latency=0.05, max_batch_size=50, max_concurrency=5)
+        handler = apiHandler(self.session_mgr, provider)
+        start = time.perf_counter()
+        df = handler.get_price(date="2024-03-01")
+        elapsed = time.perf_counter() - start
+        self.assertEqual(1000, len(df))
+        self.assertEqual(20, provider.calls)
+        self.assertEqual(5, provider.max_in_flight)
+        # 20 batches of 50ms, 5 at a time
+        self.assertLess(elapsed, 20 * 0.05 / 2)
+        prices = self.session_mgr.read("prices", filters={"sec_id": 7})
+        self.assertEqual(["2024-03-01"], prices["date"].tolist())
+        self.assertEqual(FakeProvider.value("ISIN0007", pd.Timestamp("2024-03-01"), 1, 500),
+                         prices["unit_price"].iloc[0])
+        self.assertEqual("fake", prices["source"].iloc[0])
+
+    def test_refetch_replaces_prices(self):
+        handler = apiHandler(self.session_mgr, FakeProvider(latency=0))
+        handler.get_price([1, 2], date="2024-03-01")
+        handler.get_price([1, 2], date="2024-03-01")
+        self.assertEqual(2, len(self.session_mgr.read("prices")))
+        price = self.session_mgr.get_closest_price([1], "2024-03-02")["unit_price"].iloc[0]
+        self.assertEqual(FakeProvider.value("ISIN0001", pd.Timestamp("2024-03-01"), 1, 500), price)
+
+    def test_fetch_replaces_entered_price_and_rate(self):
+        self.session_mgr.add_entry("prices", {"sec_id": 1, "date": "2024-03-01", "unit_price": 1.0})
+        self.session_mgr.add_entry("fx_rates", {"nominator": "EUR", "denominator": "USD", "rate": 1.0,
+                                                "date": "2024-03-01"})
+        handler = apiHandler(self.session_mgr, FakeProvider(latency=0))
+        handler.get_price([1], date="2024-03-01")
+        handler.get_fx_rates([("EUR", "USD")], date="2024-03-01")
+        prices = self.session_mgr.read("prices")
+        self.assertEqual([("2024-03-01", "fake")], list(zip(prices["date"], prices["source"])))
+        rates = self.session_mgr.read("fx_rates")
+        self.assertEqual([("2024-03-01", "fake")], list(zip(rates["date"], rates["source"])))
+
+    def test_retry_with_backoff(self):
+        provider = FakeProvider(latency=0, failure_rate=0.5, max_batch_size=10, seed=3)
+        handler = apiHandler(self.session_mgr, provider, retries=10, backoff=0.001)
+        df = handler.get_price(list(range(1, 101)), date="2024-03-01")
+        self.assertEqual(100, len(df))
+        self.assertGreater(handler.last_stats.retries, 0)
+        self.assertEqual(10 + handler.last_stats.retries, handler.last_stats.requests)
+        self.assertEqual([], handler.last_stats.failed)
+
+    def test_failures_are_reported(self):
+        provider = FakeProvider(latency=0, failure_rate=1.0, max_batch_size=10)
+        handler = apiHandler(self.session_mgr, provider, retries=2, backoff=0.001)
+        df = handler.get_price([1, 2, 3], date="2024-03-01")
+        self.assertTrue(df.empty)
+        self.assertEqual(3, handler.last_stats.requests)
+        self.assertEqual(["ISIN0001", "ISIN0002", "ISIN0003"], handler.last_stats.failed)
+
+        async def rejected(batch):
+            raise ProviderError("invalid api key")
+        result = asyncio.run(handler.fetch_all(rejected, ["a", "b"]))
+        self.assertEqual({}, result)
+        self.assertEqual(1, handler.last_stats.requests)
+
+    def test_check_id(self):
+        handler = apiHandler(self.session_mgr, FakeProvider(latency=0, unknown={"BAD"}))
+        self.assertEqual({"ISIN0001": True, "BAD": False}, handler.check_id(["ISIN0001", "BAD"]))
+
+    def test_no_sec_ids(self):
+        handler = apiHandler(self.session_mgr, FakeProvider(latency=0))
+        self.assertEqual(["sec_id", "isin_or_fx", "type"], list(handler.instruments([]).columns))
+        self.assertTrue(handler.get_price([], date="2024-03-01").empty)
+        self.assertEqual(0, handler.last_stats.requests)
+
+    def test_inside_running_event_loop(self):
+        handler = apiHandler(self.session_mgr, FakeProvider(latency=0, unknown={"BAD"}))
+
+        async def caller():
+            return handler.check_id(["ISIN0001", "BAD"])
+        self.assertEqual({"ISIN0001": True, "BAD": False}, asyncio.run(caller()))
+
+    def test_get_fx_rates(self):
+        handler = apiHandler(self.session_mgr, FakeProvider(latency=0))
+        handler.get_fx_rates([("EUR", "USD"), ("EUR", "HUF")], date="2024-03-01")
+        rate = self.session_mgr.fx_converter().rate("USD", "EUR", "2024-03-05")
+        self.assertAlmostEqual(1 / FakeProvider.value("EUR/USD", pd.Timestamp("2024-03-01"), 0.5, 2), rate)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(100)
+
+        async def acquire_many():
+            for _ in range(6):
+                await limiter.acquire()
+        start = time.perf_counter()
+        asyncio.run(acquire_many())
+        self.assertGreaterEqual(time.perf_counter() - start, 0.045)
+
+
+class TestQuoteCache(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("securities", [{"sec_id": sec_id, "isin_or_fx": f"ISIN{sec_id}",
+                                                   "type": "fund" if sec_id % 2 else "stock"}
+                                                  for sec_id in range(1, 11)])
+        self.cache = QuoteCache(os.path.join(self.tmp_dir.name, "cache", "quote_cache"), max_entries=50)
+        self.provider = FakeProvider(latency=0, unknown={"ISIN10"})
+        self.handler = apiHandler(self.session_mgr, self.provider, cache=self.cache)
+        self.today = pd.Timestamp.today().normalize()
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        super().tearDown()
+
+    def test_default_path_independent_of_working_directory(self):
+        self.assertTrue(os.path.isabs(cache.DEFAULT_CACHE_PATH))
+        default = os.path.join(self.tmp_dir.name, "package", "db", "quote_cache")
+        cwd = os.getcwd()
+        os.mkdir(os.path.join(self.tmp_dir.name, "elsewhere"))
+        os.chdir(os.path.join(self.tmp_dir.name, "elsewhere"))
+        try:
+            with patch("tools.cache.DEFAULT_CACHE_PATH", default):
+                other = QuoteCache()
+            other.close()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(default, other.path)
+        self.assertTrue(os.path.exists(default))
+        self.assertEqual([], os.listdir(os.path.join(self.tmp_dir.name, "elsewhere")))
+
+    def test_repeated_refresh_is_served_from_db(self):
+        first = self.handler.get_price(date=self.today)
+        self.assertEqual(9, len(first))
+        calls = self.provider.calls
+        second = self.handler.get_price(date=self.today)
+        self.assertEqual(calls, self.provider.calls)
+        self.assertEqual(sorted(first["unit_price"]), sorted(second["unit_price"]))
+        # 9 prices from the database, the unknown symbol from the cache
+        self.assertEqual((9, 1, 10), (self.cache.stats.db_hits, self.cache.stats.cache_hits, self.cache.stats.misses))
+        self.handler.get_price(date=self.today, refresh=True)
+        self.assertEqual(calls + 1, self.provider.calls)
+
+    def test_cache_shared_across_databases(self):
+        self.handler.get_fx_rates([("EUR", "USD")], date=self.today)
+        other = self.open_session("other_db")
+        calls = self.provider.calls
+        rates = apiHandler(other, self.provider, cache=self.cache).get_fx_rates([("EUR", "USD")], date=self.today)
+        self.assertEqual(calls, self.provider.calls)
+        self.assertEqual(1, self.cache.stats.cache_hits)
+        self.assertEqual(1, len(other.read("fx_rates")))
+        self.assertEqual(1, len(rates))
+
+    def test_ttl_per_instrument_type(self):
+        self.cache.ttls["stock"] = 0
+        self.handler.get_price(date=self.today)
+        self.provider.calls = 0
+        self.handler.get_price(date=self.today)
+        # only the stocks (even sec_ids) expired, the unknown ISIN10 included
+        self.assertEqual(1, self.provider.calls)
+        self.assertEqual(5, self.handler.last_stats.requested)
+        # quotes of past days fetched after the day closed do not expire
+        self.handler.get_price(date=self.today - pd.Timedelta(days=3))
+        self.provider.calls = 0
+        self.handler.get_price(date=self.today - pd.Timedelta(days=3))
+        self.assertEqual(0, self.provider.calls)
+
+    def test_lru_eviction(self):
+        self.cache.put_many({f"price:S{i}:2024-01-01": float(i) for i in range(40)})
+        self.cache.get_many({"price:S0:2024-01-01": None}, pd.Timestamp(self.today))
+        self.cache.put_many({f"price:T{i}:2024-01-01": float(i) for i in range(20)})
+        self.assertEqual(10, self.cache.stats.evictions)
+        remaining = self.cache.get_many({f"price:{prefix}{i}:2024-01-01": None for prefix in "ST" for i in range(40)},
+                                        pd.Timestamp(self.today))
+        self.assertEqual(50, len(remaining))
+        # the recently read S0 and all newer T entries survive, 10 of the other S entries are gone
+        self.assertIn("price:S0:2024-01-01", remaining)
+        self.assertEqual(20, sum(key.startswith("price:T") for key in remaining))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import json
+import unittest
+
+import pandas as pd
+
+from tools.apis import apiHandler, FakeProvider
+from tools.backfill import BackfillJob
+from tests.session_test_case import SessionTestCase
+
+
+class TestBackfillJob(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("securities", [{"sec_id": sec_id, "isin_or_fx": f"ISIN{sec_id}"}
+                                                  for sec_id in (1, 2, 3)])
+        self.session_mgr.add_entry("securities", {"sec_id": 4})
+        days = [f"{day:%Y-%m-%d}" for day in pd.bdate_range("2024-01-01", "2024-01-31")]
+        self.session_mgr.add_entry("prices", [{"sec_id": 1, "date": day, "unit_price": 1.0} for day in days
+                                              if day not in ("2024-01-10", "2024-01-11", "2024-01-12")])
+        self.session_mgr.add_entry("prices", [{"sec_id": 2, "date": day, "unit_price": 2.0} for day in days
+                                              if "2024-01-15" <= day <= "2024-01-19"])
+        self.provider = FakeProvider(latency=0, max_batch_size=2)
+        self.handler = apiHandler(self.session_mgr, self.provider)
+        self.checkpoint = os.path.join(self.tmp_dir.name, "backfill.json")
+
+    def job(self, **kwargs) -> BackfillJob:
+        return BackfillJob(self.handler, "2024-01-01", "2024-01-31", checkpoint_path=self.checkpoint, **kwargs)
+
+    def test_gaps(self):
+        gaps = self.job().gaps()
+        self.assertEqual([(1, "ISIN1", "2024-01-10", "2024-01-14"),
+                          (2, "ISIN2", "2024-01-01", "2024-01-14"),
+                          (2, "ISIN2", "2024-01-20", "2024-01-31"),
+                          (3, "ISIN3", "2024-01-01", "2024-01-31")],
+                         list(gaps.itertuples(index=False, name=None)))
+
+    def test_plan_merges_close_gaps(self):
+        # the two gaps of sec_id 2 are 6 days apart
+        self.assertEqual([(1, "ISIN1", "2024-01-10", "2024-01-14"), (2, "ISIN2", "2024-01-01", "2024-01-31"),
+                          (3, "ISIN3", "2024-01-01", "2024-01-31")], self.job().plan())
+        self.assertEqual(4, len(self.job(merge_within_days=5).plan()))
+
+    def test_run_fills_gaps_and_rerun_is_a_no_op(self):
+        self.provider.holidays = {"2024-01-26"}
+        stats = self.job().run(progress=None)
+        self.assertEqual(3, stats.requests)
+        self.assertEqual(2, self.provider.calls)
+        prices = self.session_mgr.read("prices", filters={"sec_id": 3})
+        self.assertEqual(22, len(prices))
+        # only the hole was requested, existing prices are kept
+        prices = self.session_mgr.read("prices", filters={"sec_id": 1})
+        self.assertEqual(23, len(prices))
+        self.assertEqual(20, (prices["unit_price"] == 1.0).sum())
+        # the merged range of sec_id 2 covered its stored days, one row per business day except the holiday
+        prices = self.session_mgr.read("prices", filters={"sec_id": 2})
+        self.assertEqual(22, len(prices))
+        self.assertEqual(22, prices["date"].nunique())
+        self.assertEqual(5, (prices["unit_price"] == 2.0).sum())
+        self.assertTrue(prices["date"].str.fullmatch(r"\d{4}-\d{2}-\d{2}").all())
+        written = len(self.session_mgr.read("prices"))
+
+        # the holiday is still a gap, but already tried
+        job = self.job()
+        self.assertEqual([(2, "2024-01-26", "2024-01-28"), (3, "2024-01-26", "2024-01-28")],
+                         list(job.gaps()[["sec_id", "start", "end"]].itertuples(index=False, name=None)))
+        self.assertEqual([], job.plan())
+        self.assertEqual(0, job.run(progress=None).requests)
+        self.assertEqual(2, self.provider.calls)
+        self.assertEqual(written, len(self.session_mgr.read("prices")))
+
+    def test_default_checkpoint_next_to_database(self):
+        self.provider.holidays = {"2024-01-26"}
+        BackfillJob(self.handler, "2024-01-01", "2024-01-31").run(progress=None)
+        calls = self.provider.calls
+        self.assertTrue(os.path.exists(self.session_mgr.db_path + ".backfill.json"))
+        # the holiday is not requested again by a plain re-run
+        self.assertEqual(0, BackfillJob(self.handler, "2024-01-01", "2024-01-31").run(progress=None).requests)
+        self.assertEqual(calls, self.provider.calls)
+
+    def test_resume_after_interrupt(self):
+        def interrupt(stats):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.job(requests_per_chunk=2).run(progress=interrupt)
+        with open(self.checkpoint) as file:
+            self.assertEqual({"1", "2"}, set(json.load(file)["completed"]))
+        resumed = self.job(requests_per_chunk=2)
+        self.assertEqual([(3, "ISIN3", "2024-01-01", "2024-01-31")], resumed.plan())
+        resumed.run(progress=None)
+        self.assertEqual([], self.job().plan())
+
+
+if __name__ == '__main__':
+    unittest.main()
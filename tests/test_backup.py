@@ -0,0 +1,137 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from tools import backup
+from tools import request_builder
+
+
+class TestBackup(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test_db")
+        self.backup_dir = os.path.join(self.tmp_dir.name, "backups")
+        self.session_mgr = request_builder.SessionManager(self.db_path, use_pool=True)
+        self.session_mgr.initiate_db(self.db_path)
+        self.session_mgr.add_entry("accounts", [{"id": acc_id, "short_name": f"acc{acc_id}"} for acc_id in range(1, 501)])
+
+    def tearDown(self) -> None:
+        self.session_mgr.close()
+        self.tmp_dir.cleanup()
+
+    def accounts(self, db_path: str) -> int:
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_backup_is_a_snapshot_while_writing(self):
+        target = os.path.join(self.backup_dir, "snapshot.sqlite")
+        steps = []
+
+        def write_during_backup(copied, total):
+            steps.append((copied, total))
+            if len(steps) == 1:
+                # another thread, the backup has the database open in a read transaction
+                writer = threading.Thread(target=self.session_mgr.add_entry, args=("accounts", {"id": 999}))
+                writer.start()
+                writer.join(5)
+                self.assertFalse(writer.is_alive())
+
+        result = backup.backup_db(self.db_path, target, pages=2, progress=write_during_backup)
+        self.assertGreater(len(steps), 1)
+        self.assertEqual(steps[-1][1], result.pages)
+        self.assertEqual(500, self.accounts(target))
+        self.assertEqual(501, self.accounts(self.db_path))
+        self.assertEqual([target], [os.path.join(self.backup_dir, name) for name in os.listdir(self.backup_dir)])
+
+    def test_save_db_in_background_and_restore(self):
+        job = self.session_mgr.save_db(compress=True)
+        result = job.result(timeout=30)
+        self.assertTrue(job.done())
+        self.assertEqual(1.0, job.progress)
+        self.assertTrue(result.path.endswith(".sqlite.gz"))
+        self.assertEqual([result.path], self.session_mgr.list_backups())
+        self.session_mgr.db_manager.remove_from_table("accounts", {"id": {">": 10}})
+        self.assertEqual(10, len(self.session_mgr.read("accounts")))
+        self.assertGreater(self.session_mgr.restore_db(result.path), 0)
+        self.assertEqual(500, len(self.session_mgr.read("accounts")))
+
+    def test_restore_while_reading_and_of_older_schema(self):
+        # a backup as an older version wrote it, an index short and user_version 0
+        old_path = os.path.join(self.tmp_dir.name, "old.sqlite")
+        conn = sqlite3.connect(old_path)
+        self.session_mgr.db_manager.conn.backup(conn)
+        conn.execute("DROP INDEX idx_transactions_sec_id_date")
+        conn.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+        reading = threading.Event()
+
+        def read_during_restore():
+            with self.session_mgr.pool.reader() as reader:
+                reader.execute("BEGIN")
+                reader.execute("SELECT COUNT(*) FROM accounts").fetchone()
+                reading.set()
+                time.sleep(0.2)
+                reader.rollback()
+
+        reader_thread = threading.Thread(target=read_during_restore)
+        reader_thread.start()
+        reading.wait(5)
+        self.assertGreater(self.session_mgr.restore_db(old_path), 0)
+        reader_thread.join()
+        self.assertEqual([], self.session_mgr.db_manager.check_db(self.session_mgr._scheme_dict))
+        self.assertEqual(500, len(self.session_mgr.read("accounts")))
+
+    def test_failed_compression_leaves_no_files(self):
+        target = os.path.join(self.backup_dir, backup.backup_name(self.db_path, compress=True))
+        with patch.object(backup.gzip, "open", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                backup.backup_db(self.db_path, target)
+        self.assertEqual([], os.listdir(self.backup_dir))
+
+    def test_rotate_keeps_newest(self):
+        os.makedirs(self.backup_dir)
+        for day in range(1, 5):
+            name = backup.backup_name(self.db_path, datetime.datetime(2024, 1, day), compress=day % 2 == 0)
+            open(os.path.join(self.backup_dir, name), "w").close()
+        open(os.path.join(self.backup_dir, "other_20240101_000000.sqlite"), "w").close()
+        removed = backup.rotate(self.backup_dir, self.db_path, keep=2)
+        self.assertEqual(["test_db_20240102_000000.sqlite.gz", "test_db_20240101_000000.sqlite"],
+                         [os.path.basename(path) for path in removed])
+        self.assertEqual(["test_db_20240104_000000.sqlite.gz", "test_db_20240103_000000.sqlite"],
+                         [os.path.basename(path) for path in backup.list_backups(self.backup_dir, self.db_path)])
+
+    def test_names_sharing_a_prefix(self):
+        os.makedirs(self.backup_dir)
+        other_db = os.path.join(self.tmp_dir.name, "test_db_old")
+        for db_path in (self.db_path, other_db):
+            for day in range(1, 3):
+                name = backup.backup_name(db_path, datetime.datetime(2024, 1, day))
+                open(os.path.join(self.backup_dir, name), "w").close()
+        open(os.path.join(self.backup_dir, "test_db_20240103_000000.sqlite.partial"), "w").close()
+        self.assertEqual(["test_db_20240102_000000.sqlite", "test_db_20240101_000000.sqlite"],
+                         [os.path.basename(path) for path in backup.list_backups(self.backup_dir, self.db_path)])
+        backup.rotate(self.backup_dir, self.db_path, keep=0)
+        self.assertEqual(["test_db_old_20240102_000000.sqlite", "test_db_old_20240101_000000.sqlite"],
+                         [os.path.basename(path) for path in backup.list_backups(self.backup_dir, other_db)])
+
+    def test_restore_refuses_damaged_backup(self):
+        damaged = os.path.join(self.tmp_dir.name, "damaged.sqlite")
+        with open(damaged, "wb") as file:
+            file.write(b"not a database" * 100)
+        with self.assertRaises(sqlite3.DatabaseError):
+            self.session_mgr.restore_db(damaged)
+        self.assertEqual(500, len(self.session_mgr.read("accounts")))
+
+
+if __name__ == '__main__':
+    unittest.main()
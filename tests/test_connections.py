@@ -0,0 +1,158 @@
+import gc
+import os
+import tempfile
+import threading
+import unittest
+
+from tools import connections
+from tools import dbtools
+from tools import request_builder
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test_db")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_shared_pool_lifecycle(self):
+        pool = connections.get_pool(self.db_path)
+        self.assertIs(pool, connections.get_pool(self.db_path))
+        connections.release_pool(self.db_path)
+        self.assertFalse(pool.closed)
+        connections.release_pool(self.db_path)
+        self.assertTrue(pool.closed)
+        self.assertIsNot(pool, connections.get_pool(self.db_path))
+        connections.release_pool(self.db_path)
+
+    def test_reader_pool_is_bounded(self):
+        pool = connections.ConnectionPool(self.db_path, read_pool_size=2)
+        with pool.reader() as first, pool.reader() as second:
+            self.assertIsNot(first, second)
+        with pool.reader() as third:
+            self.assertIn(third, (first, second))
+        pool.close()
+        with self.assertRaises(Exception):
+            with pool.reader():
+                pass
+
+    def test_concurrent_sessions(self):
+        pool = connections.ConnectionPool(self.db_path)
+        db_manager = dbtools.dbManager(self.db_path, pool=pool)
+        db_manager.create_table("numbers", [{"name": "value", "type": "INTEGER"}])
+
+        def write_and_read(start: int) -> None:
+            session_db = dbtools.dbManager(self.db_path, pool=pool)
+            session_db.insert_many("numbers", ["value"], [[value] for value in range(start, start + 100)],
+                                   batch_size=10)
+            session_db.read_table("numbers")
+
+        threads = [threading.Thread(target=write_and_read, args=(start,)) for start in range(0, 800, 100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        df = db_manager.read_query("SELECT COUNT(*) AS n FROM numbers")
+        self.assertEqual(800, df.at[0, "n"])
+        pool.close()
+
+    def test_session_set_db(self):
+        session_mgr = request_builder.SessionManager(self.db_path, use_pool=True)
+        session_mgr.initiate_db()
+        first_pool = session_mgr.pool
+        other_path = os.path.join(self.tmp_dir.name, "other_db")
+        session_mgr.set_db(other_path)
+        self.assertTrue(first_pool.closed)
+        self.assertEqual(other_path, session_mgr.pool.db_path)
+        session_mgr.initiate_db()
+        self.assertIn("transactions", session_mgr.list_of_tables_in_db())
+        session_mgr.close()
+        self.assertIsNone(session_mgr.pool)
+
+    def test_session_dropped_without_close_releases_pool(self):
+        session_mgr = request_builder.SessionManager(self.db_path, use_pool=True)
+        pool = connections.get_pool(self.db_path)
+        del session_mgr
+        gc.collect()
+        self.assertFalse(pool.closed)
+        # a closed session is not released a second time when it is collected
+        closed_session = request_builder.SessionManager(self.db_path, use_pool=True)
+        closed_session.close()
+        del closed_session
+        gc.collect()
+        self.assertFalse(pool.closed)
+        connections.release_pool(self.db_path)
+        self.assertTrue(pool.closed)
+
+
+class TestConnectionProfile(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test_db")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def pragma(self, conn, name: str):
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+    def test_load_profile(self):
+        config = os.path.join("config", "default_db.yaml")
+        self.assertEqual("WAL", connections.load_profile(config)["journal_mode"])
+        self.assertEqual({}, connections.load_profile(config, "default"))
+        with self.assertLogs("tools.connections", "WARNING"):
+            self.assertEqual({}, connections.load_profile(os.path.join(self.tmp_dir.name, "missing.yaml")))
+        with self.assertRaises(ValueError):
+            connections.load_profile(config, "turbo")
+
+    def test_load_yaml_parses_once_per_version(self):
+        config = os.path.join(self.tmp_dir.name, "config.yaml")
+        with open(config, "w") as file:
+            file.write("database: {name: one}\n")
+        first = connections.load_yaml(config)
+        first["database"]["name"] = "changed"
+        self.assertEqual({"database": {"name": "one"}}, connections.load_yaml(config))
+        with open(config, "w") as file:
+            file.write("database: {name: two}\n")
+        os.utime(config, ns=(0, os.stat(config).st_mtime_ns + 1000))
+        self.assertEqual({"database": {"name": "two"}}, connections.load_yaml(config))
+
+    def test_profile_on_every_connection(self):
+        profile = connections.load_profile(os.path.join("config", "default_db.yaml"), "fast")
+        pool = connections.ConnectionPool(self.db_path, profile=profile)
+        with pool.reader() as reader:
+            for conn in (pool.writer, reader):
+                self.assertEqual("wal", self.pragma(conn, "journal_mode"))
+                self.assertEqual(1, self.pragma(conn, "synchronous"))
+                self.assertEqual(-65536, self.pragma(conn, "cache_size"))
+                self.assertEqual(5000, self.pragma(conn, "busy_timeout"))
+                self.assertEqual(1, self.pragma(conn, "foreign_keys"))
+        pool.close()
+        db_manager = dbtools.dbManager(self.db_path, profile={"synchronous": "OFF", "temp_store": "MEMORY"})
+        self.assertEqual(0, self.pragma(db_manager.conn, "synchronous"))
+        self.assertEqual(2, self.pragma(db_manager.conn, "temp_store"))
+        db_manager.close()
+
+    def test_invalid_profile(self):
+        with self.assertRaises(ValueError):
+            dbtools.dbManager(self.db_path, profile={"locking_mode": "EXCLUSIVE"})
+        with self.assertRaises(ValueError):
+            dbtools.dbManager(self.db_path, profile={"journal_mode": "WAL; DROP TABLE x"})
+
+    def test_optimize(self):
+        db_manager = dbtools.dbManager(self.db_path)
+        db_manager.create_table("numbers", [{"name": "value", "type": "INTEGER"}],
+                                indexes=[{"columns": ["value"]}])
+        db_manager.insert_many("numbers", ["value"], [[value] for value in range(10)])
+        db_manager.optimize(analyze=True)
+        stats = db_manager.read_query("SELECT stat FROM sqlite_stat1 WHERE tbl = 'numbers'")
+        self.assertEqual("10", stats["stat"].iloc[0].split()[0])
+        db_manager.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
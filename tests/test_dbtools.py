@@ -1,6 +1,7 @@
 import unittest
-from unittest.mock import Mock, MagicMock, patch
+from unittest.mock import Mock, MagicMock, patch, call
 import os
+import tempfile
 
 import pandas as pd
 
@@ -48,6 +49,18 @@ class test_dbManager(unittest.TestCase):
         self.db_manager.cursor.execute.assert_called_with(expected_sql)
         self.db_manager.conn.commit.assert_any_call()
 
+    def test_create_table_with_options(self):
+        columns = [{"name": "sec_id", "type": "INTEGER"},
+                   {"name": "date", "type": "TEXT"},
+                   {"name": "unit_price", "type": "REAL"}]
+        expected_table_sql = "CREATE TABLE IF NOT EXISTS prices (sec_id INTEGER, date TEXT, unit_price REAL, " \
+                             "PRIMARY KEY (sec_id, date), UNIQUE (date, sec_id)) STRICT, WITHOUT ROWID"
+        expected_index_sql = "CREATE UNIQUE INDEX IF NOT EXISTS idx_prices_date ON prices (date)"
+        self.db_manager.create_table("prices", columns, primary_key=["sec_id", "date"], unique=[["date", "sec_id"]],
+                                     indexes=[{"columns": ["date"], "unique": True}], without_rowid=True, strict=True)
+        self.db_manager.cursor.execute.assert_has_calls([call(expected_table_sql), call(expected_index_sql)])
+        self.db_manager.conn.commit.assert_any_call()
+
     def test_check_db(self):
         pass
 
@@ -73,6 +86,27 @@ class test_dbManager(unittest.TestCase):
         self.db_manager.cursor.execute.assert_called_with(expected, input_val)
         self.db_manager.conn.commit.assert_any_call()
 
+    def test_insert_many_batches(self):
+        rows = [[1, "a"], [2, "b"], [3, "c"]]
+        expected_sql = "INSERT INTO my_table(col1, col2) VALUES(?,?)"
+        written = self.db_manager.insert_many("my_table", ["col1", "col2"], rows, batch_size=2)
+        self.assertEqual(written, 3)
+        self.db_manager.cursor.executemany.assert_has_calls([call(expected_sql, [[1, "a"], [2, "b"]]),
+                                                              call(expected_sql, [[3, "c"]])])
+        self.assertEqual(self.db_manager.conn.commit.call_count, 2)
+
+    def test_insert_many_dataframe(self):
+        df = pd.DataFrame({"col1": [1, 2], "col2": ["a", "b"]})
+        expected_sql = "INSERT OR REPLACE INTO my_table(col1, col2) VALUES(?,?)"
+        written = self.db_manager.insert_many("my_table", None, df, conflict="REPLACE")
+        self.assertEqual(written, 2)
+        self.db_manager.cursor.executemany.assert_called_once_with(expected_sql, [(1, "a"), (2, "b")])
+
+    def test_insert_many_empty(self):
+        self.assertEqual(self.db_manager.insert_many("my_table", ["col1"], []), 0)
+        self.db_manager.cursor.executemany.assert_not_called()
+        self.db_manager.conn.commit.assert_not_called()
+
     # @patch("pandas")
     def test_read_table_no_cols(self):
         table = 'my_table'
@@ -100,14 +134,16 @@ class test_dbManager(unittest.TestCase):
         self.db_manager.cursor.description = [["Instrument"], ["Quantity"], ["Price"], ["Currency"]]
         columns = ["Instrument", "Quantity", "Price", "Currency"]
         expected_df = pd.DataFrame(fetch_answer, columns=columns)
-        df = self.db_manager.read_table(table, columns=columns_input)
+        with patch.object(self.db_manager, "table_columns", return_value=columns_input) as columns_mock:
+            df = self.db_manager.read_table(table, columns=columns_input)
+        columns_mock.assert_called_with(table)
         self.db_manager.cursor.execute.assert_called_with(expected_query, [])
         self.db_manager.cursor.fetchall.assert_any_call()
         pd.testing.assert_frame_equal(expected_df, df)
 
     def test_read_table_filters(self):
         table = 'my_table'
-        expected_query = f"SELECT * FROM {table} WHERE CURRENCY in(?) AND INSTRUMENT in(?)"
+        expected_query = f"SELECT * FROM {table} WHERE CURRENCY = ? AND INSTRUMENT = ?"
         fetch_answer = [("SP500", 5, 511.12, "EUR"),
                         ("N100", 15, 99.41, "USD"),
                         ("D2027/4", 30, 10000.00, "HUF")]
@@ -116,11 +152,52 @@ class test_dbManager(unittest.TestCase):
         columns = ["Instrument", "Quantity", "Price", "Currency"]
         filter_dict = {"CURRENCY": "USD", "INSTRUMENT": "SP500"}
         expected_df = pd.DataFrame(fetch_answer, columns=columns)
-        df = self.db_manager.read_table(table, filters=filter_dict)
+        with patch.object(self.db_manager, "table_columns", return_value=["CURRENCY", "INSTRUMENT"]):
+            df = self.db_manager.read_table(table, filters=filter_dict)
         self.db_manager.cursor.execute.assert_called_with(expected_query, ["USD", "SP500"])
         self.db_manager.cursor.fetchall.assert_any_call()
         pd.testing.assert_frame_equal(expected_df, df)
 
+    def test_read_table_filter_expressions(self):
+        self.db_manager.cursor.fetchall.return_value = []
+        self.db_manager.cursor.description = [["value"]]
+        known = ["category", "option", "value", "date", "rowid"]
+        with patch.object(self.db_manager, "table_columns", return_value=known):
+            self.db_manager.read_table("types", columns=["value"],
+                                       filters={"category": ["a", "b"], "option": None,
+                                                "date": {"between": ("2024-01-01", "2024-02-01"), "!=": "2024-01-15"},
+                                                "value": {"is_null": False, "not_in": [1, 2]}},
+                                       order_by=["-date", "value"], limit=10)
+            self.db_manager.cursor.execute.assert_called_with(
+                "SELECT value FROM types WHERE category IN (?, ?) AND option IS NULL AND date BETWEEN ? AND ? "
+                "AND date != ? AND value IS NOT NULL AND value NOT IN (?, ?) ORDER BY date DESC, value LIMIT ?",
+                ["a", "b", "2024-01-01", "2024-02-01", "2024-01-15", 1, 2, 10])
+
+            self.db_manager.read_table("types", filters={"option": []})
+            self.db_manager.cursor.execute.assert_called_with("SELECT * FROM types WHERE 0", [])
+
+            with self.assertRaises(ValueError):
+                self.db_manager.read_table("types", filters={"category; DROP TABLE types": 1})
+            with self.assertRaises(ValueError):
+                self.db_manager.read_table("types", order_by="-nope")
+            with self.assertRaises(ValueError):
+                self.db_manager.read_table("types", filters={"value": {"~": 1}})
+
+    def test_read_query(self):
+        sql = "SELECT sec_id, quantity FROM positions WHERE acc_id = ?"
+        self.db_manager.cursor.fetchall.return_value = [(1, 10), (2, 20)]
+        self.db_manager.cursor.description = [["sec_id"], ["quantity"]]
+        df = self.db_manager.read_query(sql, [1])
+        self.db_manager.cursor.execute.assert_called_with(sql, [1])
+        pd.testing.assert_frame_equal(pd.DataFrame({"sec_id": [1, 2], "quantity": [10, 20]}), df)
+
+    def test_remove_from_table(self):
+        self.db_manager.cursor.rowcount = 3
+        removed = self.db_manager.remove_from_table("positions", "acc_id = ?", [1])
+        self.db_manager.cursor.execute.assert_called_with("DELETE FROM positions WHERE acc_id = ?", [1])
+        self.db_manager.conn.commit.assert_any_call()
+        self.assertEqual(removed, 3)
+
     def test__run_custom_query_commit(self):
         sql = "SELECT * FROM MY TABLE"
         self.db_manager._run_custom_query(sql)
@@ -149,9 +226,61 @@ class test_dbManager(unittest.TestCase):
         self.db_manager.cursor.fetchall.assert_any_call()
 
 
+class test_dbManager_pages(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = dbtools.dbManager(os.path.join(self.tmp_dir.name, "test_db"))
+        self.db_manager.create_table("items", [{"name": "id", "type": "INTEGER", "primary_key": True},
+                                               {"name": "name", "type": "TEXT"}])
+        self.db_manager.create_table("quotes", [{"name": "sec_id", "type": "INTEGER"}, {"name": "date", "type": "TEXT"},
+                                                {"name": "price", "type": "REAL"}],
+                                     primary_key=["sec_id", "date"], without_rowid=True)
+        self.db_manager.insert_many("items", ["id", "name"], [[1, "b"], [2, None], [3, "a"], [4, "b"], [5, None]])
+
+    def tearDown(self) -> None:
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def read_all(self, table: str, **kwargs) -> list:
+        pages, after = [], None
+        while True:
+            page = self.db_manager.read_page(table, after=after, page_size=2, **kwargs)
+            pages.append(page.rows["id"].tolist())
+            if not page.has_next:
+                return pages
+            after = page.last
+
+    def test_page_key(self):
+        self.assertEqual(["rowid"], self.db_manager.page_key("items"))
+        self.assertEqual(["sec_id", "date"], self.db_manager.page_key("quotes"))
+
+    def test_read_page(self):
+        page = self.db_manager.read_page("items", columns=["name"], page_size=2)
+        self.assertEqual(["name"], page.rows.columns.tolist())
+        self.assertEqual((2,), page.last)
+        self.assertTrue(page.has_next)
+        self.assertEqual([[1, 2], [3, 4], [5]], self.read_all("items"))
 
+    def test_read_page_sorted_with_nulls(self):
+        self.assertEqual([[2, 5], [3, 1], [4]], self.read_all("items", order_by="name"))
+        self.assertEqual([[4, 1], [3, 5], [2]], self.read_all("items", order_by="name", descending=True))
 
+    def test_read_page_without_rowid(self):
+        self.db_manager.insert_many("quotes", ["sec_id", "date", "price"],
+                                    [[2, "2024-01-01", 1.0], [1, "2024-01-02", 2.0], [1, "2024-01-01", 3.0]])
+        page = self.db_manager.read_page("quotes", page_size=2)
+        self.assertEqual([3.0, 2.0], page.rows["price"].tolist())
+        self.assertEqual((1, "2024-01-02"), page.last)
+        page = self.db_manager.read_page("quotes", after=page.last, page_size=2)
+        self.assertEqual([1.0], page.rows["price"].tolist())
+        self.assertFalse(page.has_next)
 
+    def test_estimate_count(self):
+        self.assertEqual(5, self.db_manager.estimate_count("items"))
+        self.assertEqual(0, self.db_manager.estimate_count("quotes"))
+        self.db_manager.remove_from_table("items", {"id": {"<=": 3}, "name": {"is_null": False}})
+        self.assertEqual(3, self.db_manager.estimate_count("items", exact=True))
 
 
 if __name__ == '__main__':
@@ -1,10 +1,30 @@
 import unittest
 
+import pandas as pd
+
+from tools import display
+
 
 class MyTestCase(unittest.TestCase):
     def test_something(self):
         self.assertEqual(True, False)  # add assertion here
 
 
+class TestDisplay(unittest.TestCase):
+    def test_create_bar_chart(self):
+        data = pd.DataFrame({"date": pd.date_range("2024-01-01", periods=2), "value": [1.0, 2.0],
+                             "account": ["acc1", "acc1"]})
+        chart = display.create_bar_chart(data, x="date", y="value", color="account", title="test")
+        self.assertEqual("bar", chart.mark)
+        self.assertEqual("date:T", chart.encoding.x.shorthand)
+        self.assertEqual("account:N", chart.encoding.color.shorthand)
+
+    def test_create_pie_chart(self):
+        data = pd.DataFrame({"type": ["ETF", "Bond"], "value": [1.0, 2.0]})
+        chart = display.create_pie_chart(data, theta="value", color="type")
+        self.assertEqual("arc", chart.mark)
+        self.assertEqual("value:Q", chart.encoding.theta.shorthand)
+
+
 if __name__ == '__main__':
     unittest.main()
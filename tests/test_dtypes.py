@@ -0,0 +1,75 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from tools import dtypes
+from tests.session_test_case import SessionTestCase
+
+
+class TestDtypes(unittest.TestCase):
+
+    def test_column_kinds(self):
+        columns = [{"name": "id", "type": "INTEGER"}, {"name": "price", "type": "REAL"},
+                   {"name": "change_date", "type": "TEXT"}, {"name": "currency", "type": "TEXT"},
+                   {"name": "note", "type": "TEXT"}]
+        kinds = dtypes.column_kinds(columns, {"currency": "category"})
+        self.assertEqual({"id": "int", "price": "float", "change_date": "datetime", "currency": "category",
+                          "note": "text"}, kinds)
+        with self.assertRaises(ValueError):
+            dtypes.column_kinds(columns, {"note": "blob"})
+
+    def test_schema_hints(self):
+        scheme = {"database": {"tables": {"types": {"columns": [{"name": "category", "type": "TEXT",
+                                                                 "dtype": "category"},
+                                                                {"name": "value", "type": "TEXT"}]}}}}
+        self.assertEqual({"types": {"category": "category"}}, dtypes.schema_hints(scheme))
+
+    def test_combine_chunks(self):
+        kinds = {"qty": "int", "ccy": "category", "day": "datetime", "note": "text"}
+        chunks = [dtypes.typed_chunk(pd.DataFrame({"qty": ["1", 2], "ccy": ["EUR", "USD"],
+                                                   "day": ["2024-01-01", "2024-01-02T00:00:00"],
+                                                   "note": ["a", "a"]}), kinds),
+                  dtypes.typed_chunk(pd.DataFrame({"qty": [3, None], "ccy": ["HUF", "EUR"],
+                                                   "day": [None, "2024-01-03"], "note": ["a", "b"]}), kinds)]
+        df = dtypes.combine(chunks, kinds, ["qty", "ccy", "day", "note"])
+        self.assertEqual(np.float64, df["qty"].dtype)
+        self.assertEqual(["EUR", "USD", "HUF", "EUR"], df["ccy"].tolist())
+        self.assertIsInstance(df["ccy"].dtype, pd.CategoricalDtype)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df["day"]))
+        self.assertTrue(pd.isna(df["day"].iloc[2]))
+        self.assertIsInstance(df["note"].dtype, pd.CategoricalDtype)
+
+
+class TestTypedReads(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("accounts", [{"id": 1, "short_name": "acc1"}])
+        self.session_mgr.add_entry("securities", [{"sec_id": 1}])
+        self.session_mgr.add_entry("transactions", [
+            {"sec_id": 1, "acc_id": 1, "date": "2024-01-0" + str(day), "quantity": day, "unit_price": 1.5,
+             "currency": "EUR" if day % 2 else "USD"} for day in range(1, 6)])
+
+    def test_read_typed(self):
+        df = self.session_mgr.read("transactions", columns=["acc_id", "date", "quantity", "unit_price", "currency"],
+                                   typed=True)
+        self.assertEqual(np.int64, df["quantity"].dtype)
+        self.assertEqual(np.float64, df["unit_price"].dtype)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df["date"]))
+        self.assertEqual(["EUR", "USD"], sorted(df["currency"].cat.categories))
+        self.assertEqual({"EUR": 9, "USD": 6}, df.groupby("currency", observed=True)["quantity"].sum().to_dict())
+
+    def test_read_typed_empty(self):
+        df = self.session_mgr.read("transactions", filters={"acc_id": 2}, typed=True)
+        self.assertTrue(df.empty)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df["date"]))
+
+    def test_read_arrow(self):
+        df = self.session_mgr.read("transactions", columns=["quantity", "currency"], arrow=True)
+        self.assertIsInstance(df["quantity"].dtype, pd.ArrowDtype)
+        self.assertEqual(15, df["quantity"].sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+import numpy as np
+
+from tools.fx import FxConverter
+from tests.session_test_case import SessionTestCase
+
+
+class TestFxConverter(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("fx_rates", [
+            {"nominator": "EUR", "denominator": "USD", "rate": 1.10, "date": "2024-01-02"},
+            {"nominator": "EUR", "denominator": "USD", "rate": 1.20, "date": "2024-01-10"},
+            {"nominator": "EUR", "denominator": "HUF", "rate": 400.0, "date": "2024-01-02"},
+            {"nominator": "GBP", "denominator": "CHF", "rate": 1.10, "date": "2024-01-02"},
+            {"nominator": "CHF", "denominator": "HUF", "rate": 420.0, "date": "2024-01-02"}])
+        self.converter = FxConverter(self.session_mgr.db_manager, pivot="EUR")
+
+    def test_direct_and_inverse(self):
+        self.assertAlmostEqual(1.10, self.converter.rate("EUR", "USD", "2024-01-05"))
+        self.assertAlmostEqual(1.20, self.converter.rate("EUR", "USD", "2024-01-10"))
+        self.assertAlmostEqual(1 / 400.0, self.converter.rate("HUF", "EUR", "2024-01-05"))
+        self.assertEqual(1.0, self.converter.rate("HUF", "HUF", "2024-01-05"))
+        self.assertTrue(np.isnan(self.converter.rate("EUR", "USD", "2024-01-01")))
+
+    def test_triangulation(self):
+        self.assertAlmostEqual(400.0 / 1.10, self.converter.rate("USD", "HUF", "2024-01-05"))
+        self.assertAlmostEqual(1.10 * 420.0 / 400.0, self.converter.rate("GBP", "EUR", "2024-01-05"))
+        self.assertTrue(np.isnan(self.converter.rate("EUR", "JPY", "2024-01-05")))
+
+    def test_convert_single_date(self):
+        converted = self.converter.convert([100, 200, 300, 50], ["USD", "EUR", "USD", "JPY"], "EUR", "2024-01-05")
+        self.converter.convert([1], ["USD"], "EUR", "2024-01-05")
+        cache_info = self.converter._cached_rate.cache_info()
+        self.assertEqual((3, 1), (cache_info.misses, cache_info.hits))
+        np.testing.assert_allclose([100 / 1.1, 200, 300 / 1.1, np.nan], converted)
+
+    def test_convert_per_row_dates(self):
+        converted = self.converter.convert([110, 120, 10], ["USD", "USD", None], "EUR",
+                                           ["2024-01-05", "2024-01-11T10:00:00", "2024-01-05"])
+        np.testing.assert_allclose([100, 100, np.nan], converted)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+from tools.holdings import HoldingsView
+from tests.session_test_case import SessionTestCase
+
+
+class TestHoldingsView(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("accounts", [{"id": 1, "short_name": "acc1"}, {"id": 2, "short_name": "acc2"}])
+        self.session_mgr.add_entry("securities", [{"sec_id": 11, "short_name": "AAA", "type": "stock"},
+                                                  {"sec_id": 12, "short_name": "BBB", "type": "fund"}])
+        self.session_mgr.add_entry("transactions", [{"sec_id": 11, "acc_id": 1, "date": "2024-01-10", "quantity": 10},
+                                                    {"sec_id": 12, "acc_id": 1, "date": "2024-01-11", "quantity": 4},
+                                                    {"sec_id": 11, "acc_id": 2, "date": "2024-01-12", "quantity": 3}])
+        self.session_mgr.add_entry("prices", [{"sec_id": 11, "date": "2024-01-05", "unit_price": 2.0},
+                                              {"sec_id": 11, "date": "2024-01-15", "unit_price": 3.0},
+                                              {"sec_id": 12, "date": "2024-01-15", "unit_price": 5.0}])
+        for acc_id in (1, 2):
+            self.session_mgr.refresh_positions(acc_id, datetime.datetime(2024, 1, 16))
+        self.view = HoldingsView(self.session_mgr.db_manager, self.session_mgr.tables)
+
+    def totals(self, date) -> dict:
+        holdings = self.session_mgr.get_holdings(date)
+        return {(acc_id, sec_id): total for acc_id, sec_id, total in
+                zip(holdings["acc_id"], holdings["sec_id"], holdings["total_price"])}
+
+    def test_get_holdings_materializes(self):
+        holdings = self.session_mgr.get_holdings(datetime.datetime(2024, 1, 31))
+        self.assertEqual([(1, 11), (1, 12), (2, 11)], list(zip(holdings["acc_id"], holdings["sec_id"])))
+        self.assertEqual(["acc1", "acc1", "acc2"], list(holdings["account"]))
+        self.assertEqual(["AAA", "BBB", "AAA"], list(holdings["security"]))
+        self.assertEqual([30.0, 20.0, 9.0], list(holdings["total_price"]))
+        self.assertEqual(["2024-01-31T00:00:00"], self.view.dates())
+        with patch.object(HoldingsView, "refresh") as refresh_mock:
+            self.assertEqual(3, len(self.session_mgr.get_holdings(datetime.datetime(2024, 1, 31, 15))))
+        refresh_mock.assert_not_called()
+
+    def test_price_change_refreshes_affected_rows(self):
+        self.totals("2024-01-19")
+        self.totals("2024-01-31")
+        with patch.object(HoldingsView, "refresh", wraps=self.view.refresh) as refresh_mock:
+            self.session_mgr.add_entry("prices", {"sec_id": 11, "date": "2024-01-20", "unit_price": 4.0})
+        # only the dates after the price, only the rows of the security
+        self.assertEqual(1, refresh_mock.call_count)
+        self.assertEqual(("2024-01-31T00:00:00", None, {11}), refresh_mock.call_args.args)
+        self.assertEqual({(1, 11): 40.0, (1, 12): 20.0, (2, 11): 12.0}, self.totals("2024-01-31"))
+        self.assertEqual({(1, 11): 30.0, (1, 12): 20.0, (2, 11): 9.0}, self.totals("2024-01-19"))
+
+    def test_positions_refresh_updates_account(self):
+        self.totals("2024-02-15")
+        self.session_mgr.add_entry("transactions", [{"sec_id": 12, "acc_id": 2, "date": "2024-02-01", "quantity": 1},
+                                                    {"sec_id": 11, "acc_id": 2, "date": "2024-02-02", "quantity": -3}])
+        self.session_mgr.refresh_positions(2, datetime.datetime(2024, 2, 10))
+        self.assertEqual({(1, 11): 30.0, (1, 12): 20.0, (2, 12): 5.0}, self.totals("2024-02-15"))
+
+    def test_read_uses_index(self):
+        plan = self.session_mgr.db_manager.explain_query_plan(
+            f"SELECT * FROM {self.view.holdings} WHERE date = ? ORDER BY acc_id, sec_id", ["2024-01-31T00:00:00"])
+        self.assertTrue(any("USING INDEX" in step for step in plan), plan)
+        self.assertFalse(any("TEMP B-TREE" in step for step in plan), plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
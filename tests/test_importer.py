@@ -0,0 +1,67 @@
+import os
+import unittest
+from unittest.mock import Mock
+
+import pandas as pd
+
+from tools.importer import TransactionImporter
+from tests.session_test_case import SessionTestCase
+
+
+class TestTransactionImporter(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("accounts", [{"id": 1, "short_name": "broker1"},
+                                                {"id": 2, "short_name": "broker2"}])
+        self.session_mgr.add_entry("securities", [{"sec_id": 10, "isin_or_fx": "US0000000001"},
+                                                  {"sec_id": 11, "isin_or_fx": "US0000000002"}])
+        self.csv_path = os.path.join(self.tmp_dir.name, "export.csv")
+        pd.DataFrame({"Account": ["broker1", "broker2", "broker1", "unknown"],
+                      "ISIN": ["US0000000001", "US0000000002", "US0000000002", "US0000000001"],
+                      "Trade Date": ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"],
+                      "Qty": ["10", "5", "-2", "1"],
+                      "Price": ["100.5", "20", "21", "1"],
+                      "Ccy": ["USD", "EUR", "EUR", "USD"]}).to_csv(self.csv_path, index=False)
+        self.column_map = {"Account": "acc_id", "ISIN": "sec_id", "Trade Date": "date",
+                           "Qty": "quantity", "Price": "unit_price", "Ccy": "currency"}
+
+    def test_run(self):
+        progress_mock = Mock()
+        importer = TransactionImporter(self.session_mgr, self.column_map, chunksize=2)
+        stats = importer.run(self.csv_path, progress=progress_mock)
+
+        self.assertEqual((stats.rows_read, stats.rows_written, stats.rows_skipped, stats.chunks), (4, 3, 1, 2))
+        self.assertEqual(progress_mock.call_count, 2)
+        df = self.session_mgr.read("transactions", columns=["sec_id", "acc_id", "date", "quantity", "currency"])
+        expected = pd.DataFrame({"sec_id": [10, 11, 11], "acc_id": [1, 2, 1],
+                                 "date": ["2024-01-02", "2024-01-03", "2024-01-04"],
+                                 "quantity": [10, 5, -2], "currency": ["USD", "EUR", "EUR"]})
+        pd.testing.assert_frame_equal(expected, df, check_dtype=False)
+        recorded = self.session_mgr.read("transactions", columns=["recorded_date"])
+        self.assertEqual(recorded["recorded_date"].nunique(), 1)
+
+    def test_bad_rows_are_skipped(self):
+        pd.DataFrame({"Account": ["broker1", "broker1", "broker2", "broker1", "unknown"],
+                      "ISIN": ["US0000000001", "US0000000002", "US0000000002", "US0000000001", "US0000000001"],
+                      "Trade Date": ["2024-01-02", "2024-01-03", "03/01/2024", "2024-01-05", "2024-01-06"],
+                      "Qty": ["10", "", "5", "1,000", "1"],
+                      "Price": ["100.5", "20", "21", "", "1"],
+                      "Ccy": ["USD", "EUR", "EUR", "USD", "USD"]}).to_csv(self.csv_path, index=False)
+        importer = TransactionImporter(self.session_mgr, self.column_map, chunksize=2, date_format="%Y-%m-%d")
+        with self.assertLogs("tools.importer", "WARNING") as logs:
+            stats = importer.run(self.csv_path, progress=None)
+        self.assertEqual((5, 1, 4), (stats.rows_read, stats.rows_written, stats.rows_skipped))
+        self.assertEqual({"security or account could not be resolved": 1, "blank or invalid date": 1,
+                          "blank or invalid quantity": 2}, stats.skip_reasons)
+        self.assertIn("2 blank or invalid quantity", logs.output[0])
+        df = self.session_mgr.read("transactions", columns=["sec_id", "date", "quantity"])
+        self.assertEqual([(10, "2024-01-02", 10)], list(df.itertuples(index=False, name=None)))
+
+    def test_unknown_column(self):
+        with self.assertRaises(ValueError):
+            TransactionImporter(self.session_mgr, {"Qty": "qty"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from tools import dbtools
+from tools.instrumentation import QueryRecorder, normalize_sql
+
+
+class TestQueryRecorder(unittest.TestCase):
+
+    def test_normalize_sql(self):
+        self.assertEqual("SELECT * FROM prices WHERE sec_id IN (?...) AND date < ? AND source = ?",
+                         normalize_sql("SELECT *  FROM prices\n WHERE sec_id IN (?, ?,?) AND date < ? AND source = 'x'"))
+        self.assertEqual(normalize_sql("SELECT * FROM t LIMIT 10"), normalize_sql("SELECT * FROM t LIMIT 20"))
+        self.assertEqual("SELECT col2 FROM t2", normalize_sql("SELECT col2 FROM t2"))
+
+    def test_record_groups_statements(self):
+        recorder = QueryRecorder(slow_threshold=0.5)
+        self.assertFalse(recorder.record("SELECT * FROM t WHERE id IN (?, ?)", 0.1, rows=2, nbytes=100))
+        self.assertTrue(recorder.record("SELECT * FROM t WHERE id IN (?)", 0.7, rows=1, nbytes=50))
+        recorder.record("DELETE FROM t", 0.2, rows=-1)
+        stats = recorder.stats()
+        self.assertEqual(["SELECT * FROM t WHERE id IN (?...)", "DELETE FROM t"], list(stats["sql"]))
+        self.assertEqual([2, 1], list(stats["calls"]))
+        self.assertEqual([3, 0], list(stats["rows"]))
+        self.assertEqual(150, stats.at[0, "bytes"])
+        self.assertAlmostEqual(700.0, stats.at[0, "max_ms"])
+        recorder.reset()
+        self.assertTrue(recorder.stats().empty)
+
+
+class TestDbManagerInstrumentation(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = dbtools.dbManager(os.path.join(self.tmp_dir.name, "test_db"))
+        with self.assertLogs("tools.dbtools", level="DEBUG") as logs:
+            self.db_manager.create_table("t", [{"name": "id", "type": "INTEGER", "primary_key": True},
+                                               {"name": "name", "type": "TEXT"}])
+        self.assertIn("CREATE TABLE IF NOT EXISTS t", logs.output[0])
+
+    def tearDown(self) -> None:
+        self.db_manager.conn.close()
+        self.tmp_dir.cleanup()
+
+    def test_statements_are_recorded(self):
+        self.db_manager.insert_many("t", ["id", "name"], [[i, f"name{i}"] for i in range(10)])
+        self.db_manager.read_table("t", filters={"id": [1, 2, 3]})
+        self.db_manager.read_table("t", filters={"id": [4]})
+        self.db_manager.remove_from_table("t", "id > ?", [7])
+        stats = self.db_manager.recorder.stats().set_index("sql")
+        read = stats.loc["SELECT * FROM t WHERE id IN (?...)"]
+        self.assertEqual((2, 4), (read["calls"], read["rows"]))
+        self.assertGreater(read["bytes"], 0)
+        self.assertEqual(10, stats.loc["INSERT INTO t(id, name) VALUES(?...)", "rows"])
+        self.assertEqual(2, stats.loc["DELETE FROM t WHERE id > ?", "rows"])
+
+    def test_string_bytes_only_measured_for_slow_statements(self):
+        self.db_manager.insert_many("t", ["id", "name"], [[i, f"name{i}"] for i in range(10)])
+        with patch.object(pd.DataFrame, "memory_usage", autospec=True,
+                          side_effect=pd.DataFrame.memory_usage) as memory_usage:
+            self.db_manager.read_table("t")
+            self.assertFalse(memory_usage.call_args.kwargs["deep"])
+            self.db_manager.recorder.slow_threshold = 0
+            with self.assertLogs("tools.instrumentation", level="WARNING"):
+                self.db_manager.read_table("t")
+            self.assertTrue(memory_usage.call_args.kwargs["deep"])
+
+    def test_slow_queries_are_explained(self):
+        self.db_manager.recorder.slow_threshold = 0
+        with self.assertLogs("tools.instrumentation", level="WARNING"):
+            self.db_manager.read_query("SELECT name FROM t WHERE id = ?", [1])
+        slow = self.db_manager.recorder.slow_queries()
+        self.assertEqual("SELECT name FROM t WHERE id = ?", slow.at[0, "sql"])
+        self.assertIn("USING INTEGER PRIMARY KEY", slow.at[0, "plan"])
+
+    def test_disabled(self):
+        self.db_manager.recorder.reset()
+        self.db_manager.recorder.enabled = False
+        self.db_manager.read_query("SELECT * FROM t")
+        self.assertTrue(self.db_manager.recorder.stats().empty)
+
+
+if __name__ == '__main__':
+    unittest.main()
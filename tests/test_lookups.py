@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import patch
+
+from tools.lookups import LookupService
+from tests.session_test_case import SessionTestCase
+
+
+class TestLookupService(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("securities", [
+            {"sec_id": 1, "isin_or_fx": "US0378331005", "short_name": "AAPL"},
+            {"sec_id": 2, "isin_or_fx": "US5949181045", "short_name": "MSFT"},
+            {"sec_id": 3, "isin_or_fx": "IE00B4L5Y983", "short_name": "IWDA_100%"}])
+        self.service = LookupService(self.session_mgr.db_manager)
+        self.labels = ["isin_or_fx", "short_name"]
+
+    def test_options_limit(self):
+        options = self.service.options("securities", "sec_id", self.labels, limit=2)
+        self.assertEqual({"1 - US0378331005 - AAPL": 1, "2 - US5949181045 - MSFT": 2}, options)
+        self.assertIsInstance(options["1 - US0378331005 - AAPL"], int)
+
+    def test_search(self):
+        self.assertEqual([2], list(self.service.options("securities", "sec_id", self.labels, search="sft").values()))
+        self.assertEqual({}, self.service.options("securities", "sec_id", self.labels, search="sft", prefix=True))
+        # wildcards in the search term are matched literally
+        self.assertEqual([3], list(self.service.options("securities", "sec_id", self.labels, search="_100%").values()))
+        # rows starting with the term come before rows containing it
+        self.session_mgr.add_entry("securities", [{"sec_id": 0, "isin_or_fx": "XMSFT", "short_name": "M2"}])
+        self.assertEqual([2, 0], list(self.service.options("securities", "sec_id", self.labels,
+                                                           search="msft").values()))
+
+    def test_cache_invalidated_on_write(self):
+        self.service.options("securities", "sec_id", self.labels)
+        with patch.object(self.session_mgr.db_manager, "read_query",
+                          wraps=self.session_mgr.db_manager.read_query) as read_mock:
+            self.service.options("securities", "sec_id", self.labels)
+            read_mock.assert_not_called()
+            self.session_mgr.add_entry("securities", [{"sec_id": 5, "short_name": "NEW"}])
+            options = self.service.options("securities", "sec_id", self.labels)
+            read_mock.assert_called_once()
+        self.assertEqual(5, options["5 - NEW"])
+
+    def test_session_manager_lookup_options(self):
+        self.session_mgr.add_entry("accounts", [{"id": 1, "short_name": "broker", "provider": "bank"}])
+        self.assertEqual({"1 - broker - bank": 1}, self.session_mgr.lookup_options("accounts", "id"))
+        self.assertEqual({"2 - US5949181045 - MSFT": 2},
+                         self.session_mgr.lookup_options("securities", "sec_id", search="MSFT"))
+
+
+if __name__ == '__main__':
+    unittest.main()
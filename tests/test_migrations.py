@@ -0,0 +1,128 @@
+import copy
+import os
+import sqlite3
+import unittest
+from unittest.mock import patch
+
+from tools import migrations
+from tools import request_builder
+from tests.session_test_case import SessionTestCase
+
+
+class TestMigrations(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.db_manager = self.session_mgr.db_manager
+        self.scheme = copy.deepcopy(self.session_mgr._scheme_dict)
+        self.tables = self.scheme["database"]["tables"]
+        self.session_mgr.add_entry("accounts", [{"id": 1, "short_name": "acc1"}, {"id": 2, "short_name": "acc2"}])
+        self.session_mgr.add_entry("securities", {"sec_id": 11, "short_name": "AAA"})
+        self.session_mgr.add_entry("transactions", [{"sec_id": 11, "acc_id": 1, "date": "2024-01-10", "quantity": 10},
+                                                    {"sec_id": 11, "acc_id": 2, "date": "2024-01-11", "quantity": 4}])
+
+    def columns(self, table: str) -> list:
+        return list(self.db_manager.table_info(table)["name"])
+
+    def indexes(self, table: str) -> set:
+        return set(self.db_manager.read_query(f"PRAGMA index_list({table})")["name"])
+
+    def test_new_database_is_up_to_date(self):
+        self.assertEqual(migrations.schema_hash(self.scheme), self.db_manager.user_version())
+        self.assertEqual([], self.db_manager.check_db(self.scheme))
+        with patch.object(migrations, "diff") as diff_mock:
+            self.assertEqual([], self.db_manager.create_db_from_schema(self.scheme))
+        diff_mock.assert_not_called()
+
+    def test_add_column_and_indexes(self):
+        self.tables["accounts"]["columns"].append({"name": "note", "type": "TEXT"})
+        self.tables["transactions"]["indexes"].append({"columns": ["type"]})
+        self.tables["types"]["indexes"] = [{"columns": ["category", "option"], "unique": True}]
+        self.db_manager._run_custom_query("CREATE INDEX idx_by_hand ON accounts (provider)")
+        steps = self.db_manager.create_db_from_schema(self.scheme)
+        self.assertEqual([("accounts", "add_column"), ("transactions", "create_index"), ("types", "dedupe"),
+                          ("types", "drop_index"), ("types", "create_index")],
+                         [(step.table, step.action) for step in steps])
+        self.assertEqual("note", self.columns("accounts")[-1])
+        self.assertIn("idx_transactions_type", self.indexes("transactions"))
+        # indexes the schema does not name are not dropped
+        self.assertIn("idx_by_hand", self.indexes("accounts"))
+        self.assertEqual(["acc1", "acc2"], list(self.db_manager.read_table("accounts")["short_name"]))
+        self.assertEqual(migrations.schema_hash(self.scheme), self.db_manager.user_version())
+        self.assertEqual([], self.db_manager.check_db(self.scheme))
+
+    def test_rebuild_keeps_rows_and_indexes(self):
+        columns = self.tables["transactions"]["columns"]
+        self.tables["transactions"]["columns"] = [column for column in columns if column["name"] != "costs"]
+        steps = self.db_manager.create_db_from_schema(self.scheme)
+        self.assertEqual([("transactions", "rebuild", "columns removed: costs")],
+                         [(step.table, step.action, step.reason) for step in steps])
+        self.assertNotIn("costs", self.columns("transactions"))
+        transactions = self.db_manager.read_table("transactions")
+        self.assertEqual([(1, 1, 10), (2, 2, 4)], list(zip(transactions["tr_id"], transactions["acc_id"],
+                                                            transactions["quantity"])))
+        self.assertEqual({"idx_transactions_sec_id_date", "idx_transactions_acc_id_date"}, self.indexes("transactions"))
+        self.assertEqual(2, len(self.db_manager.foreign_key_list("transactions")))
+        self.assertEqual([], self.db_manager.check_db(self.scheme))
+        # the foreign keys are enforced again after the swap
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.session_mgr.add_entry("transactions", {"sec_id": 99, "acc_id": 1, "date": "2024-01-12"})
+
+    def test_autoincrement_added_by_rebuild(self):
+        # transactions as older versions created them, a tr_id of a deleted row could come back
+        old_scheme = copy.deepcopy(self.scheme)
+        old_scheme["database"]["tables"]["transactions"]["columns"][0].pop("autoincrement")
+        self.assertEqual([("transactions", "rebuild", "autoincrement changed")],
+                         [(step.table, step.action, step.reason)
+                          for step in self.db_manager.create_db_from_schema(old_scheme)])
+        steps = self.db_manager.create_db_from_schema(self.scheme)
+        self.assertEqual([("transactions", "rebuild", "autoincrement changed")],
+                         [(step.table, step.action, step.reason) for step in steps])
+        self.assertEqual([], self.db_manager.check_db(self.scheme))
+        self.db_manager.remove_from_table("transactions", {"tr_id": 2})
+        self.session_mgr.add_entry("transactions", {"sec_id": 11, "acc_id": 1, "date": "2024-01-12", "quantity": 1})
+        self.assertEqual([1, 3], list(self.db_manager.read_table("transactions")["tr_id"]))
+
+    def test_failed_migration_rolls_back(self):
+        version = self.db_manager.user_version()
+        self.tables["accounts"]["columns"].append({"name": "note", "type": "TEXT"})
+        self.tables["transactions"]["indexes"].append({"columns": ["sec_id"]})
+        self.tables["securities"]["columns"].append({"name": "required", "type": "TEXT NOT NULL"})
+        with self.assertRaises(sqlite3.OperationalError):
+            self.db_manager.create_db_from_schema(self.scheme)
+        self.assertNotIn("idx_transactions_sec_id", self.indexes("transactions"))
+        self.assertNotIn("note", self.columns("accounts"))
+        self.assertEqual(version, self.db_manager.user_version())
+
+    def test_database_of_older_version_with_duplicates(self):
+        # the tables as older versions created them: prices without a key, positions without a unique index
+        old_path = os.path.join(self.tmp_dir.name, "old_db")
+        old_session = request_builder.SessionManager(old_path)
+        self.addCleanup(old_session.close)
+        old_scheme = copy.deepcopy(self.scheme)
+        old_tables = old_scheme["database"]["tables"]
+        for option in ("primary_key", "without_rowid"):
+            old_tables["prices"].pop(option)
+        old_tables["positions"].pop("indexes")
+        old_session.create_tables_from_scheme_dict(old_scheme)
+        db_manager = old_session.db_manager
+        db_manager.insert_many("positions", ["date", "acc_id", "sec_id", "quantity"],
+                               [["2024-01-10T00:00:00", 1, 11, 5], ["2024-01-10T00:00:00", 1, 11, 7],
+                                ["2024-01-10T00:00:00", 1, 12, 3], ["2024-01-11T00:00:00", None, 11, 1],
+                                ["2024-01-11T00:00:00", None, 11, 2]])
+        db_manager.insert_many("prices", ["sec_id", "date", "unit_price"],
+                               [[11, "2024-01-10", 2.0], [11, "2024-01-10", 2.5], [11, "2024-01-11", 3.0]])
+        self.assertEqual(0, db_manager.user_version())
+        with self.assertLogs("tools.migrations", "WARNING") as logs:
+            old_session.initiate_db(old_path)
+        self.assertEqual(2, len(logs.records))
+        # the newest row of each key is kept, rows with a NULL key never collide
+        positions = db_manager.read_query("SELECT quantity FROM positions ORDER BY rowid")
+        self.assertEqual([7, 3, 1, 2], list(positions["quantity"]))
+        prices = db_manager.read_query("SELECT date, unit_price FROM prices ORDER BY date")
+        self.assertEqual([("2024-01-10", 2.5), ("2024-01-11", 3.0)], list(prices.itertuples(index=False, name=None)))
+        self.assertEqual([], db_manager.check_db(self.scheme))
+
+
+if __name__ == '__main__':
+    unittest.main()
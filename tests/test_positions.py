@@ -0,0 +1,133 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from tools.positions import PositionEngine, latest_snapshots, security_currencies
+from tests.session_test_case import SessionTestCase
+
+
+class TestPositionEngine(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("accounts", [{"id": 1, "short_name": "acc1"}])
+        self.session_mgr.add_entry("securities", [{"sec_id": sec_id} for sec_id in (11, 12, 13)])
+        self.add_transactions([(11, "2024-01-10", 10), (12, "2024-01-15", 5), (11, "2024-02-01", -4)])
+        self.engine = PositionEngine(self.session_mgr.db_manager, self.session_mgr.tables)
+
+    def add_transactions(self, transactions: list) -> None:
+        self.session_mgr.add_entry("transactions", [{"sec_id": sec_id, "acc_id": 1, "date": date, "quantity": qty}
+                                                    for sec_id, date, qty in transactions])
+
+    def as_dict(self, df) -> dict:
+        return dict(zip(df["sec_id"], df["quantity"]))
+
+    def test_full_build(self):
+        snapshot = self.engine.update(1, datetime.datetime(2024, 1, 20))
+        self.assertEqual({11: 10, 12: 5}, self.as_dict(snapshot))
+        self.assertEqual(self.engine.watermark(1), (3, "2024-01-20T00:00:00"))
+
+    def test_incremental_update(self):
+        self.engine.update(1, datetime.datetime(2024, 1, 20))
+        self.add_transactions([(13, "2024-02-10", 7), (12, "2024-02-11", -5)])
+        with patch.object(self.engine, "_sum_transactions", wraps=self.engine._sum_transactions) as sum_mock:
+            snapshot = self.engine.update(1, datetime.datetime(2024, 3, 1))
+        sum_mock.assert_called_once_with(1, "2024-03-01T00:00:00", 5, from_date="2024-01-20T00:00:00")
+        self.assertEqual({11: 6, 13: 7}, self.as_dict(snapshot))
+        # the closed position is left out, the snapshot is complete without it
+        self.assertEqual({11: 6, 13: 7}, self.engine.snapshot(1, "2024-03-05").to_dict())
+        self.assertEqual({11: 10, 12: 5}, self.engine.snapshot(1, "2024-02-15").to_dict())
+
+    def test_backdated_insert_rebuilds(self):
+        self.engine.update(1, datetime.datetime(2024, 1, 20))
+        self.engine.update(1, datetime.datetime(2024, 3, 1))
+        self.add_transactions([(13, "2024-01-05", 3)])
+        snapshot = self.engine.update(1, datetime.datetime(2024, 3, 1))
+        self.assertEqual({11: 6, 12: 5, 13: 3}, self.as_dict(snapshot))
+        positions = self.session_mgr.read("positions")
+        self.assertEqual(["2024-03-01T00:00:00"], positions["date"].unique().tolist())
+
+    def test_historical_date_keeps_watermark(self):
+        self.engine.update(1, datetime.datetime(2024, 3, 1))
+        snapshot = self.engine.update(1, datetime.datetime(2024, 1, 12))
+        self.assertEqual({11: 10}, self.as_dict(snapshot))
+        self.assertEqual(self.engine.watermark(1), (3, "2024-03-01T00:00:00"))
+
+    def test_update_positions_is_idempotent(self):
+        for _ in range(2):
+            self.session_mgr.update_positions(1, datetime.datetime(2024, 3, 1))
+        positions = self.session_mgr.read("positions")
+        self.assertEqual({11: 6, 12: 5}, dict(zip(positions["sec_id"], positions["quantity"])))
+
+    def test_ids_of_deleted_transactions_not_reused(self):
+        self.engine.update(1, datetime.datetime(2024, 3, 1))
+        self.session_mgr.db_manager.remove_from_table("transactions", {"tr_id": 3})
+        self.add_transactions([(13, "2024-02-10", 1)])
+        self.assertEqual([1, 2, 4], list(self.session_mgr.read("transactions")["tr_id"]))
+        # the new transaction is seen as backdated, the snapshots are rebuilt without the deleted one
+        snapshot = self.engine.update(1, datetime.datetime(2024, 3, 1))
+        self.assertEqual({11: 10, 12: 5, 13: 1}, self.as_dict(snapshot))
+
+    def test_update_positions_rebuilds_from_date(self):
+        self.session_mgr.update_positions(1, datetime.datetime(2024, 3, 1))
+        self.session_mgr.db_manager.execute_statements("transactions", [
+            ("UPDATE transactions SET quantity = ? WHERE tr_id = ?", [20, 1])])
+        self.session_mgr.update_positions(1, datetime.datetime(2024, 3, 1), datetime.datetime(2024, 1, 10))
+        self.assertEqual({11: 16, 12: 5}, self.engine.snapshot(1, "2024-03-01T00:00:00").to_dict())
+        self.assertEqual((3, "2024-03-01T00:00:00"), self.engine.watermark(1))
+
+    def test_write_snapshot_replaces_rows(self):
+        self.engine.write_snapshot(1, "2024-03-01T00:00:00", pd.Series({11: 6, 12: 5}))
+        self.engine.write_snapshot(1, "2024-03-01T00:00:00", pd.Series({11: 7, 12: 0, 13: 1}))
+        self.assertEqual({11: 7, 13: 1}, self.engine.snapshot(1, "2024-03-01T00:00:00").to_dict())
+        # a snapshot with everything closed keeps zero rows, as-of reads must not fall back to older ones
+        self.engine.write_snapshot(1, "2024-04-01T00:00:00", pd.Series({11: 0}, dtype="int64"),
+                                   self.engine.snapshot(1, "2024-03-01T00:00:00"))
+        self.assertEqual({11: 0, 13: 0}, self.engine.snapshot(1, "2024-04-01T00:00:00").to_dict())
+
+    def test_compact(self):
+        for date, quantities in (("2024-01-20", {11: 10, 12: 5}), ("2024-01-25", {11: 10, 12: 5}),
+                                 ("2024-02-05", {11: 6, 12: 5}), ("2024-02-10", {11: 6, 12: 5, 13: 0})):
+            self.engine.write_snapshot(1, f"{date}T00:00:00", pd.Series(quantities))
+        self.assertEqual(2, self.session_mgr.compact_positions())
+        positions = self.session_mgr.read("positions")
+        self.assertEqual(["2024-01-20T00:00:00", "2024-02-05T00:00:00"], sorted(positions["date"].unique()))
+        self.assertEqual({11: 6, 12: 5}, self.engine.snapshot(1, "2024-02-10T00:00:00").to_dict())
+        self.assertEqual(0, self.session_mgr.compact_positions(1))
+
+    def test_duplicates_of_older_versions_removed_at_startup(self):
+        db_manager = self.session_mgr.db_manager
+        # positions as older versions wrote them, without the unique key and with repeated rows
+        db_manager._run_custom_query("DROP INDEX uq_positions_acc_id_date_sec_id")
+        db_manager._run_custom_query("PRAGMA user_version = 0")
+        db_manager.insert_many("positions", ["date", "acc_id", "sec_id", "quantity"],
+                               [["2024-01-20T00:00:00", 1, 11, 10], ["2024-01-20T00:00:00", 1, 11, 10],
+                                ["2024-01-20T00:00:00", 1, 12, 5]])
+        with self.assertLogs("tools.migrations", "WARNING"):
+            self.session_mgr.initiate_db()
+        self.assertEqual(2, len(self.session_mgr.read("positions")))
+        self.assertEqual({11: 10, 12: 5}, self.engine.snapshot(1, "2024-01-20T00:00:00").to_dict())
+
+    def test_security_currencies(self):
+        self.session_mgr.add_entry("transactions", [
+            {"sec_id": 11, "acc_id": 1, "date": "2024-01-10", "quantity": 1, "currency": "USD"},
+            {"sec_id": 11, "acc_id": 1, "date": "2024-01-10", "quantity": 1, "currency": "CHF"},
+            {"sec_id": 11, "acc_id": 1, "date": "2024-01-05", "quantity": 1, "currency": "EUR"},
+            {"sec_id": 12, "acc_id": 1, "date": "2024-01-05", "quantity": 1, "currency": "GBP"}])
+        # the latest transaction naming a currency, the later inserted one on the same day
+        currencies = security_currencies(self.session_mgr.db_manager, "transactions", [12, 11, 13])
+        self.assertEqual([12, 11, 13], list(currencies.index))
+        self.assertEqual(["GBP", "CHF"], list(currencies.iloc[:2]))
+        self.assertTrue(pd.isna(currencies.loc[13]))
+        self.assertTrue(security_currencies(self.session_mgr.db_manager, "transactions", []).empty)
+
+    def test_positions_at_uses_index(self):
+        sql, params = latest_snapshots("positions", "accounts", "2024-03-01", [1])
+        plan = self.session_mgr.db_manager.explain_query_plan(sql, params)
+        self.assertTrue(any("USING COVERING INDEX" in step and "acc_id=?" in step for step in plan), plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from tools.prices import PriceIndex
+from tests.session_test_case import SessionTestCase
+
+
+class TestPriceIndex(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("securities", [{"sec_id": sec_id} for sec_id in (1, 2, 3)])
+        self.session_mgr.add_entry("prices", [{"sec_id": 1, "date": "2024-01-02", "unit_price": 10.0},
+                                              {"sec_id": 1, "date": "2024-01-05", "unit_price": 11.0},
+                                              {"sec_id": 2, "date": "2024-01-03", "unit_price": 50.0},
+                                              {"sec_id": 2, "date": "2024-01-10", "unit_price": 55.0}])
+        self.index = PriceIndex(self.session_mgr.db_manager)
+
+    def test_lookup(self):
+        self.assertEqual((pd.Timestamp("2024-01-02"), 10.0), self.index.lookup(1, "2024-01-04"))
+        self.assertEqual((pd.Timestamp("2024-01-05"), 11.0), self.index.lookup(1, datetime.datetime(2024, 2, 1)))
+        self.assertIsNone(self.index.lookup(1, "2024-01-01"))
+        self.assertIsNone(self.index.lookup(3, "2024-01-01"))
+
+    def test_lookup_many_single_query(self):
+        pairs = pd.DataFrame({"sec_id": [2, 1, 3, 1], "date": ["2024-01-20", "2024-01-03", "2024-01-20", "2024-01-05"]})
+        with patch.object(self.session_mgr.db_manager, "read_query",
+                          wraps=self.session_mgr.db_manager.read_query) as read_mock:
+            result = self.index.lookup_many(pairs)
+            self.index.lookup_many(pairs)
+        read_mock.assert_called_once()
+        self.assertEqual([2, 1, 3, 1], result["sec_id"].tolist())
+        np.testing.assert_array_equal([55.0, 10.0, np.nan, 11.0], result["unit_price"].to_numpy())
+        self.assertEqual(pd.Timestamp("2024-01-10"), result.at[0, "price_date"])
+
+    def test_invalidate(self):
+        self.assertEqual(11.0, self.index.lookup(1, "2024-02-01")[1])
+        self.session_mgr.db_manager.insert_many("prices", ["sec_id", "date", "unit_price"], [[1, "2024-01-31", 12.0]])
+        self.assertEqual(11.0, self.index.lookup(1, "2024-02-01")[1])
+        self.index.invalidate([1])
+        self.assertEqual(12.0, self.index.lookup(1, "2024-02-01")[1])
+
+    def test_get_closest_price(self):
+        result = self.session_mgr.get_closest_price([1, 2], datetime.datetime(2024, 1, 4))
+        self.assertEqual([10.0, 50.0], result["unit_price"].tolist())
+        self.session_mgr.add_entry("prices", {"sec_id": 2, "date": "2024-01-04", "unit_price": 51.0})
+        result = self.session_mgr.get_closest_price([(2, "2024-01-04")])
+        self.assertEqual([51.0], result["unit_price"].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,12 +2,16 @@ import unittest
 from unittest.mock import Mock, MagicMock, patch, call
 import os
 import random
+import subprocess
+import sys
 import datetime
 
 import pandas as pd
 
 import tools.request_builder
 from tools import request_builder
+from tools import fx
+from tests.session_test_case import SessionTestCase
 
 
 class TestSessionManager_with_default_values(unittest.TestCase):
@@ -16,21 +20,21 @@ class TestSessionManager_with_default_values(unittest.TestCase):
     def setUp(self, dbmanager_mock) -> None:
         dbmanager_mock.return_value = Mock()
         self.session_mgr = request_builder.SessionManager()
-        dbmanager_mock.assert_called_with(self.session_mgr.db_path)
+        dbmanager_mock.assert_called_with(self.session_mgr.db_path, profile=self.session_mgr.connection_profile)
 
     def test_default_values(self):
-        default_config = os.path.join("config", "default_db.yaml")
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(request_builder.__file__)))
+        default_config = os.path.join(package_dir, "config", "default_db.yaml")
         default_db_path = os.path.join("db", "accounts")
         self.assertEqual(self.session_mgr.default_db_config, default_config)
+        self.assertTrue(os.path.exists(default_config))
         self.assertEqual(self.session_mgr.db_path, default_db_path)
 
-    @patch('yaml.safe_load')
-    @patch('builtins.open')
-    def test_db_scheme(self, mock_open, mock_yaml):
-        mock_open.return_value.__enter__.return_value = "mocked_file"
+    @patch("tools.connections.load_yaml")
+    def test_db_scheme(self, load_yaml_mock):
         value = self.session_mgr.db_scheme()
-        mock_open.assert_called_with(self.session_mgr.default_db_config)
-        mock_yaml.assert_called_with("mocked_file")
+        load_yaml_mock.assert_called_with(self.session_mgr.default_db_config)
+        self.assertEqual(load_yaml_mock.return_value, value)
 
     def test_create_tables_from_scheme_dict(self):
         scheme_mock = {'database': {'name': 'accounts_db', 'tables': {'accounts': {'columns': [{'name': 'id', 'type': 'INTEGER', 'primary_key': True}, {'name': 'short_name', 'type': 'TEXT'}, {'name': 'provider', 'type': 'TEXT'}, {'name': 'active', 'type': 'INTEGER'}, {'name': 'change_date', 'type': 'TEXT'}]}, 'securities': {'columns': [{'name': 'sec_id', 'type': 'INTEGER', 'primary_key': True}, {'name': 'short_name', 'type': 'TEXT'}, {'name': 'full_name', 'type': 'TEXT'}, {'name': 'type', 'type': 'TEXT'}, {'name': 'subtype', 'type': 'TEXT'}]}, 'transactions': {'columns': [{'name': 'tr_id', 'type': 'INTEGER', 'primary_key': True}, {'name': 'sec_id', 'type': 'INTEGER'}, {'name': 'acc_id', 'type': 'INTEGER'}, {'name': 'date', 'type': 'TEXT'}, {'name': 'type', 'type': 'TEXT'}, {'name': 'quantity', 'type': 'INTEGER'}, {'name': 'unit_price', 'type': 'REAL'}, {'name': 'total_price', 'type': 'REAL'}, {'name': 'costs', 'type': 'REAL'}, {'name': 'currency', 'type': 'TEXT'}]}, 'fx_rates': {'columns': [{'name': 'nominator', 'type': 'TEXT'}, {'name': 'denominator', 'type': 'TEXT'}, {'name': 'rate', 'type': 'REAL'}, {'name': 'date', 'type': 'TEXT'}, {'name': 'source', 'type': 'TEXT'}, {'name': 'entry_date', 'type': 'TEXT'}]}, 'prices': {'columns': [{'name': 'sec_id', 'type': 'INTEGER'}, {'name': 'date', 'type': 'TEXT'}, {'name': 'unit_price', 'type': 'REAL'}, {'name': 'source', 'type': 'TEXT'}, {'name': 'entry_date', 'type': 'TEXT'}]}, 'holdings': {'columns': [{'name': 'acc_id', 'type': 'INTEGER'}, {'name': 'sec_id', 'type': 'INTEGER'}, {'name': 'account', 'type': 'TEXT'}, {'name': 'security', 'type': 'TEXT'}, {'name': 'date', 'type': 'TEXT'}, {'name': 'type', 'type': 'TEXT'}, {'name': 'subtype', 'type': 'TEXT'}, {'name': 'quantity', 'type': 'INTEGER'}, {'name': 'unit_price', 'type': 'REAL'}, {'name': 'total_price', 'type': 'REAL'}]}}}}
@@ -40,14 +44,22 @@ class TestSessionManager_with_default_values(unittest.TestCase):
             expected_calls.append(call(table, columns['columns']))
         self.session_mgr.db_manager.create_table.assert_has_calls(expected_calls)
 
-    @patch("tools.request_builder.SessionManager.create_tables_from_scheme_dict")
+    def test_import_leaves_charts_and_analysis_lazy(self):
+        # a fresh interpreter, this one has imported these modules through other tests already; the app
+        # imports tools.util and tools.request_builder, none of these are needed for its first page
+        lazy = ["altair", "tools.display", "tools.apis", "tools.cache", "tools.backfill", "tools.importer",
+                "tools.positions", "tools.holdings", "tools.prices", "tools.fx", "tools.timeseries"]
+        script = f"import sys, tools.util, tools.request_builder; print([name for name in {lazy!r} if name in sys.modules])"
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+        self.assertEqual("[]", output.stdout.strip())
+
     @patch("tools.request_builder.SessionManager.db_scheme")
-    def test_initiate_db(self, db_scheme_mock, create_tables_mock):
+    def test_initiate_db(self, db_scheme_mock):
         scheme_dict_mock = "scheme_dict_mock"
         db_scheme_mock.return_value = scheme_dict_mock
         self.session_mgr.initiate_db()
         db_scheme_mock.assert_called_with(self.session_mgr.default_db_config)
-        create_tables_mock.assert_called_with(scheme_dict_mock)
+        self.session_mgr.db_manager.create_db_from_schema.assert_called_with(scheme_dict_mock)
 
     def test_add_entry(self):
         now = datetime.datetime.now()
@@ -59,7 +71,7 @@ class TestSessionManager_with_default_values(unittest.TestCase):
         expected_values = [val for val in kwargs.values()]
         expected_columns = [col for col in kwargs.keys()]
         self.session_mgr.add_entry(type, kwargs)
-        self.session_mgr.db_manager.update_table.assert_called_with(expected_tbl_name, expected_values, expected_columns)
+        self.session_mgr.db_manager.insert_many.assert_called_with(expected_tbl_name, expected_columns, [expected_values])
 
     def test_add_entry_autotimestampp(self):
         now = datetime.datetime.now()
@@ -73,37 +85,58 @@ class TestSessionManager_with_default_values(unittest.TestCase):
         expected_columns = [col for col in kwargs.keys()] + timestamp_col
         self.session_mgr.add_entry(type, kwargs, timestamp_col)
         self.session_mgr.db_manager.to_dbtime.assert_any_call()
-        self.session_mgr.db_manager.update_table.assert_called_with(expected_tbl_name, expected_values, expected_columns)
+        self.session_mgr.db_manager.insert_many.assert_called_with(expected_tbl_name, expected_columns, [expected_values])
+
+    def test_add_entry_batch(self):
+        timestamp = datetime.datetime.now().isoformat()
+        self.session_mgr.db_manager.to_dbtime.return_value = timestamp
+        entries = [{"short_name": "acc1", "provider": "bank1"},
+                   {"short_name": "acc2", "provider": "bank2"}]
+        expected_rows = [["acc1", "bank1", timestamp], ["acc2", "bank2", timestamp]]
+        self.session_mgr.add_entry("accounts", entries, ["change_date"])
+        self.session_mgr.db_manager.to_dbtime.assert_called_once_with()
+        self.session_mgr.db_manager.insert_many.assert_called_once_with(
+            "accounts", ["short_name", "provider", "change_date"], expected_rows)
+
+    def test_add_entry_batch_keys_in_any_order(self):
+        entries = [{"short_name": "acc1", "provider": "bank1"},
+                   {"provider": "bank2", "short_name": "acc2"}]
+        self.session_mgr.add_entry("accounts", entries)
+        self.session_mgr.db_manager.insert_many.assert_called_once_with(
+            "accounts", ["short_name", "provider"], [["acc1", "bank1"], ["acc2", "bank2"]])
+        with self.assertRaises(ValueError):
+            self.session_mgr.add_entry("accounts", [{"short_name": "acc1", "provider": "bank1"},
+                                                    {"short_name": "acc2"}])
+        self.session_mgr.db_manager.insert_many.assert_called_once()
 
-    def test_update_positions(self):
-        input_id = 1
-        input_filter = {'acc_id': 1}
+    @patch("tools.positions.PositionEngine")
+    def test_update_positions(self, engine_mock):
         date = datetime.datetime(2024, 6, 1)
-        mock_transactions_dict = data = {
-            'tr_id': [1, 2, 3, 4, 5, 6],
-            'sec_id': [11, 11, 102, 103, 102, 11],
-            'acc_id': [1, 1, 1, 1, 1, 1],
-            'date': ['2023-01-10', '2023-02-15', '2023-03-20', '2023-04-25', '2023-05-30', '2023-06-15'],
-            'type': ['buy', 'buy', 'buy', 'buy', 'buy', 'sell'],
-            'quantity': [10, 20, 5, 15, 10, -25],
-            'unit_price': [100.0, 105.0, 110.0, 115.0, 120.0, 125.0],
-            'total_price': [1000.0, 2100.0, 550.0, 1725.0, 1200.0, 3125.0],
-            'costs': [10.0, 20.0, 5.0, 15.0, 10.0, 25.0],
-            'currency': ['USD', 'USD', 'USD', 'USD', 'USD', 'USD'],
-            'recorded_date': ['2023-01-11', '2023-02-16', '2023-03-21', '2023-04-26', '2023-05-31', '2023-06-16']
-        }
-        mock_transactions_df = pd.DataFrame(mock_transactions_dict)
-        expected_dbtime_calls = [call(date)] * 3
-        self.session_mgr.db_manager.to_dbtime.return_value = "mock_dbtime"
-        expected_update_table_calls = [call(self.session_mgr.tables["positions"], ['mock_dbtime', 1, 11, 5]),
-                                       call(self.session_mgr.tables["positions"], ['mock_dbtime', 1, 102, 15]),
-                                       call(self.session_mgr.tables["positions"], ['mock_dbtime', 1, 103, 15])]
-        self.session_mgr.db_manager.read_table.return_value = mock_transactions_df
-        expected_df = pd.DataFrame(mock_transactions_dict)
-        self.session_mgr.update_positions(input_id, date)
-        self.session_mgr.db_manager.to_dbtime.assert_has_calls(expected_dbtime_calls)
-        self.session_mgr.db_manager.read_table.assert_called_with(self.session_mgr.tables["transactions"], filters=input_filter)
-        self.session_mgr.db_manager.update_table.assert_has_calls(expected_update_table_calls)
+        engine = engine_mock.return_value
+        engine.changed_from = "2024-06-01T00:00:00"
+        with patch.object(self.session_mgr, "refresh_holdings") as refresh_mock:
+            snapshot = self.session_mgr.update_positions(1, date)
+        engine_mock.assert_called_once_with(self.session_mgr.db_manager, self.session_mgr.tables)
+        engine.update.assert_called_once_with(1, date)
+        engine.reset.assert_not_called()
+        self.assertIs(engine.update.return_value, snapshot)
+        refresh_mock.assert_called_once_with(acc_ids=[1], since="2024-06-01T00:00:00")
+        # nothing written, nothing to refresh
+        engine.changed_from = None
+        with patch.object(self.session_mgr, "refresh_holdings") as refresh_mock:
+            self.session_mgr.refresh_positions(1, date)
+        refresh_mock.assert_not_called()
+
+    @patch("tools.positions.PositionEngine")
+    def test_update_positions_from_transaction_date(self, engine_mock):
+        self.session_mgr.db_manager.to_dbtime.return_value = "2024-01-01T00:00:00"
+        engine = engine_mock.return_value
+        engine.changed_from = "2024-06-01T00:00:00"
+        with patch.object(self.session_mgr, "refresh_holdings") as refresh_mock:
+            self.session_mgr.update_positions(1, datetime.datetime(2024, 6, 1), datetime.datetime(2024, 1, 1))
+        self.session_mgr.db_manager.to_dbtime.assert_called_once_with(datetime.datetime(2024, 1, 1))
+        engine.reset.assert_called_once_with(1, "2024-01-01T00:00:00")
+        refresh_mock.assert_called_once_with(acc_ids=[1], since="2024-01-01T00:00:00")
 
     def test_communicate_table_attributes(self):
         db_return_value = pd.DataFrame({'type': {0: 'table', 1: 'table', 2: 'table', 3: 'table', 4: 'table', 5: 'table', 6: 'table', 7: 'table'},
@@ -146,6 +179,120 @@ class TestSessionManager_with_default_values(unittest.TestCase):
 
 
 
+class TestSessionManager_with_db(SessionTestCase):
+
+    def test_config_found_from_other_directory(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        try:
+            session_mgr = request_builder.SessionManager(init_db_manager=False)
+            self.assertEqual("WAL", session_mgr.connection_profile["journal_mode"])
+            session_mgr.initiate_db("other_db")
+            self.assertIn("transactions", session_mgr.list_of_tables_in_db())
+            session_mgr.close()
+        finally:
+            os.chdir(cwd)
+
+    def test_check_query_plans(self):
+        results = self.session_mgr.check_query_plans()
+        self.assertEqual(set(request_builder.HOT_QUERIES.keys()), set(results.keys()))
+        for name, result in results.items():
+            self.assertTrue(result["uses_index"], f"{name}: {result['plan']}")
+
+    def test_check_query_plans_full_scan(self):
+        queries = {"no_index": ("SELECT * FROM holdings WHERE account = ?", ["acc"])}
+        results = self.session_mgr.check_query_plans(queries)
+        self.assertFalse(results["no_index"]["uses_index"])
+
+    def add_portfolio(self):
+        self.session_mgr.add_entry("accounts", [{"id": 1, "short_name": "acc1"}, {"id": 2, "short_name": "acc2"}])
+        self.session_mgr.add_entry("securities", [{"sec_id": 10, "short_name": "SP500", "type": "ETF"},
+                                                  {"sec_id": 11, "short_name": "BOND", "type": "Bond"},
+                                                  {"sec_id": 12, "short_name": "DAX", "type": "ETF"}])
+        self.session_mgr.add_entry("transactions", [
+            {"sec_id": 10, "acc_id": 1, "date": "2024-01-02", "quantity": 10, "currency": "USD"},
+            {"sec_id": 11, "acc_id": 1, "date": "2024-01-02", "quantity": 5, "currency": "HUF"},
+            {"sec_id": 10, "acc_id": 2, "date": "2024-01-03", "quantity": 2, "currency": "USD"},
+            {"sec_id": 12, "acc_id": 2, "date": "2024-01-03", "quantity": 4, "currency": "EUR"}])
+        self.session_mgr.add_entry("prices", [{"sec_id": 10, "date": "2024-01-02", "unit_price": 100.0},
+                                              {"sec_id": 10, "date": "2024-01-20", "unit_price": 999.0},
+                                              {"sec_id": 11, "date": "2024-01-01", "unit_price": 10000.0},
+                                              {"sec_id": 12, "date": "2024-01-03", "unit_price": 50.0}])
+        self.session_mgr.add_entry("fx_rates", [{"nominator": "EUR", "denominator": "USD", "rate": 1.25, "date": "2024-01-01"},
+                                                {"nominator": "EUR", "denominator": "HUF", "rate": 400.0, "date": "2024-01-01"}])
+        for acc_id in (1, 2):
+            self.session_mgr.refresh_positions(acc_id, datetime.datetime(2024, 1, 5))
+
+    def test_aggregate_accounts(self):
+        self.add_portfolio()
+        valued = self.session_mgr.aggregate_accounts(datetime.datetime(2024, 1, 10)).sort_values(["acc_id", "sec_id"])
+        self.assertEqual([1000.0, 50000.0, 200.0, 200.0], valued["market_value"].tolist())
+        self.assertEqual([800.0, 125.0, 160.0, 200.0], valued["base_value"].tolist())
+        valued = self.session_mgr.aggregate_accounts(datetime.datetime(2024, 1, 10), account=2)
+        self.assertEqual({10, 12}, set(valued["sec_id"]))
+
+    def test_generate_summary(self):
+        self.add_portfolio()
+        summary = self.session_mgr.generate_summary(datetime.datetime(2024, 1, 10)).set_index(["account", "type", "currency"])
+        self.assertEqual(925.0, summary.loc[("acc1", "All", "All"), "base_value"])
+        self.assertEqual(1160.0, summary.loc[("All", "ETF", "All"), "base_value"])
+        self.assertEqual(1200.0, summary.loc[("All", "All", "USD"), "market_value"])
+        self.assertEqual(1285.0, summary.loc[("All", "All", "All"), "base_value"])
+        self.assertEqual(4, summary.loc[("All", "All", "All"), "positions"])
+        self.assertEqual(["EUR"], summary["base_currency"].unique().tolist())
+
+    def test_positions_without_value(self):
+        self.add_portfolio()
+        self.session_mgr.add_entry("securities", [{"sec_id": 13, "short_name": "NIKKEI", "type": "ETF"},
+                                                  {"sec_id": 14, "short_name": "NEW", "type": "Bond"}])
+        self.session_mgr.add_entry("transactions", [
+            {"sec_id": 13, "acc_id": 1, "date": "2024-01-04", "quantity": 1, "currency": "JPY"},
+            {"sec_id": 14, "acc_id": 1, "date": "2024-01-04", "quantity": 1, "currency": "EUR"}])
+        self.session_mgr.add_entry("prices", {"sec_id": 13, "date": "2024-01-04", "unit_price": 30000.0})
+        self.session_mgr.refresh_positions(1, datetime.datetime(2024, 1, 5))
+        valued = self.session_mgr.aggregate_accounts(datetime.datetime(2024, 1, 10), account=1).set_index("sec_id")
+        self.assertEqual(["", "", "fx_rate", "price"], valued.loc[[10, 11, 13, 14], "missing"].fillna("").tolist())
+        self.assertEqual("2024-01-04", fx.date_key(valued.at[13, "price_date"]))
+        self.assertTrue(pd.isna(valued.at[14, "price_date"]))
+        # the as-of prices come from the price index
+        self.assertIn(13, self.session_mgr.price_index())
+        with self.assertLogs("tools.request_builder", "WARNING") as logs:
+            summary = self.session_mgr.generate_summary(datetime.datetime(2024, 1, 10))
+        self.assertIn("sec_id 13 (fx_rate), sec_id 14 (price)", logs.output[0])
+        summary = summary.set_index(["account", "type", "currency"])
+        self.assertEqual(2, summary.loc[("acc1", "All", "All"), "unvalued"])
+        self.assertEqual(925.0, summary.loc[("acc1", "All", "All"), "base_value"])
+        self.assertEqual(1, summary.loc[("All", "All", "JPY"), "unvalued"])
+        self.assertEqual(0, summary.loc[("All", "All", "USD"), "unvalued"])
+
+    def test_form_config(self):
+        parsed_config, restricted = self.session_mgr.form_config("transactions")
+        self.assertEqual({"sec_id": "INTEGER", "acc_id": "INTEGER", "date": "DATE", "type": "TEXT",
+                          "quantity": "INTEGER", "unit_price": "REAL", "total_price": "REAL", "costs": "REAL",
+                          "currency": "TEXT", "recorded_date": "DATE",
+                          "FOREIGN KEY(sec_id)": "REFERENCES securities(sec_id)",
+                          "FOREIGN KEY(acc_id)": "REFERENCES accounts(id)"}, parsed_config)
+        self.assertEqual({"sec_id": {"securities": "sec_id"}, "acc_id": {"accounts": "id"}}, restricted)
+        # composite primary key columns stay in the form
+        self.assertIn("sec_id", self.session_mgr.form_config("prices")[0])
+
+    def test_schema_cache_invalidation(self):
+        with patch.object(self.session_mgr, "_table_metadata", wraps=self.session_mgr._table_metadata) as build_mock:
+            self.session_mgr.table_metadata()
+            self.session_mgr.table_metadata("accounts")
+            self.assertEqual(1, build_mock.call_count)
+            self.session_mgr.db_manager.create_table("new_table", [{"name": "col1", "type": "TEXT"}])
+            metadata = self.session_mgr.table_metadata()
+            self.assertEqual(2, build_mock.call_count)
+        self.assertEqual([{"name": "col1", "type": "TEXT", "notnull": False, "pk": 0}],
+                         metadata["new_table"]["columns"])
+        self.assertIn("new_table", self.session_mgr.list_of_tables_in_db())
+
+    def test_communicate_table_attributes_skips_indexes(self):
+        schema = self.session_mgr.communicate_table_attributes("prices")
+        self.assertEqual({"prices": "sec_id INTEGER, date TEXT, unit_price REAL, source TEXT, entry_date TEXT, "
+                                    "PRIMARY KEY (sec_id, date)"}, schema)
+
 
 if __name__ == '__main__':
     unittest.main()
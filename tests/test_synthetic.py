@@ -0,0 +1,40 @@
+import unittest
+
+from tools import request_builder
+from tools import synthetic
+from tests.session_test_case import SessionTestCase
+
+
+class TestSyntheticData(SessionTestCase):
+    db_name = None
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.scale = synthetic.Scale(accounts=3, securities=7, transactions=2500, start="2023-01-02", end="2023-03-31")
+
+    def build(self, name: str, seed: int = 0) -> request_builder.SessionManager:
+        session_mgr = self.open_session(name)
+        self.counts = synthetic.SyntheticData(session_mgr, self.scale, seed, chunksize=1000).generate()
+        return session_mgr
+
+    def test_row_counts(self):
+        session_mgr = self.build("db")
+        business_days = 65
+        self.assertEqual({"accounts": 3, "securities": 7, "fx_rates": 4 * business_days,
+                          "prices": 7 * business_days, "transactions": 2500}, self.counts)
+        transactions = session_mgr.read("transactions")
+        self.assertTrue(transactions["date"].is_monotonic_increasing)
+        self.assertTrue(set(transactions["acc_id"]) <= {1, 2, 3})
+        self.assertTrue(set(transactions["currency"]) <= set(synthetic.CURRENCIES))
+        self.assertEqual(["buy", "sell"], sorted(transactions["type"].unique()))
+
+    def test_seeded(self):
+        first = self.build("first", seed=1).read("transactions")
+        again = self.build("again", seed=1).read("transactions")
+        other = self.build("other", seed=2).read("transactions")
+        self.assertTrue(first.equals(again))
+        self.assertFalse(first.equals(other))
+
+
+if __name__ == '__main__':
+    unittest.main()
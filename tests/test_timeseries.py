@@ -0,0 +1,72 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from tools import timeseries
+from tools.timeseries import PortfolioHistory
+from tests.session_test_case import SessionTestCase
+
+
+class TestPortfolioHistory(SessionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.session_mgr.add_entry("accounts", [{"id": 1, "short_name": "acc1"}, {"id": 2, "short_name": "acc2"}])
+        self.session_mgr.add_entry("securities", [{"sec_id": 10}, {"sec_id": 11}])
+        self.session_mgr.add_entry("transactions", [
+            {"sec_id": 10, "acc_id": 1, "date": "2024-01-01", "quantity": 10, "currency": "USD"},
+            {"sec_id": 10, "acc_id": 1, "date": "2024-01-03", "quantity": -4, "currency": "USD"},
+            {"sec_id": 11, "acc_id": 2, "date": "2024-01-02", "quantity": 1, "currency": "EUR"}])
+        self.session_mgr.add_entry("prices", [{"sec_id": 10, "date": "2023-12-29", "unit_price": 100.0},
+                                              {"sec_id": 10, "date": "2024-01-03", "unit_price": 200.0},
+                                              {"sec_id": 11, "date": "2024-01-02", "unit_price": 50.0}])
+        self.session_mgr.add_entry("fx_rates", [{"nominator": "EUR", "denominator": "USD", "rate": 2.0,
+                                                 "date": "2023-12-01"}])
+        self.history = PortfolioHistory(self.session_mgr.db_manager, self.session_mgr.tables, pivot="EUR")
+
+    def test_values(self):
+        values = self.history.values(end=datetime.date(2024, 1, 4), base_currency="EUR")
+        expected = pd.DataFrame({1: [500.0, 500.0, 600.0, 600.0], 2: [0.0, 50.0, 50.0, 50.0]},
+                                index=pd.date_range("2024-01-01", "2024-01-04", freq="D", name="date"))
+        expected["total"] = expected.sum(axis=1)
+        pd.testing.assert_frame_equal(expected, values, check_names=False, check_column_type=False)
+
+    def test_values_start_after_transactions(self):
+        values = self.history.values(start=datetime.date(2024, 1, 3), end=datetime.date(2024, 1, 3),
+                                     base_currency="USD", acc_ids=[1])
+        self.assertEqual([1200.0], values["total"].tolist())
+
+    def test_values_in_chunks_of_securities(self):
+        expected = self.history.values(end=datetime.date(2024, 1, 4))
+        with patch.object(timeseries, "CHUNK_SECURITIES", 1):
+            pd.testing.assert_frame_equal(expected, self.history.values(end=datetime.date(2024, 1, 4)))
+
+    def test_rates_change_and_chain_of_quotes(self):
+        # GBP is only quoted against USD, the rate to EUR goes GBP -> USD -> EUR
+        self.session_mgr.add_entry("securities", {"sec_id": 12})
+        self.session_mgr.add_entry("transactions", {"sec_id": 12, "acc_id": 2, "date": "2024-01-01", "quantity": 1,
+                                                    "currency": "GBP"})
+        self.session_mgr.add_entry("prices", {"sec_id": 12, "date": "2024-01-01", "unit_price": 10.0})
+        self.session_mgr.add_entry("fx_rates", [{"nominator": "GBP", "denominator": "USD", "rate": 1.5,
+                                                 "date": "2023-12-01"},
+                                                {"nominator": "EUR", "denominator": "USD", "rate": 3.0,
+                                                 "date": "2024-01-03"}])
+        values = self.history.values(end=datetime.date(2024, 1, 4), acc_ids=[2])
+        self.assertEqual([7.5, 57.5, 55.0, 55.0], values[2].tolist())
+
+    def test_values_no_transactions(self):
+        self.session_mgr.db_manager.remove_from_table("transactions", "1 = 1")
+        self.assertTrue(self.history.values(end=datetime.date(2024, 1, 4)).empty)
+
+    def test_generate_chart(self):
+        chart = self.session_mgr.generate_chart(end=datetime.date(2024, 1, 4))
+        self.assertEqual("bar", chart.mark)
+        self.assertEqual({"acc1", "acc2"}, set(chart.data["account"]))
+        chart = self.session_mgr.generate_chart("allocation")
+        self.assertEqual("arc", chart.mark)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -41,6 +41,13 @@ class TestUtil(unittest.TestCase):
         output = util.parse_column_config(input_dict, "transactions")
         self.assertEqual(expected_output, output)
 
+    def test_parse_column_config_composite_key(self):
+        input_dict = {"prices": "sec_id INTEGER, date TEXT, unit_price REAL, PRIMARY KEY (sec_id, date), "
+                                "UNIQUE (date, sec_id)"}
+        expected_output = {"sec_id": "INTEGER", "date": "DATE", "unit_price": "REAL"}
+        output = util.parse_column_config(input_dict, "prices")
+        self.assertEqual(expected_output, output)
+
     def test_restricted_column_options(self):
         # case: No foreign key requirement
         input_table_config_1 = {'short_name': 'TEXT', 'provider': 'TEXT', 'active': 'INTEGER', 'change_date': 'DATE'}
@@ -60,43 +67,31 @@ class TestUtil(unittest.TestCase):
 
     def test_option_list_from_table_values(self):
         session_mngr_mock = MagicMock()
+        session_mngr_mock.tables = {"my_test_table": "my_test_table"}
         table = "my_test_table"
         column = "test_column"
 
         # case: table is empty -> no optional values available
-        session_mngr_mock.read.return_value = pd.DataFrame()
-        expected_1 = [f"No selectable values found in table '{table}'"]
+        session_mngr_mock.lookup_options.return_value = {}
+        expected_1 = {f"No selectable values found in table '{table}'": None}
         output_1 = util.option_list_from_table_values(session_mngr_mock, table, column)
         self.assertEqual(expected_1, output_1)
+        session_mngr_mock.lookup_options.assert_called_with(table, column, search="", limit=100)
 
-        # case: There is one optional value
-        columns = ["id", "short_name", "long_name", "test_column"]
-        values = [1, "my_security", "security_long_name_here", "VALUE1"]
-        session_mngr_mock.read.return_value = pd.DataFrame([values], columns=columns)
-        expected_2 = {' - '.join(f"{value}" for value in values): values[-1]}
-        output_2 = util.option_list_from_table_values(session_mngr_mock, table, column)
+        # case: nothing matches the search term
+        expected_2 = {f"No values matching 'xyz' found in table '{table}'": None}
+        output_2 = util.option_list_from_table_values(session_mngr_mock, table, column, search="xyz", limit=20)
         self.assertEqual(expected_2, output_2)
+        session_mngr_mock.lookup_options.assert_called_with(table, column, search="xyz", limit=20)
 
-        # case: Multiple optional values
-        columns = ["id", "short_name", "long_name", "test_column"]
-        values = [[1, "my_security", "security_long_name_here", "VALUE1"],
-                  [2, "my_security_2", "security_long_name_here_2", "VALUE2"]]
-        session_mngr_mock.read.return_value = pd.DataFrame(values, columns=columns)
-        expected_3 = {}
-        for value in values:
-            key = ' - '.join(f"{val}" for val in value)
-            expected_3[key] = value[-1]
-        output_3 = util.option_list_from_table_values(session_mngr_mock, table, column)
-        self.assertEqual(expected_3, output_3)
-
-    @patch("tools.util.restricted_column_options")
-    @patch("tools.util.parse_column_config")
-    def test_build_form_configs(self, parse_columns_mock, restricted_col_opt_mock):
+        # case: options come from the lookup service as they are
+        options = {"1 - my_security": 1, "2 - my_security_2": 2}
+        session_mngr_mock.lookup_options.return_value = options
+        output_3 = util.option_list_from_table_values(session_mngr_mock, table, column, search="my")
+        self.assertEqual(options, output_3)
+
+    def test_build_form_configs(self):
         session_mngr_mock = MagicMock()
-        table_config = {'accounts':
-                        'id INTEGER PRIMARY KEY, short_name TEXT, provider TEXT, sec_id TEXT, active INTEGER, change_date TEXT,'
-                        'FOREIGN KEY(sec_id) REFERENCES securities(sec_id)'}
-        session_mngr_mock.communicate_table_attributes.return_value = table_config
         table_name = "test_table"
         parsed_config = {"short_name": "TEXT",
                          "sec_id": "TEXT",
@@ -104,22 +99,13 @@ class TestUtil(unittest.TestCase):
                          "active": "INTEGER",
                          "change_date": "DATE",
                          "FOREIGN KEY(sec_id)": "REFERENCES securities(sec_id)"}
-        parse_columns_mock.return_value = parsed_config
-        restricted_col_opt_mock.return_value = {'sec_id': {'securities': 'sec_id'}}
-        expected = (
-            {"short_name": "TEXT",
-             "sec_id": "TEXT",
-             "provider": "TEXT",
-             "active": "INTEGER",
-             "change_date": "DATE",
-             "FOREIGN KEY(sec_id)": "REFERENCES securities(sec_id)"},
-            {'sec_id': {'securities': 'sec_id'}})
+        restricted_value_columns = {'sec_id': {'securities': 'sec_id'}}
+        session_mngr_mock.form_config.return_value = parsed_config, restricted_value_columns
 
         output = util.build_form_configs(table_name, session_mngr_mock)
 
-        parse_columns_mock.assert_called_with(table_config, table_name)
-        restricted_col_opt_mock.assert_called_with(parsed_config)
-        self.assertEqual(expected, output)
+        session_mngr_mock.form_config.assert_called_with(table_name)
+        self.assertEqual((parsed_config, restricted_value_columns), output)
 
     @patch("tools.util.option_list_from_table_values")
     def test_build_val_column_selection(self, option_list_from_tbl_mock):
@@ -132,7 +118,7 @@ class TestUtil(unittest.TestCase):
 
         output = util.build_val_column_selection(restricted_value_columns, column, session_mngr_mock)
 
-        option_list_from_tbl_mock.assert_called_with(session_mngr_mock, "securities", "sec_id")
+        option_list_from_tbl_mock.assert_called_with(session_mngr_mock, "securities", "sec_id", search="")
         self.assertEqual((options_from_tbl, expected_display), output)
 
     # @patch("tools.util.restricted_column_options")
@@ -183,12 +169,28 @@ class TestUtil(unittest.TestCase):
         # Asserts
         streamlit_mock.text_input.assert_has_calls(expected_calls)
         build_form_conf_mock.assert_called_with(table_name, session_mngr_mock)
-        build_val_mock.assert_called_with(restricted_value_columns, "sec_id", session_mngr_mock)
+        build_val_mock.assert_called_with(restricted_value_columns, "sec_id", session_mngr_mock, search="")
         streamlit_mock.date_input.assert_called_with("change_date")
         streamlit_mock.selectbox.assert_called_with("sec_id", display_options)
         streamlit_mock.form_submit_button.assert_called_with(submit_text)
         self.assertEqual(expected, actual)
 
+    @patch("tools.util.build_form_configs")
+    @patch("tools.util.build_val_column_selection")
+    @patch("tools.util.st")
+    def test_formfactory_blocks_empty_foreign_key(self, streamlit_mock, build_val_mock, build_form_conf_mock):
+        build_form_conf_mock.return_value = ({"sec_id": "INTEGER", "quantity": "INTEGER",
+                                              "FOREIGN KEY(sec_id)": "REFERENCES securities(sec_id)"},
+                                             {"sec_id": {"securities": "sec_id"}})
+        placeholder = "No values matching 'zzz' found in table 'securities'"
+        build_val_mock.return_value = {placeholder: None}, [placeholder]
+        streamlit_mock.selectbox.return_value = placeholder
+        streamlit_mock.text_input.return_value = "5"
+        streamlit_mock.form_submit_button.return_value = True
+        self.assertIsNone(util.formfactory("transactions", "Record Trade", MagicMock(), {"sec_id": "zzz"}))
+        streamlit_mock.error.assert_called_once()
+        self.assertIn("sec_id", streamlit_mock.error.call_args.args[0])
+
     def test_restricted_column_options(self):
         test_config = {"id": "INTEGER PRIMARY KEY",
                        "short_name": "TEXT",
@@ -208,20 +210,19 @@ class TestUtil(unittest.TestCase):
     def test_columns_value_options_from_db(self):
         session_mngr_mock = MagicMock()
         session_mngr_mock.tables = {"types": "types_test"}
-        mock_df = pd.DataFrame({"category": ["some_settings", "types_col_values", "types_col_values",
-                                             "types_col_values", "types_col_values"],
-                                "option": ["some_option", "currency", "currency", "active", "active"],
-                                "value": ["some_value", "USD", "HUF", "True", "False"]})
-        session_mngr_mock.read.return_value = mock_df
+        session_mngr_mock.read.return_value = pd.DataFrame({"value": ["USD", "HUF"]})
 
         expected_options = ["USD", "HUF"]
         options = util.columns_value_options_from_db("types", "currency", session_mngr_mock)
-        session_mngr_mock.read.assert_called_with("types_test")
+        session_mngr_mock.read.assert_called_with("types_test", columns=["value"],
+                                                  filters={"category": "types_col_values", "option": "currency"})
         self.assertEqual(expected_options, options)
 
+        session_mngr_mock.read.return_value = pd.DataFrame({"value": []})
         expected_options = []
         options = util.columns_value_options_from_db("types", "quantity", session_mngr_mock)
-        session_mngr_mock.read.assert_called_with("types_test")
+        session_mngr_mock.read.assert_called_with("types_test", columns=["value"],
+                                                  filters={"category": "types_col_values", "option": "quantity"})
         self.assertEqual(expected_options, options)
 
 
@@ -304,20 +305,37 @@ class TestUtil(unittest.TestCase):
         mock_edit_table.assert_called_once()
         mock_append_table.assert_called_once()
 
-    @patch("tools.util.st.dataframe")
-    @patch("tools.util.st.session_state")
-    def test_show_table(self, streamlit_session_state_mock, streamlit_df_mock):
-        values = {"Browse-Show": "Mock_some_table_name"}
-        streamlit_session_state_mock.__getitem__.side_effect = values.__getitem__
+    @patch("tools.util.st")
+    def test_show_table(self, streamlit_mock):
+        streamlit_mock.session_state = {"Browse-Show": "Mock_some_table_name"}
+        streamlit_mock.multiselect.return_value = ["id", "name"]
+        streamlit_mock.selectbox.return_value = "name"
+        streamlit_mock.checkbox.return_value = False
+        streamlit_mock.columns.return_value = (MagicMock(), MagicMock())
+        streamlit_mock.form_submit_button.return_value = False
         session_mngr_mock = MagicMock()
-        read_return_value = "Mock_read_return"
-        session_mngr_mock.read.return_value = "Mock_read_return"
+        session_mngr_mock.table_columns.return_value = ["id", "name", "value"]
+        first_page = MagicMock(rows="Mock_page_1", last=("b", 2), has_next=True)
+        second_page = MagicMock(rows="Mock_page_2", last=("c", 3), has_next=False)
+        session_mngr_mock.read_page.side_effect = [first_page, second_page, first_page]
 
         util.show_table(session_mngr_mock)
+        session_mngr_mock.read_page.assert_called_with("Mock_some_table_name", ["id", "name"], "name", False,
+                                                       after=None, page_size=100)
+        streamlit_mock.dataframe.assert_called_with("Mock_page_1")
 
-        streamlit_session_state_mock.__getitem__.assert_called_with("Browse-Show")
-        session_mngr_mock.read.assert_called_with(values["Browse-Show"])
-        streamlit_df_mock.assert_called_with(read_return_value)
+        # "Next page" continues after the last row of the shown page
+        streamlit_mock.form_submit_button.side_effect = [False, True]
+        util.show_table(session_mngr_mock)
+        session_mngr_mock.read_page.assert_called_with("Mock_some_table_name", ["id", "name"], "name", False,
+                                                       after=("b", 2), page_size=100)
+        streamlit_mock.dataframe.assert_called_with("Mock_page_2")
+
+        # "Previous page" goes back to the stored cursor of the first page
+        streamlit_mock.form_submit_button.side_effect = [True, False]
+        util.show_table(session_mngr_mock)
+        session_mngr_mock.read_page.assert_called_with("Mock_some_table_name", ["id", "name"], "name", False,
+                                                       after=None, page_size=100)
 
     @patch("tools.util.st.write")
     @patch("tools.util.formfactory")
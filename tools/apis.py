@@ -1,14 +1,330 @@
-""" """
+"""Market data fetching through pluggable providers
+
+apiHandler splits the requested symbols into batches of the provider's max_batch_size and runs them
+as asyncio tasks, at most max_concurrency in flight and spaced by the provider's rate limit. Batches
+failing with a TransientProviderError are retried with exponential backoff. Fetched prices and FX
+rates are written to the prices / fx_rates tables with one batched insert per call.
+
+With a QuoteCache, quotes already stored in the database or the cache and still within the TTL of
+their instrument type are served from there and only the rest is requested from the provider.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import random
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, Awaitable, Callable
+
+import pandas as pd
+
+from tools.cache import QuoteCache
+from tools.dbtools import dbManager
+from tools.fx import date_key
+from tools.prices import MAX_QUERY_PARAMS
+from tools.request_builder import SessionManager
+
+logger = logging.getLogger(__name__)
+
+
+def run_sync(coroutine: Awaitable) -> object:
+    """asyncio.run that also works where an event loop is running already (notebooks, async callers)
+
+    asyncio.run refuses to start inside a running loop, the coroutine then runs on a loop of its own in
+    a worker thread while the caller waits for it.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+class ProviderError(Exception):
+    """Request failed for good, e.g. unknown symbols or a rejected API key"""
+
+
+class TransientProviderError(ProviderError):
+    """Request may succeed when retried, e.g. timeouts or HTTP 429/5xx"""
+
+
+class RateLimiter:
+    """Spaces calls at least 1 / rate seconds apart, shared by every event loop using the provider"""
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    async def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class Provider:
+    """Interface of a market data source
+
+    fetch_prices returns {symbol: price} and fetch_fx_rates {(nominator, denominator): rate} for the
+    symbols / pairs it knows, as of date. Both get at most max_batch_size items per call.
+    """
+    name = "provider"
+    max_batch_size = 50
+    max_concurrency = 4
+    requests_per_second = 5.0
+
+    def __init__(self) -> None:
+        self.limiter = RateLimiter(self.requests_per_second)
+
+    async def fetch_prices(self, symbols: list, date: pd.Timestamp) -> dict:
+        raise NotImplementedError
+
+    async def fetch_fx_rates(self, pairs: list, date: pd.Timestamp) -> dict:
+        raise NotImplementedError
+
+    async def fetch_history(self, requests: list) -> dict:
+        """{(symbol, start, end): {"YYYY-MM-DD": price}} for (symbol, start, end) requests, bounds included"""
+        raise NotImplementedError
+
+    async def check_ids(self, symbols: list) -> dict:
+        """{symbol: known} for symbols"""
+        prices = await self.fetch_prices(symbols, pd.Timestamp.today().normalize())
+        return {symbol: symbol in prices for symbol in symbols}
+
+
+class FakeProvider(Provider):
+    """In-process provider for tests and benchmarks
+
+    Prices are derived from a hash of symbol and date so repeated runs agree. Every call waits
+    latency seconds, fails with a TransientProviderError with probability failure_rate, and symbols
+    in unknown are never returned.
+    """
+    name = "fake"
+
+    def __init__(self, latency: float = 0.01, failure_rate: float = 0.0, max_batch_size: int = 100,
+                 max_concurrency: int = 8, requests_per_second: float = 0.0, unknown: Optional[set] = None,
+                 seed: int = 0) -> None:
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        super().__init__()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.unknown = unknown if unknown else set()
+        self.holidays = set()
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @staticmethod
+    def value(key: str, date: pd.Timestamp, low: float, high: float) -> float:
+        fraction = zlib.crc32(f"{key}|{date:%Y-%m-%d}".encode()) / 0xFFFFFFFF
+        return round(low + fraction * (high - low), 4)
+
+    async def _request(self, keys: list, value: Callable[[object], float]) -> dict:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.random.random() < self.failure_rate:
+                raise TransientProviderError(f"{self.name}: simulated timeout")
+            return {key: value(key) for key in keys if key not in self.unknown}
+        finally:
+            self.in_flight -= 1
+
+    async def fetch_prices(self, symbols: list, date: pd.Timestamp) -> dict:
+        return await self._request(symbols, lambda symbol: self.value(symbol, date, 1, 500))
+
+    async def fetch_fx_rates(self, pairs: list, date: pd.Timestamp) -> dict:
+        return await self._request(pairs, lambda pair: self.value("/".join(pair), date, 0.5, 2))
+
+    async def fetch_history(self, requests: list) -> dict:
+        """Business day prices, days in holidays are left out like a closed exchange would"""
+        def history(request: tuple) -> dict:
+            symbol, start, end = request
+            if symbol in self.unknown:
+                return {}
+            return {f"{day:%Y-%m-%d}": self.value(symbol, day, 1, 500) for day in pd.bdate_range(start, end)
+                    if f"{day:%Y-%m-%d}" not in self.holidays}
+        return await self._request(requests, history)
+
+
+@dataclass
+class FetchStats:
+    requested: int = 0
+    fetched: int = 0
+    requests: int = 0
+    retries: int = 0
+    failed: list = field(default_factory=list)
+    seconds: float = 0.0
 
 
 class apiHandler:
-    raise NotImplemented
+    def __init__(self, session_mgr: SessionManager, provider: Provider, max_concurrency: Optional[int] = None,
+                 retries: int = 3, backoff: float = 0.5, batch_size: Optional[int] = None,
+                 cache: Optional[QuoteCache] = None) -> None:
+        self.session_mgr = session_mgr
+        self.provider = provider
+        self.cache = cache
+        self.max_concurrency = max_concurrency if max_concurrency else provider.max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_size = min(batch_size, provider.max_batch_size) if batch_size else provider.max_batch_size
+        self.last_stats = FetchStats()
+
+    @property
+    def db_manager(self) -> dbManager:
+        return self.session_mgr.db_manager
+
+    async def _call(self, request: Callable[[list], Awaitable[dict]], batch: list, semaphore: asyncio.Semaphore,
+                    stats: FetchStats) -> dict:
+        for attempt in range(self.retries + 1):
+            async with semaphore:
+                await self.provider.limiter.acquire()
+                stats.requests += 1
+                try:
+                    return await request(batch)
+                except TransientProviderError as error:
+                    if attempt == self.retries:
+                        logger.warning(f"{self.provider.name}: giving up on {len(batch)} items after "
+                                       f"{attempt + 1} attempts: {error}")
+                        break
+                except ProviderError as error:
+                    logger.warning(f"{self.provider.name}: request for {len(batch)} items failed: {error}")
+                    break
+            stats.retries += 1
+            # full jitter keeps retried batches from hitting the provider in lockstep
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        stats.failed += batch
+        return {}
+
+    async def fetch_all(self, request: Callable[[list], Awaitable[dict]], items: list) -> dict:
+        """Results of request over items, batched and fetched concurrently, see last_stats"""
+        stats = FetchStats(requested=len(items))
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        results = await asyncio.gather(*(self._call(request, batch, semaphore, stats) for batch in batches))
+        merged = {key: value for result in results for key, value in result.items()}
+        stats.fetched = len(merged)
+        stats.seconds = time.perf_counter() - start
+        self.last_stats = stats
+        return merged
+
+    def instruments(self, sec_ids: Optional[list] = None) -> pd.DataFrame:
+        """sec_id, isin_or_fx and type of all securities with a symbol, or of those among sec_ids"""
+        table = self.session_mgr.tables["securities"]
+        columns = ["sec_id", "isin_or_fx", "type"]
+        if sec_ids is None:
+            chunks = [self.session_mgr.read(table, columns, {"isin_or_fx": {"is_null": False}})]
+        else:
+            sec_ids = [int(sec_id) for sec_id in sec_ids]
+            if not sec_ids:
+                return pd.DataFrame({"sec_id": pd.Series(dtype=int), "isin_or_fx": pd.Series(dtype=object),
+                                     "type": pd.Series(dtype=object)})
+            chunks = [self.session_mgr.read(table, columns, {"sec_id": sec_ids[i:i + MAX_QUERY_PARAMS],
+                                                             "isin_or_fx": {"is_null": False}})
+                      for i in range(0, len(sec_ids), MAX_QUERY_PARAMS)]
+        df = pd.concat(chunks, ignore_index=True)
+        df["sec_id"] = df["sec_id"].astype(int)
+        return df
+
+    def symbols(self, sec_ids: Optional[list] = None) -> dict:
+        """{symbol: sec_id} from securities.isin_or_fx, for all securities or the given sec_ids"""
+        df = self.instruments(sec_ids)
+        return dict(zip(df["isin_or_fx"], df["sec_id"]))
+
+    def _fetch_cached(self, kind: str, items: dict, date: pd.Timestamp, stored: dict,
+                      request: Callable[[list], Awaitable[dict]], refresh: bool) -> tuple[dict, dict]:
+        """({item: value} to write, {item: value} already in the database) for items ({item: instrument type})
+
+        stored maps items to the (value, entry_date) rows the database has for date.
+        """
+        if not self.cache or refresh:
+            return run_sync(self.fetch_all(request, list(items))), {}
+        now = time.time()
+        in_db = {item: value for item, (value, entry_date) in stored.items()
+                 if self.cache.fresh(items[item], date, datetime.fromisoformat(entry_date).timestamp(), now)}
+        self.cache.stats.db_hits += len(in_db)
+        keys = {QuoteCache.key(kind, item, date): item for item in items if item not in in_db}
+        cached = self.cache.get_many({key: items[item] for key, item in keys.items()}, date)
+        found = {keys[key]: value for key, value in cached.items()}
+        missing = [item for item in items if item not in in_db and item not in found]
+        self.cache.stats.misses += len(missing)
+        fetched = run_sync(self.fetch_all(request, missing)) if missing else {}
+        failed = set(self.last_stats.failed) if missing else set()
+        # items the provider answered without a value are cached as unknown (NaN)
+        self.cache.put_many({QuoteCache.key(kind, item, date): fetched.get(item, float("nan"))
+                             for item in missing if item not in failed})
+        found = {item: value for item, value in found.items() if pd.notna(value)}
+        return {**found, **fetched}, in_db
+
+    def check_id(self, symbols: list) -> dict:
+        """{symbol: known by the provider}"""
+        known = run_sync(self.fetch_all(self.provider.check_ids, list(symbols)))
+        return {symbol: known.get(symbol, False) for symbol in symbols}
 
-    def check_id(self):
-        raise NotImplemented
+    def get_price(self, sec_ids: Optional[list] = None, date=None, refresh: bool = False) -> pd.DataFrame:
+        """Price of every security (or of sec_ids) as of date, new quotes are written to prices
 
-    def get_price(self):
-        raise NotImplemented
+        refresh skips the cache and requests every symbol from the provider.
+        """
+        date = pd.Timestamp(date if date is not None else pd.Timestamp.today()).normalize()
+        # the day as every other writer stores it, so REPLACE hits the row already stored for it
+        db_date = date_key(date)
+        instruments = self.instruments(sec_ids)
+        symbols = dict(zip(instruments["isin_or_fx"], instruments["sec_id"]))
+        stored = {}
+        if self.cache and not refresh:
+            by_sec_id = {sec_id: symbol for symbol, sec_id in symbols.items()}
+            sec_id_list = list(by_sec_id)
+            for i in range(0, len(sec_id_list), MAX_QUERY_PARAMS):
+                rows = self.session_mgr.read(self.session_mgr.tables["prices"], ["sec_id", "unit_price", "entry_date"],
+                                             {"sec_id": sec_id_list[i:i + MAX_QUERY_PARAMS], "date": db_date,
+                                              "unit_price": {"is_null": False}, "entry_date": {"is_null": False}})
+                stored.update({by_sec_id[int(sec_id)]: (price, entry_date) for sec_id, price, entry_date
+                               in zip(rows["sec_id"], rows["unit_price"], rows["entry_date"])})
+        new, in_db = self._fetch_cached("price", dict(zip(instruments["isin_or_fx"], instruments["type"])), date,
+                                        stored, lambda batch: self.provider.fetch_prices(batch, date), refresh)
+        df = pd.DataFrame({"sec_id": [symbols[symbol] for symbol in new], "date": db_date,
+                           "unit_price": list(new.values()), "source": self.provider.name,
+                           "entry_date": dbManager.to_dbtime()})
+        self.db_manager.insert_many(self.session_mgr.tables["prices"], None, df, conflict="REPLACE")
+        if len(df):
+            self.session_mgr.refresh_holdings(sec_ids=list(df["sec_id"]), since=date)
+        kept = pd.DataFrame({"sec_id": [symbols[symbol] for symbol in in_db], "date": db_date,
+                             "unit_price": list(in_db.values()), "source": "db"})
+        return pd.concat([df, kept], ignore_index=True) if len(kept) else df
 
-    def get_fx_rates(self):
-        raise NotImplemented
+    def get_fx_rates(self, pairs: list, date=None, refresh: bool = False) -> pd.DataFrame:
+        """Rate of every (nominator, denominator) pair as of date, new rates are written to fx_rates"""
+        date = pd.Timestamp(date if date is not None else pd.Timestamp.today()).normalize()
+        db_date = date_key(date)
+        pairs = [tuple(pair) for pair in pairs]
+        stored = {}
+        if self.cache and not refresh:
+            rows = self.session_mgr.read(self.session_mgr.tables["fx_rates"],
+                                         ["nominator", "denominator", "rate", "entry_date"],
+                                         {"date": db_date, "rate": {"is_null": False},
+                                          "entry_date": {"is_null": False}})
+            wanted = set(pairs)
+            stored = {(nominator, denominator): (rate, entry_date) for nominator, denominator, rate, entry_date
+                      in zip(rows["nominator"], rows["denominator"], rows["rate"], rows["entry_date"])
+                      if (nominator, denominator) in wanted}
+        new, in_db = self._fetch_cached("fx", {pair: "fx" for pair in pairs}, date, stored,
+                                        lambda batch: self.provider.fetch_fx_rates(batch, date), refresh)
+        df = pd.DataFrame({"nominator": [pair[0] for pair in new], "denominator": [pair[1] for pair in new],
+                           "rate": list(new.values()), "date": db_date,
+                           "source": self.provider.name, "entry_date": dbManager.to_dbtime()})
+        self.db_manager.insert_many(self.session_mgr.tables["fx_rates"], None, df, conflict="REPLACE")
+        kept = pd.DataFrame({"nominator": [pair[0] for pair in in_db], "denominator": [pair[1] for pair in in_db],
+                             "rate": list(in_db.values()), "date": db_date, "source": "db"})
+        return pd.concat([df, kept], ignore_index=True) if len(kept) else df
@@ -0,0 +1,155 @@
+"""Gap-aware backfill of historical prices
+
+The missing date ranges of every security with a symbol come from one grouped query over prices:
+the whole window for securities without prices, the stretches before the first and after the last
+price, and the holes between consecutive prices found with LAG(). Gaps without a business day
+(weekends) are dropped and gaps close to each other are merged into one range request. Requests run
+through apiHandler in chunks, each chunk is written right away and recorded in a JSON checkpoint
+(by default next to the database), so an interrupted run resumes where it stopped and ranges the
+provider has no data for (holidays, delisted periods) are not requested again.
+"""
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Callable
+
+import numpy as np
+import pandas as pd
+
+from tools.apis import apiHandler, run_sync
+from tools.dbtools import dbManager
+from tools.fx import date_key
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BackfillStats:
+    gaps: int = 0
+    requests: int = 0
+    rows_written: int = 0
+    failed: list = field(default_factory=list)
+    seconds: float = 0.0
+
+
+def log_progress(stats: BackfillStats) -> None:
+    logger.info(f"Backfill: {stats.requests}/{stats.gaps} ranges, {stats.rows_written} prices in {stats.seconds:.1f}s")
+
+
+class BackfillJob:
+    def __init__(self, handler: apiHandler, start, end=None, checkpoint_path: Optional[os.path] = None,
+                 merge_within_days: int = 7, requests_per_chunk: int = 200) -> None:
+        self.handler = handler
+        self.session_mgr = handler.session_mgr
+        self.start = date_key(start)
+        # the last complete trading day, today's prices are not final yet
+        self.end = date_key(end if end is not None else pd.Timestamp.today().normalize() - pd.offsets.BDay(1))
+        self.checkpoint_path = checkpoint_path if checkpoint_path else self.session_mgr.db_path + ".backfill.json"
+        self.merge_within_days = merge_within_days
+        self.requests_per_chunk = requests_per_chunk
+        self.completed = self._load_checkpoint()
+
+    def _load_checkpoint(self) -> dict:
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as file:
+            return {int(sec_id): ranges for sec_id, ranges in json.load(file)["completed"].items()}
+
+    def _save_checkpoint(self) -> None:
+        temporary = self.checkpoint_path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump({"completed": {str(sec_id): ranges for sec_id, ranges in self.completed.items()}}, file)
+        os.replace(temporary, self.checkpoint_path)
+
+    def gaps(self) -> pd.DataFrame:
+        """sec_id, symbol, start, end of every missing range in one query, bounds included"""
+        prices = self.session_mgr.tables["prices"]
+        securities = self.session_mgr.tables["securities"]
+        sql = f"""
+            WITH symbols AS (SELECT sec_id, isin_or_fx AS symbol FROM {securities} WHERE isin_or_fx IS NOT NULL),
+            days AS (SELECT sec_id, date FROM {prices} WHERE date >= ? AND date < ? AND unit_price IS NOT NULL
+                     AND sec_id IN (SELECT sec_id FROM symbols)),
+            bounds AS (SELECT symbols.sec_id, substr(MIN(days.date), 1, 10) AS first_day,
+                       substr(MAX(days.date), 1, 10) AS last_day FROM symbols
+                       LEFT JOIN days ON days.sec_id = symbols.sec_id GROUP BY symbols.sec_id),
+            -- ordered like the (sec_id, date) primary key, so the window needs no sort
+            lagged AS (SELECT sec_id, substr(date, 1, 10) AS day,
+                       substr(LAG(date) OVER (PARTITION BY sec_id ORDER BY date), 1, 10) AS previous_day FROM days)
+            SELECT sec_id, ? AS gap_start, ? AS gap_end FROM bounds WHERE first_day IS NULL
+            UNION ALL
+            SELECT sec_id, ?, date(first_day, '-1 day') FROM bounds WHERE first_day > ?
+            UNION ALL
+            SELECT sec_id, date(last_day, '+1 day'), ? FROM bounds WHERE last_day < ?
+            UNION ALL
+            SELECT sec_id, date(previous_day, '+1 day'), date(day, '-1 day') FROM lagged
+            WHERE julianday(day) - julianday(previous_day) > 1"""
+        next_day = date_key(pd.Timestamp(self.end) + pd.Timedelta(days=1))
+        gaps = self.handler.db_manager.read_query(sql, [self.start, next_day, self.start, self.end, self.start,
+                                                        self.start, self.end, self.end])
+        symbols = self.handler.symbols()
+        by_sec_id = {sec_id: symbol for symbol, sec_id in symbols.items()}
+        gaps["sec_id"] = gaps["sec_id"].astype(int)
+        gaps["symbol"] = gaps["sec_id"].map(by_sec_id)
+        gaps = gaps.rename(columns={"gap_start": "start", "gap_end": "end"})
+        if gaps.empty:
+            return gaps[["sec_id", "symbol", "start", "end"]]
+        # weekends are not gaps
+        business_days = np.busday_count(gaps["start"].to_numpy(dtype="datetime64[D]"),
+                                        gaps["end"].to_numpy(dtype="datetime64[D]") + 1)
+        gaps = gaps.loc[business_days > 0]
+        return gaps[["sec_id", "symbol", "start", "end"]].sort_values(["sec_id", "start"]).reset_index(drop=True)
+
+    def _done(self, sec_id: int, start: str, end: str) -> bool:
+        return any(done_start <= start and end <= done_end for done_start, done_end in self.completed.get(sec_id, []))
+
+    def plan(self) -> list:
+        """(sec_id, symbol, start, end) range requests, merged and without ranges already tried"""
+        requests = []
+        for gap in self.gaps().itertuples(index=False):
+            if self._done(gap.sec_id, gap.start, gap.end):
+                continue
+            if requests and requests[-1][0] == gap.sec_id and \
+                    (pd.Timestamp(gap.start) - pd.Timestamp(requests[-1][3])).days <= self.merge_within_days:
+                requests[-1] = (gap.sec_id, gap.symbol, requests[-1][2], gap.end)
+            else:
+                requests.append((gap.sec_id, gap.symbol, gap.start, gap.end))
+        return requests
+
+    def run(self, progress: Optional[Callable[[BackfillStats], None]] = log_progress) -> BackfillStats:
+        requests = self.plan()
+        stats = BackfillStats(gaps=len(requests))
+        started = time.perf_counter()
+        provider = self.handler.provider
+        for start in range(0, len(requests), self.requests_per_chunk):
+            chunk = requests[start:start + self.requests_per_chunk]
+            sec_ids = {(symbol, first, last): sec_id for sec_id, symbol, first, last in chunk}
+            history = run_sync(self.handler.fetch_all(provider.fetch_history, list(sec_ids)))
+            entry_date = dbManager.to_dbtime()
+            # merged ranges span days that are stored already, those keep their price
+            rows = [[sec_ids[request], date_key(day), price, provider.name, entry_date]
+                    for request, prices in history.items() for day, price in prices.items()]
+            if rows:
+                days = (min(row[1] for row in rows), max(row[1] for row in rows))
+                stored = self.handler.db_manager.read_table(
+                    self.session_mgr.tables["prices"], ["sec_id", "date"],
+                    filters={"sec_id": list(set(sec_ids.values())), "date": {"between": days}})
+                stored = set(zip(stored["sec_id"], stored["date"]))
+                rows = [row for row in rows if (row[0], row[1]) not in stored]
+            stats.rows_written += self.handler.db_manager.insert_many(
+                self.session_mgr.tables["prices"], ["sec_id", "date", "unit_price", "source", "entry_date"], rows,
+                conflict="IGNORE")
+            if rows:
+                self.session_mgr.refresh_holdings(sec_ids={row[0] for row in rows}, since=min(row[1] for row in rows))
+            failed = set(self.handler.last_stats.failed)
+            for request, sec_id in sec_ids.items():
+                if request not in failed:
+                    self.completed.setdefault(sec_id, []).append([request[1], request[2]])
+            stats.failed += list(failed)
+            self._save_checkpoint()
+            stats.requests += len(chunk)
+            stats.seconds = time.perf_counter() - started
+            if progress:
+                progress(stats)
+        return stats
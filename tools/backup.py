@@ -0,0 +1,204 @@
+"""Online backups of the live database
+
+Backups go through SQLite's online backup API on a connection of their own, a bounded number of
+pages per step, so the app keeps reading and writing while a copy of a large database is taken. In
+WAL mode the backup connection holds one read transaction for the whole copy: the copy is a
+consistent snapshot of the moment the backup started, and writers are never blocked. Without WAL
+every step holds a shared lock, so the backup pauses between steps to let writers in.
+
+A copy is written under a temporary name and renamed once complete (and optionally gzipped), so a
+crashed or failed backup never leaves a torn file that looks like a backup. Backups are named
+<database>_<YYYYmmdd_HHMMSS>.sqlite[.gz], which sorts them by age for rotate.
+"""
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGES = 256
+DEFAULT_PAUSE = 0.005
+BACKUP_SUFFIX = ".sqlite"
+GZIP_SUFFIX = ".gz"
+
+
+@dataclass
+class BackupResult:
+    path: str
+    pages: int
+    seconds: float
+    bytes: int
+
+
+def backup_name(db_path: str, when: Optional[datetime] = None, compress: bool = False) -> str:
+    when = when if when else datetime.now()
+    name = os.path.splitext(os.path.basename(db_path))[0]
+    return f"{name}_{when:%Y%m%d_%H%M%S}{BACKUP_SUFFIX}{GZIP_SUFFIX if compress else ''}"
+
+
+def list_backups(directory: str, db_path: str) -> list[str]:
+    """Backups of db_path in directory, the newest first"""
+    if not os.path.isdir(directory):
+        return []
+    # the exact name pattern, "accounts" must not pick up the backups of "accounts_old"
+    pattern = re.compile(rf"{re.escape(os.path.splitext(os.path.basename(db_path))[0])}_\d{{8}}_\d{{6}}"
+                         rf"{re.escape(BACKUP_SUFFIX)}(?:{re.escape(GZIP_SUFFIX)})?")
+    names = [name for name in os.listdir(directory) if pattern.fullmatch(name)]
+    return [os.path.join(directory, name) for name in sorted(names, reverse=True)]
+
+
+def rotate(directory: str, db_path: str, keep: int) -> list[str]:
+    """Remove all but the keep newest backups of db_path, returns the removed files"""
+    removed = list_backups(directory, db_path)[max(keep, 0):]
+    for path in removed:
+        os.remove(path)
+        logger.info(f"Removed old backup {path}")
+    return removed
+
+
+def backup_db(db_path: str, target_path: str, pages: int = DEFAULT_PAGES, pause: float = DEFAULT_PAUSE,
+              progress: Optional[Callable[[int, int], None]] = None) -> BackupResult:
+    """Copy db_path to target_path (gzipped when it ends with .gz) in steps of pages pages
+
+    progress(copied, total) is called after every step.
+    """
+    began = time.perf_counter()
+    directory = os.path.dirname(os.path.abspath(target_path))
+    os.makedirs(directory, exist_ok=True)
+    handle, partial = tempfile.mkstemp(suffix=".partial", dir=directory)
+    os.close(handle)
+    copied = [0]
+    source = sqlite3.connect(db_path, timeout=30)
+    try:
+        wal = source.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+        if wal:
+            # pins the snapshot, changes committed by other connections from here on are not copied
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+        def step(status: int, remaining: int, total: int) -> None:
+            copied[0] = total - remaining
+            if progress:
+                progress(copied[0], total)
+            if not wal and remaining and pause:
+                time.sleep(pause)
+
+        target = sqlite3.connect(partial)
+        try:
+            source.backup(target, pages=pages, progress=step)
+        finally:
+            target.close()
+        if wal:
+            source.rollback()
+    except BaseException:
+        os.remove(partial)
+        raise
+    finally:
+        source.close()
+    try:
+        if target_path.endswith(GZIP_SUFFIX):
+            with open(partial, "rb") as plain, gzip.open(partial + GZIP_SUFFIX, "wb", compresslevel=6) as packed:
+                shutil.copyfileobj(plain, packed, 1024 * 1024)
+            os.remove(partial)
+            partial += GZIP_SUFFIX
+        os.replace(partial, target_path)
+    except BaseException:
+        for leftover in (partial, partial + GZIP_SUFFIX):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    result = BackupResult(target_path, copied[0], time.perf_counter() - began, os.path.getsize(target_path))
+    logger.info(f"Backup of {db_path} to {target_path}: {result.pages} pages in {result.seconds:.2f} s")
+    return result
+
+
+def restore_db(backup_path: str, target: sqlite3.Connection, lock: Optional[threading.RLock] = None) -> int:
+    """Replace the content of the database of connection target with a backup, returns the pages copied
+
+    The backup is checked before anything is overwritten. The copy runs in one step while holding lock,
+    the fastest way and the only one that cannot leave the live database half restored. Other
+    connections reading the database at the time make it fail with "database is locked", see
+    ConnectionPool.exclusive.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if backup_path.endswith(GZIP_SUFFIX):
+            plain_path = os.path.join(tmp_dir, "restore.sqlite")
+            with gzip.open(backup_path, "rb") as packed, open(plain_path, "wb") as plain:
+                shutil.copyfileobj(packed, plain, 1024 * 1024)
+        else:
+            plain_path = backup_path
+        source = sqlite3.connect(f"file:{plain_path}?mode=ro", uri=True)
+        try:
+            check = source.execute("PRAGMA quick_check").fetchone()[0]
+            if check != "ok":
+                raise sqlite3.DatabaseError(f"Backup {backup_path} is damaged: {check}")
+            pages = source.execute("PRAGMA page_count").fetchone()[0]
+            with lock if lock else nullcontext():
+                if target.in_transaction:
+                    target.commit()
+                source.backup(target)
+        finally:
+            source.close()
+    logger.info(f"Restored {pages} pages from {backup_path}")
+    return pages
+
+
+class BackupJob:
+    """A backup running on a thread of its own, poll done() and progress or wait for result()"""
+    def __init__(self, db_path: str, target_path: str, keep: Optional[int] = None, pages: int = DEFAULT_PAGES,
+                 pause: float = DEFAULT_PAUSE) -> None:
+        self.db_path = db_path
+        self.target_path = target_path
+        self.keep = keep
+        self.copied = 0
+        self.total = 0
+        self._options = {"pages": pages, "pause": pause}
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=f"backup {os.path.basename(db_path)}", daemon=True)
+
+    def start(self) -> "BackupJob":
+        self._thread.start()
+        return self
+
+    def _progress(self, copied: int, total: int) -> None:
+        self.copied, self.total = copied, total
+
+    def _run(self) -> None:
+        try:
+            result = backup_db(self.db_path, self.target_path, progress=self._progress, **self._options)
+            if self.keep is not None:
+                rotate(os.path.dirname(self.target_path), self.db_path, self.keep)
+            self._result = result
+        except Exception as error:
+            logger.error(f"Backup of {self.db_path} failed: {error}")
+            self._error = error
+
+    @property
+    def progress(self) -> float:
+        """Share of the pages copied, 0.0 to 1.0"""
+        if self._result is not None:
+            return 1.0
+        return self.copied / self.total if self.total else 0.0
+
+    def done(self) -> bool:
+        return self._result is not None or self._error is not None
+
+    def result(self, timeout: Optional[float] = None) -> BackupResult:
+        """Wait for the backup, raises what made it fail"""
+        self._thread.join(timeout)
+        if self._error:
+            raise self._error
+        if self._result is None:
+            raise TimeoutError(f"Backup of {self.db_path} still running")
+        return self._result
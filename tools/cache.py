@@ -0,0 +1,107 @@
+"""On-disk TTL cache for quotes fetched from market data providers
+
+Entries live in their own small sqlite file, so they survive restarts and are shared by every
+database the app opens. Each entry is valid for the TTL of its instrument type, quotes for days
+that were already over when fetched never expire. The cache keeps at most max_entries entries and
+evicts the least recently used ones beyond that. Symbols a provider did not know are cached as NaN
+so they are not requested again within the TTL either.
+"""
+import math
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import pandas as pd
+
+from tools import connections
+from tools.dbtools import dbManager
+from tools.prices import MAX_QUERY_PARAMS
+
+# next to the tools package like the database config, so every working directory shares one cache
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db", "quote_cache")
+
+# seconds a quote stays valid per instrument type (securities.type, "fx" for rates)
+DEFAULT_TTLS = {"default": 15 * 60, "fx": 60 * 60, "fund": 12 * 60 * 60, "bond": 12 * 60 * 60}
+
+
+@dataclass
+class CacheStats:
+    db_hits: int = 0
+    cache_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.db_hits + self.cache_hits + self.misses
+        return (self.db_hits + self.cache_hits) / lookups if lookups else 0.0
+
+
+class QuoteCache:
+    table = "quotes"
+
+    def __init__(self, path: Optional[os.path] = None, max_entries: int = 100000,
+                 ttls: Optional[dict] = None) -> None:
+        path = path if path else DEFAULT_CACHE_PATH
+        self.path = path
+        self.max_entries = max_entries
+        self.ttls = {**DEFAULT_TTLS, **(ttls if ttls else {})}
+        self.stats = CacheStats()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.pool = connections.get_pool(path, profile={"journal_mode": "WAL", "synchronous": "NORMAL"})
+        self.db_manager = dbManager(path, pool=self.pool)
+        self.db_manager.create_table(self.table, [{"name": "key", "type": "TEXT"}, {"name": "value", "type": "REAL"},
+                                                  {"name": "fetched", "type": "REAL"},
+                                                  {"name": "accessed", "type": "REAL"}],
+                                     primary_key=["key"], without_rowid=True, indexes=[{"columns": ["accessed"]}])
+
+    def close(self) -> None:
+        connections.release_pool(self.path)
+
+    @staticmethod
+    def key(kind: str, symbol, date: pd.Timestamp) -> str:
+        symbol = "/".join(symbol) if isinstance(symbol, tuple) else symbol
+        return f"{kind}:{symbol}:{date:%Y-%m-%d}"
+
+    def ttl(self, instrument_type: Optional[str], date: pd.Timestamp, fetched: float) -> float:
+        """Seconds an entry fetched at fetched (epoch) stays valid, infinite once date was over when fetched"""
+        if datetime.fromtimestamp(fetched).date() > date.date():
+            return math.inf
+        return self.ttls.get(instrument_type, self.ttls["default"])
+
+    def fresh(self, instrument_type: Optional[str], date: pd.Timestamp, fetched: float, now: float) -> bool:
+        return now - fetched < self.ttl(instrument_type, date, fetched)
+
+    def get_many(self, keys: dict, date: pd.Timestamp) -> dict:
+        """{key: value} of the fresh entries among keys ({key: instrument type}), NaN for unknown symbols"""
+        now = time.time()
+        found = {}
+        key_list = list(keys)
+        for start in range(0, len(key_list), MAX_QUERY_PARAMS):
+            chunk = key_list[start:start + MAX_QUERY_PARAMS]
+            df = self.db_manager.read_table(self.table, ["key", "value", "fetched"], {"key": chunk})
+            for key, value, fetched in zip(df["key"], df["value"], df["fetched"]):
+                if self.fresh(keys[key], date, fetched, now):
+                    found[key] = (value, fetched)
+        if found:
+            self.db_manager.insert_many(self.table, ["key", "value", "fetched", "accessed"],
+                                        [[key, value, fetched, now] for key, (value, fetched) in found.items()],
+                                        conflict="REPLACE")
+        self.stats.cache_hits += len(found)
+        return {key: value for key, (value, _) in found.items()}
+
+    def put_many(self, values: dict) -> None:
+        now = time.time()
+        self.db_manager.insert_many(self.table, ["key", "value", "fetched", "accessed"],
+                                    [[key, value, now, now] for key, value in values.items()], conflict="REPLACE")
+        excess = self.db_manager.estimate_count(self.table, exact=True) - self.max_entries
+        if excess > 0:
+            self.stats.evictions += self.db_manager.remove_from_table(
+                self.table, f"key IN (SELECT key FROM {self.table} ORDER BY accessed LIMIT ?)", [excess])
+
+    def clear(self) -> None:
+        self.db_manager.remove_from_table(self.table, "1")
+        self.stats = CacheStats()
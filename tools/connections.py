@@ -0,0 +1,204 @@
+"""Shared sqlite connections for the app
+
+One ConnectionPool per database file holds a single writer connection, serialized by write_lock,
+and up to read_pool_size reader connections that are lent out one thread at a time. Pools are
+shared between sessions through get_pool/release_pool and closed when the last user releases them.
+"""
+import copy
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import yaml
+
+from tools.instrumentation import QueryRecorder
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_READ_POOL_SIZE = 4
+# applied in this order, journal_mode has to be set before anything opens a transaction
+PROFILE_PRAGMAS = ("journal_mode", "busy_timeout", "synchronous", "cache_size", "mmap_size", "temp_store")
+
+
+_yaml_cache = {}
+_yaml_lock = threading.Lock()
+
+
+def load_yaml(config_path: os.path) -> dict:
+    """Parsed yaml config, parsed once per file version and handed out as a copy the caller may change"""
+    key = (os.path.abspath(config_path), os.stat(config_path).st_mtime_ns)
+    with _yaml_lock:
+        if key not in _yaml_cache:
+            for stale in [cached for cached in _yaml_cache if cached[0] == key[0]]:
+                del _yaml_cache[stale]
+            with open(config_path) as file:
+                # the C loader parses the schema several times faster where libyaml is available
+                _yaml_cache[key] = yaml.load(file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+        return copy.deepcopy(_yaml_cache[key])
+
+
+def load_profile(config_path: os.path, name: Optional[str] = None) -> dict:
+    """Pragmas of the connection profile called name (default: the selected "profile") in the yaml config"""
+    if not os.path.exists(config_path):
+        logger.warning(f"Config {os.path.abspath(config_path)} not found, connections use the sqlite defaults")
+        return {}
+    connection = load_yaml(config_path)["database"].get("connection", {})
+    name = name if name else connection.get("profile")
+    if not name:
+        return {}
+    profiles = connection.get("profiles", {})
+    if name not in profiles:
+        raise ValueError(f"Unknown connection profile '{name}', expected one of {list(profiles)}")
+    return profiles[name] if profiles[name] else {}
+
+
+def apply_profile(conn: sqlite3.Connection, profile: Optional[dict] = None) -> sqlite3.Connection:
+    conn.execute("PRAGMA foreign_keys = ON")
+    profile = profile if profile else {}
+    unknown = set(profile) - set(PROFILE_PRAGMAS)
+    if unknown:
+        raise ValueError(f"Unsupported connection pragma(s) {sorted(unknown)}, expected {PROFILE_PRAGMAS}")
+    for pragma in PROFILE_PRAGMAS:
+        if pragma in profile:
+            value = profile[pragma]
+            if not isinstance(value, int) and not str(value).isidentifier():
+                raise ValueError(f"Invalid value {value!r} for PRAGMA {pragma}")
+            conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, db_path: os.path, read_pool_size: int = DEFAULT_READ_POOL_SIZE,
+                 profile: Optional[dict] = None) -> None:
+        self.db_path = db_path
+        self.read_pool_size = read_pool_size
+        self.profile = profile if profile else {}
+        self.write_lock = threading.RLock()
+        self._pool_lock = threading.Lock()
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        # borrowed readers and the flag of exclusive(), which keeps new reads waiting
+        self._gate = threading.Condition()
+        self._borrowed = 0
+        self._exclusive = False
+        # write counter per table, shared by every dbManager on the pool, see dbManager.table_version
+        self.table_versions = {}
+        # statement timings of every dbManager on the pool, see tools.instrumentation
+        self.recorder = QueryRecorder()
+        self.writer = None
+        self.open()
+
+    def _connect(self) -> sqlite3.Connection:
+        return apply_profile(sqlite3.connect(self.db_path, check_same_thread=False), self.profile)
+
+    @property
+    def closed(self) -> bool:
+        return self.writer is None
+
+    def open(self) -> None:
+        if self.closed:
+            self.writer = self._connect()
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a reader connection, blocks while all read_pool_size readers are in use"""
+        if self.closed:
+            raise sqlite3.ProgrammingError(f"Connection pool for {self.db_path} is closed")
+        with self._gate:
+            self._gate.wait_for(lambda: not self._exclusive)
+            self._borrowed += 1
+        try:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                with self._pool_lock:
+                    create = self._reader_count < self.read_pool_size
+                    if create:
+                        self._reader_count += 1
+                conn = self._connect() if create else self._readers.get()
+            try:
+                yield conn
+            finally:
+                if self.closed:
+                    conn.close()
+                else:
+                    self._readers.put(conn)
+        finally:
+            with self._gate:
+                self._borrowed -= 1
+                self._gate.notify_all()
+
+    def _close_readers(self) -> None:
+        with self._pool_lock:
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._reader_count = 0
+
+    @contextmanager
+    def exclusive(self) -> Iterator[sqlite3.Connection]:
+        """The writer while no reader connection is open, for operations replacing the whole database
+
+        Holds the write lock, waits until borrowed readers are returned and closes them; new reads wait
+        until the block is left and then connect again.
+        """
+        with self.write_lock:
+            with self._gate:
+                self._exclusive = True
+                self._gate.wait_for(lambda: self._borrowed == 0)
+            try:
+                self._close_readers()
+                yield self.writer
+            finally:
+                with self._gate:
+                    self._exclusive = False
+                    self._gate.notify_all()
+
+    def close(self) -> None:
+        with self.write_lock:
+            if self.writer is not None:
+                optimize(self.writer)
+                self.writer.close()
+                self.writer = None
+        self._close_readers()
+
+
+def optimize(conn: sqlite3.Connection, analyze: bool = False) -> None:
+    """Refresh the query planner statistics, a full ANALYZE or the cheap PRAGMA optimize"""
+    try:
+        conn.execute("ANALYZE" if analyze else "PRAGMA optimize")
+        conn.commit()
+    except sqlite3.OperationalError:
+        # busy or read-only databases keep their old statistics
+        pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: os.path, read_pool_size: int = DEFAULT_READ_POOL_SIZE,
+             profile: Optional[dict] = None) -> ConnectionPool:
+    """Shared pool for db_path, every call has to be paired with release_pool"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        if key not in _pools or _pools[key][0].closed:
+            _pools[key] = [ConnectionPool(db_path, read_pool_size, profile), 0]
+        _pools[key][1] += 1
+        return _pools[key][0]
+
+
+def release_pool(db_path: os.path) -> None:
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        if key not in _pools:
+            return
+        _pools[key][1] -= 1
+        if _pools[key][1] <= 0:
+            _pools.pop(key)[0].close()
@@ -1,26 +1,181 @@
 """File for creating and managing db"""
+import logging
 import os
 import sqlite3
-from typing import Optional
+import threading
+import time
+from dataclasses import dataclass
+from itertools import islice
+from typing import Optional, Iterable, Union
 from datetime import datetime
 
 import pandas as pd
 
+from tools import backup
+from tools import migrations
+from tools.connections import ConnectionPool, apply_profile, optimize
+from tools.dtypes import typed_chunk, combine, to_arrow
+from tools.instrumentation import QueryRecorder
+
+logger = logging.getLogger(__name__)
+
+
+FILTER_OPERATORS = {"=": "=", "!=": "!=", ">": ">", ">=": ">=", "<": "<", "<=": "<=", "like": "LIKE"}
+
+
+def check_columns(table: str, columns: list, known: list) -> list:
+    unknown = [column for column in columns if column not in known]
+    if unknown:
+        raise ValueError(f"Unknown column(s) {unknown} for table '{table}'")
+    return columns
+
+
+def where_clause(filters: dict, check=lambda columns: columns) -> tuple[str, list]:
+    """(sql, params) for filters combined with AND, values are always bound as parameters
+
+    Per column a filter is either
+      value                  col = ?
+      None                   col IS NULL
+      [v1, v2, ...]          col IN (?, ?, ...), an empty list matches nothing
+      {op: value, ...}       with op in =, !=, >, >=, <, <=, like, between (a pair), in / not_in (lists)
+                             and is_null (True / False), several ops on one column are combined with AND
+    check validates the column names and raises ValueError for unknown ones.
+    """
+    check(list(filters.keys()))
+    conditions, params = [], []
+    for column, spec in filters.items():
+        ops = spec if isinstance(spec, dict) else {"is_null": True} if spec is None \
+            else {"in": spec} if isinstance(spec, (list, tuple, set)) else {"=": spec}
+        for op, value in ops.items():
+            if op in FILTER_OPERATORS:
+                conditions.append(f"{column} {FILTER_OPERATORS[op]} ?")
+                params.append(value)
+            elif op == "between":
+                low, high = value
+                conditions.append(f"{column} BETWEEN ? AND ?")
+                params += [low, high]
+            elif op in ("in", "not_in"):
+                values = list(value)
+                if not values:
+                    conditions.append("0" if op == "in" else "1")
+                    continue
+                conditions.append(f"{column} {'NOT IN' if op == 'not_in' else 'IN'} ({', '.join('?' for _ in values)})")
+                params += values
+            elif op == "is_null":
+                conditions.append(f"{column} IS {'' if value else 'NOT '}NULL")
+            else:
+                raise ValueError(f"Unknown filter operator '{op}' for column '{column}'")
+    return " AND ".join(conditions), params
+
+
+@dataclass
+class Page:
+    """One page of read_page, last is the cursor to pass as after for the next page"""
+    rows: pd.DataFrame
+    last: Optional[tuple] = None
+    has_next: bool = False
+
 
 class dbManager:
-    def __init__(self, db_path: os.path) -> None:
+    """Database access; with a ConnectionPool writes go through its shared writer connection
+    (serialized by its write lock) and reads borrow one of its reader connections"""
+    def __init__(self, db_path: os.path, pool: Optional[ConnectionPool] = None, profile: Optional[dict] = None,
+                 recorder: Optional[QueryRecorder] = None) -> None:
+        """profile holds the connection pragmas (see connections.load_profile), pools apply their own;
+        statement timings go to recorder, by default the pool's one or a recorder of this dbManager"""
         self.db = db_path
-        self.conn = sqlite3.connect(db_path)
-        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.pool = pool
+        if pool:
+            self.conn = pool.writer
+            self.lock = pool.write_lock
+        else:
+            self.conn = sqlite3.connect(db_path)
+            try:
+                apply_profile(self.conn, profile)
+            except (ValueError, sqlite3.Error):
+                self.conn.close()
+                raise
+            self.lock = threading.RLock()
+        self.table_versions = pool.table_versions if pool else {}
+        self.recorder = recorder if recorder else (pool.recorder if pool else QueryRecorder())
+        self._columns_cache = {}
         self.cursor = self.conn.cursor()
 
+    def table_version(self, table: str) -> int:
+        """Number of writes made to table through dbManager, lets callers invalidate what they cached from it"""
+        return self.table_versions.get(table, 0)
+
+    def _table_written(self, table: str) -> None:
+        self.table_versions[table] = self.table_versions.get(table, 0) + 1
+
+    def _record(self, sql: str, params: Optional[list], seconds: float, rows: int = 0, nbytes: int = 0) -> None:
+        """Add one statement to the recorder, slow ones are logged with their query plan"""
+        if not self.recorder.enabled:
+            return
+        if self.recorder.record(sql, seconds, rows, nbytes):
+            try:
+                plan = self.explain_query_plan(sql, params)
+            except sqlite3.Error:
+                plan = []
+            self.recorder.record_slow(sql, seconds, plan)
+
+    def close(self) -> None:
+        """Close the own connection, a pooled writer is left to the pool"""
+        if not self.pool:
+            self.optimize()
+            self.conn.close()
+
+    def optimize(self, analyze: bool = False) -> None:
+        """Maintenance hook, PRAGMA optimize (or a full ANALYZE) so the planner sees current table sizes"""
+        with self.lock:
+            optimize(self.conn, analyze)
+
     def _run_custom_query(self, sql: str, commit: bool = True, fetch_return: bool = False) -> Optional[tuple]:
-        self.cursor.execute(sql)
-        if commit:
-            self.conn.commit()
-        if fetch_return:
-            data = self.cursor.fetchall()
-            return data
+        started = time.perf_counter()
+        data = None
+        with self.lock:
+            self.cursor.execute(sql)
+            if commit:
+                self.conn.commit()
+            if fetch_return:
+                data = self.cursor.fetchall()
+            rows = len(data) if fetch_return else self.cursor.rowcount
+        self._record(sql, [], time.perf_counter() - started, rows)
+        return data
+
+    def _fetch_df(self, sql: str, params: list, dtypes: Optional[dict] = None, arrow: bool = False,
+                  chunksize: int = 50000) -> pd.DataFrame:
+        """Run a query into a DataFrame, typed per chunk of rows when dtypes ({column: kind}) are given"""
+        started = time.perf_counter()
+        if self.pool:
+            with self.pool.reader() as conn:
+                df = self._cursor_df(conn.execute(sql, params), dtypes, arrow, chunksize)
+        else:
+            with self.lock:
+                self.cursor.execute(sql, params)
+                df = self._cursor_df(self.cursor, dtypes, arrow, chunksize)
+        if self.recorder.enabled:
+            seconds = time.perf_counter() - started
+            # deep counts every string object, a pass over all rows only paid for statements that are slow anyway
+            threshold = self.recorder.slow_threshold
+            deep = threshold is not None and seconds >= threshold
+            self._record(sql, params, seconds, len(df), int(df.memory_usage(index=False, deep=deep).sum()))
+        return df
+
+    @staticmethod
+    def _cursor_df(cursor: sqlite3.Cursor, dtypes: Optional[dict], arrow: bool, chunksize: int) -> pd.DataFrame:
+        if dtypes is None and not arrow:
+            rows = cursor.fetchall()
+            header_columns = [column[0] for column in cursor.description]
+            return pd.DataFrame(rows, columns=header_columns)
+        # converting chunk by chunk keeps only chunksize rows of python objects alive at a time
+        header_columns = [column[0] for column in cursor.description]
+        kinds = dtypes if dtypes else {}
+        chunks = []
+        while rows := cursor.fetchmany(chunksize):
+            chunks.append(typed_chunk(pd.DataFrame(rows, columns=header_columns), kinds))
+        df = combine(chunks, kinds, header_columns)
+        return to_arrow(df) if arrow else df
 
     @staticmethod
     def to_dbtime(time: Optional[datetime] = None) -> str:
@@ -33,57 +188,309 @@ class dbManager:
         return datetime.fromisoformat(time)
 
     def create_db(self, db_path: os.path):
-        self.cursor.execute(f"""CREATE DATABASE IF NOT EXISTS {db_path}""")
-        self.conn.commit()
+        with self.lock:
+            self.cursor.execute(f"""CREATE DATABASE IF NOT EXISTS {db_path}""")
+            self.conn.commit()
+
+    def user_version(self) -> int:
+        """Hash of the schema last applied by create_db_from_schema, 0 for databases it never migrated"""
+        with self.lock:
+            self.cursor.execute("PRAGMA user_version")
+            return self.cursor.fetchone()[0]
 
-    def check_db(self, db_scheme: dict):
-        raise NotImplemented
+    def check_db(self, db_scheme: dict) -> list[migrations.Step]:
+        """Migration steps the database needs to match db_scheme, empty when it is up to date"""
+        return migrations.diff(self, db_scheme)
 
-    def create_table(self, table_name: str, columns: list[dict]):
-        columns_def = [f"""{col["name"]} {col["type"]}{" PRIMARY KEY" if col.get("primary_key") else ""}""" for col in
-                       columns]
+    @staticmethod
+    def table_sql(table_name: str, columns: list[dict], primary_key: Optional[list] = None,
+                  unique: Optional[list[list]] = None, without_rowid: bool = False, strict: bool = False) -> str:
+        columns_def = [f"""{col["name"]} {col["type"]}{" PRIMARY KEY" if col.get("primary_key") else ""}"""
+                       f"""{" AUTOINCREMENT" if col.get("autoincrement") else ""}""" for col in columns]
+        if primary_key:
+            columns_def.append(f"PRIMARY KEY ({', '.join(primary_key)})")
+        for unique_columns in unique if unique else []:
+            columns_def.append(f"UNIQUE ({', '.join(unique_columns)})")
         columns_def_str = ", ".join(columns_def)
-        sql = f"""CREATE TABLE IF NOT EXISTS {table_name} ({columns_def_str})"""
-        print(sql)
-        self.cursor.execute(sql)
-        self.conn.commit()
+        table_options = [option for option, enabled in (("STRICT", strict), ("WITHOUT ROWID", without_rowid)) if enabled]
+        table_options_str = f" {', '.join(table_options)}" if table_options else ""
+        return f"""CREATE TABLE IF NOT EXISTS {table_name} ({columns_def_str}){table_options_str}"""
 
-    def create_db_from_schema(self):
-        raise NotImplemented
+    def create_table(self, table_name: str, columns: list[dict], primary_key: Optional[list] = None,
+                     unique: Optional[list[list]] = None, indexes: Optional[list[dict]] = None,
+                     without_rowid: bool = False, strict: bool = False):
+        sql = self.table_sql(table_name, columns, primary_key, unique, without_rowid, strict)
+        logger.debug(sql)
+        started = time.perf_counter()
+        with self.lock:
+            self.cursor.execute(sql)
+            for index in indexes if indexes else []:
+                self.cursor.execute(self.index_sql(table_name, index))
+            self.conn.commit()
+        self._record(sql, [], time.perf_counter() - started)
+
+    @staticmethod
+    def index_name(table_name: str, index: dict) -> str:
+        return index.get("name", f"idx_{table_name}_{'_'.join(index['columns'])}")
+
+    @staticmethod
+    def index_sql(table_name: str, index: dict) -> str:
+        index_name = dbManager.index_name(table_name, index)
+        unique = "UNIQUE " if index.get("unique") else ""
+        return f"""CREATE {unique}INDEX IF NOT EXISTS {index_name} ON {table_name} ({', '.join(index['columns'])})"""
+
+    def explain_query_plan(self, sql: str, params: Optional[list] = None) -> list[str]:
+        with self.lock:
+            self.cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params if params else [])
+            return [row[-1] for row in self.cursor.fetchall()]
+
+    def create_db_from_schema(self, db_scheme: dict, force: bool = False) -> list[migrations.Step]:
+        """Create or migrate the tables of db_scheme in place, skipped when user_version shows it is applied"""
+        return migrations.migrate(self, db_scheme, force)
 
     def update_table(self, table: str, values: list, cols: Optional[list] = None) -> None:
         columns = f"({', '.join([str(col) for col in cols])})" if cols else ""
         markers = ",".join("?" for val in values)
         val_string = "VALUES" if cols else ""
         sql = f"""INSERT INTO {table}{columns} {val_string}({markers})"""
-        self.cursor.execute(sql, values)
-        self.conn.commit()
-
-    def read_table(self, table: str, columns: Optional[list] = None, filters: Optional[dict] = None) -> pd.DataFrame:
-        columns = ', '.join(str(col) for col in columns) if columns else "*"
-        sql = f"SELECT {columns} FROM {table}"
-        filter_values = []
-        if filters and len(filters) > 0:
-            filter_columns = [f"{str(key)} in(?)" for key in filters.keys()]
-            filter_statement = f" WHERE {(' AND ').join(filter_columns)}"
-            sql += filter_statement
-            filter_values = [str(val) for val in filters.values()]
-        self.cursor.execute(sql, filter_values)
-        rows = self.cursor.fetchall()
-        header_columns = [description[0] for description in self.cursor.description]
-        df = pd.DataFrame(rows, columns=header_columns)
+        started = time.perf_counter()
+        with self.lock:
+            self.cursor.execute(sql, values)
+            self.conn.commit()
+        self._record(sql, values, time.perf_counter() - started, 1)
+        self._table_written(table)
+
+    def insert_many(self, table: str, cols: Optional[list], rows: Union[pd.DataFrame, Iterable],
+                    batch_size: int = 5000, conflict: Optional[str] = None, upsert_on: Optional[list] = None) -> int:
+        """Insert rows with executemany, committing once per batch of batch_size rows
+
+        rows can be a DataFrame (cols defaults to its columns) or any iterable of row sequences.
+        conflict is an optional SQLite conflict clause, e.g. "REPLACE" or "IGNORE".
+        upsert_on names the columns of a unique key, rows colliding on it update the other columns in place.
+        Returns the number of rows written.
+        """
+        if isinstance(rows, pd.DataFrame):
+            cols = cols if cols else [str(col) for col in rows.columns]
+            rows = rows[cols].itertuples(index=False, name=None)
+        rows = iter(rows)
+        first_batch = list(islice(rows, batch_size))
+        if not first_batch:
+            return 0
+        columns = f"({', '.join([str(col) for col in cols])})" if cols else ""
+        markers = ",".join("?" for _ in (cols if cols else first_batch[0]))
+        or_conflict = f" OR {conflict}" if conflict else ""
+        sql = f"""INSERT{or_conflict} INTO {table}{columns} VALUES({markers})"""
+        if upsert_on:
+            updates = ", ".join(f"{col} = excluded.{col}" for col in cols if col not in upsert_on)
+            sql += f" ON CONFLICT({', '.join(upsert_on)}) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING")
+        written = 0
+        batch = first_batch
+        while batch:
+            started = time.perf_counter()
+            with self.lock:
+                try:
+                    self.cursor.executemany(sql, batch)
+                    self.conn.commit()
+                except sqlite3.Error:
+                    self.conn.rollback()
+                    raise
+            self._record(sql, list(batch[0]), time.perf_counter() - started, len(batch))
+            self._table_written(table)
+            written += len(batch)
+            batch = list(islice(rows, batch_size))
+        return written
+
+    def table_columns(self, table: str) -> list:
+        """Column names of table (plus rowid), cached until the schema changes"""
+        version = self.schema_version()
+        if self._columns_cache.get("version") != version:
+            self._columns_cache = {"version": version}
+        if table not in self._columns_cache:
+            self._columns_cache[table] = self.table_info(table)["name"].tolist() + ["rowid"]
+        return self._columns_cache[table]
+
+    def read_table(self, table: str, columns: Optional[list] = None, filters: Optional[dict] = None,
+                   order_by: Optional[Union[str, list]] = None, limit: Optional[int] = None,
+                   dtypes: Optional[dict] = None, arrow: bool = False) -> pd.DataFrame:
+        """SELECT with every filter, sort and limit done by SQLite, see where_clause for the filter format
+
+        order_by takes column names, prefixed with "-" for descending order. dtypes ({column: kind},
+        see tools.dtypes) gives typed columns instead of object ones, arrow returns Arrow-backed columns.
+        """
+        order_by = [order_by] if isinstance(order_by, str) else (order_by if order_by else [])
+        known = self.table_columns(table) if columns or filters or order_by else []
+        columns = check_columns(table, columns if columns else [], known)
+        sql = f"SELECT {', '.join(columns) if columns else '*'} FROM {table}"
+        where, filter_values = where_clause(filters if filters else {}, lambda cols: check_columns(table, cols, known))
+        if where:
+            sql += f" WHERE {where}"
+        if order_by:
+            sort_columns = check_columns(table, [column.lstrip("-") for column in order_by], known)
+            sql += " ORDER BY " + ", ".join(f"{name}{' DESC' if column.startswith('-') else ''}"
+                                            for name, column in zip(sort_columns, order_by))
+        if limit is not None:
+            sql += " LIMIT ?"
+            filter_values.append(int(limit))
+        df = self._fetch_df(sql, filter_values, dtypes, arrow)
+        return df
+
+    def read_query(self, sql: str, params: Optional[list] = None, dtypes: Optional[dict] = None,
+                   arrow: bool = False) -> pd.DataFrame:
+        df = self._fetch_df(sql, params if params else [], dtypes, arrow)
         return df
 
     def get_table_attributes(self):
         sql = "SELECT *  FROM sqlite_master"
-        self.cursor.execute(sql)
-        rows = self.cursor.fetchall()
-        header_columns = [description[0] for description in self.cursor.description]
+        with self.lock:
+            self.cursor.execute(sql)
+            rows = self.cursor.fetchall()
+            header_columns = [description[0] for description in self.cursor.description]
         df = pd.DataFrame(rows, columns=header_columns)
         return df
 
-    def remove_from_table(self):
-        raise NotImplemented
+    def schema_version(self) -> int:
+        """Counter SQLite bumps on every schema change, used to invalidate cached metadata"""
+        with self.lock:
+            self.cursor.execute("PRAGMA schema_version")
+            return self.cursor.fetchone()[0]
+
+    def execute_statements(self, table: str, statements: list[tuple[str, list]]) -> list[int]:
+        """Run (sql, params) statements writing to table in one transaction, returns their row counts"""
+        counts, timings = [], []
+        with self.lock:
+            try:
+                for sql, params in statements:
+                    started = time.perf_counter()
+                    self.cursor.execute(sql, params)
+                    counts.append(self.cursor.rowcount)
+                    timings.append(time.perf_counter() - started)
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+        for (sql, params), seconds, count in zip(statements, timings, counts):
+            self._record(sql, params, seconds, count)
+        self._table_written(table)
+        return counts
+
+    def table_info(self, table: str) -> pd.DataFrame:
+        return self.read_query(f"PRAGMA table_info({table})")
+
+    def foreign_key_list(self, table: str) -> pd.DataFrame:
+        return self.read_query(f"PRAGMA foreign_key_list({table})")
+
+    def remove_from_table(self, table: str, where: Union[str, dict], params: Optional[list] = None) -> int:
+        """Delete the rows matching where, an SQL condition with params or a filter dict as in read_table"""
+        if isinstance(where, dict):
+            where, params = where_clause(where, lambda cols: check_columns(table, cols, self.table_columns(table)))
+        sql = f"DELETE FROM {table} WHERE {where}"
+        started = time.perf_counter()
+        with self.lock:
+            self.cursor.execute(sql, params if params else [])
+            self.conn.commit()
+            removed = self.cursor.rowcount
+        self._record(sql, params, time.perf_counter() - started, removed)
+        self._table_written(table)
+        return removed
+
+    def page_key(self, table: str) -> list:
+        """Columns identifying a row in keyset order, the primary key of WITHOUT ROWID tables, else rowid"""
+        info = self.table_info(table)
+        primary_key = info.loc[info["pk"] > 0].sort_values("pk")["name"].tolist()
+        table_sql = self.read_query("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", [table])
+        if primary_key and "WITHOUT ROWID" in str(table_sql["sql"].iloc[0]).upper():
+            return primary_key
+        return ["rowid"]
+
+    def read_page(self, table: str, columns: Optional[list] = None, order_by: Optional[str] = None,
+                  descending: bool = False, after: Optional[tuple] = None, page_size: int = 100) -> Page:
+        """Up to page_size rows following the cursor after, in order_by then page_key order
+
+        The cursor holds the order_by value (when sorting) followed by the page key of the last row
+        of the previous page, so every page is a single seek on the key (or an index on order_by)
+        instead of an OFFSET scan over all earlier rows.
+        """
+        key = self.page_key(table)
+        sort_columns = ([order_by] if order_by else []) + key
+        hidden = [f"_page_{i}" for i in range(len(sort_columns))]
+        selected = ", ".join(f"{column} AS {alias}" for column, alias in zip(sort_columns, hidden))
+        sql = f"SELECT {', '.join(columns) if columns else '*'}, {selected} FROM {table}"
+        params = []
+        if after is not None:
+            compare = "<" if descending else ">"
+            key_markers = ", ".join("?" for _ in key)
+            after_key = list(after[1:] if order_by else after)
+            seek = f"({', '.join(key)}) {compare} ({key_markers})"
+            # NULLs sort first in SQLite, and row values holding a NULL never compare true
+            if not order_by:
+                sql += f" WHERE {seek}"
+                params = after_key
+            elif after[0] is None:
+                sql += f" WHERE ({order_by} IS NULL AND {seek})"
+                sql += "" if descending else f" OR {order_by} IS NOT NULL"
+                params = after_key
+            else:
+                sql += f" WHERE (({order_by}, {', '.join(key)}) {compare} (?, {key_markers})"
+                sql += f" OR {order_by} IS NULL)" if descending else ")"
+                params = [after[0]] + after_key
+        direction = " DESC" if descending else ""
+        sql += f" ORDER BY {', '.join(column + direction for column in sort_columns)} LIMIT ?"
+        df = self.read_query(sql, params + [page_size + 1])
+        has_next = len(df) > page_size
+        df = df.iloc[:page_size]
+        last = None
+        if not df.empty:
+            last = tuple(value.item() if hasattr(value, "item") else value for value in df[hidden].iloc[-1])
+            last = tuple(None if pd.isna(value) else value for value in last)
+        return Page(df.drop(columns=hidden).reset_index(drop=True), last, has_next)
+
+    def estimate_count(self, table: str, exact: bool = False) -> int:
+        """Row count of table without a full scan where possible
+
+        Uses the row count ANALYZE stored in sqlite_stat1, else MAX(rowid) (an upper bound once rows
+        were deleted), and only counts WITHOUT ROWID tables or exact requests with COUNT(*).
+        """
+        if not exact:
+            has_stats = self.read_query("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if not has_stats.empty:
+                stats = self.read_query("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", [table])
+                if not stats.empty:
+                    return int(str(stats["stat"].iloc[0]).split()[0])
+            if self.page_key(table) == ["rowid"]:
+                return int(self.read_query(f"SELECT IFNULL(MAX(rowid), 0) AS n FROM {table}")["n"].iloc[0])
+        return int(self.read_query(f"SELECT COUNT(*) AS n FROM {table}")["n"].iloc[0])
+
+    def backup_dir(self) -> str:
+        return os.path.join(os.path.dirname(os.path.abspath(self.db)), "backups")
+
+    def save_db(self, directory: Optional[str] = None, compress: bool = False, keep: Optional[int] = None,
+                wait: bool = False) -> backup.BackupJob:
+        """Back up the database on a background thread with the online backup API, see tools.backup
+
+        Backups go to directory (default: backups next to the database file), gzipped with compress;
+        keep removes all but the keep newest once the copy is done. wait blocks until it is.
+        """
+        directory = directory if directory else self.backup_dir()
+        job = backup.BackupJob(self.db, os.path.join(directory, backup.backup_name(self.db, compress=compress)),
+                               keep).start()
+        if wait:
+            job.result()
+        return job
+
+    def list_backups(self, directory: Optional[str] = None) -> list[str]:
+        return backup.list_backups(directory if directory else self.backup_dir(), self.db)
 
-    def save_db(self):
-        raise NotImplemented
+    def restore_db(self, backup_path: str) -> int:
+        """Replace the content of the database with a backup, returns the pages restored"""
+        if self.pool:
+            # pooled readers in a read transaction would make the restore fail with "database is locked"
+            with self.pool.exclusive() as conn:
+                pages = backup.restore_db(backup_path, conn)
+        else:
+            pages = backup.restore_db(backup_path, self.conn, self.lock)
+        # everything cached from the old content is stale now
+        restored = self.read_query("SELECT name FROM sqlite_master WHERE type = 'table'")["name"]
+        for table in set(self.table_versions) | set(restored):
+            self._table_written(table)
+        self._columns_cache.clear()
+        return pages
@@ -1,7 +1,22 @@
 """For graphical analysis and related"""
+from typing import Optional
 
-def create_bar_chart(**kwargs):
-    raise NotImplemented
+import altair as alt
+import pandas as pd
 
-def create_pie_chart(**kwargs):
-    raise NotImplemented
+
+def create_bar_chart(data: pd.DataFrame, x: str, y: str, color: Optional[str] = None,
+                     title: str = "") -> alt.Chart:
+    """Stacked bar chart of y over x, x is treated as time when it holds datetimes"""
+    x_type = "T" if pd.api.types.is_datetime64_any_dtype(data[x]) else "N"
+    encoding = {"x": alt.X(f"{x}:{x_type}", title=x), "y": alt.Y(f"{y}:Q", title=y, stack=True),
+                "tooltip": [column for column in (x, color, y) if column]}
+    if color:
+        encoding["color"] = alt.Color(f"{color}:N", title=color)
+    return alt.Chart(data, title=title).mark_bar().encode(**encoding)
+
+
+def create_pie_chart(data: pd.DataFrame, theta: str, color: str, title: str = "") -> alt.Chart:
+    return alt.Chart(data, title=title).mark_arc().encode(theta=alt.Theta(f"{theta}:Q", title=theta),
+                                                          color=alt.Color(f"{color}:N", title=color),
+                                                          tooltip=[color, theta])
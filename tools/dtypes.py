@@ -0,0 +1,85 @@
+"""Column dtypes for typed reads
+
+Every column gets a kind from its declared SQLite type, optionally overridden by a "dtype" entry of
+the column in the yaml schema:
+  int / float     INTEGER / REAL, int64 unless NULLs force float64
+  datetime        TEXT columns named *date*, parsed once to datetime64
+  category        repeated labels such as currency or type
+  text            other TEXT, turned into category when at most CATEGORY_RATIO of the values are distinct
+"""
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+KINDS = ("int", "float", "datetime", "category", "text")
+CATEGORY_RATIO = 0.5
+
+
+def kind_of(name: str, declared_type: str) -> str:
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        return "int"
+    if any(real in declared_type for real in ("REAL", "FLOA", "DOUB")):
+        return "float"
+    if "date" in name.lower():
+        return "datetime"
+    return "text"
+
+
+def column_kinds(columns: list, hints: Optional[dict] = None) -> dict:
+    """{column: kind} for table_metadata style columns, hints ({column: kind}) take precedence"""
+    kinds = {column["name"]: kind_of(column["name"], column["type"]) for column in columns}
+    for column, kind in (hints if hints else {}).items():
+        if kind not in KINDS:
+            raise ValueError(f"Unknown dtype '{kind}' for column '{column}', expected one of {KINDS}")
+        kinds[column] = kind
+    return kinds
+
+
+def schema_hints(scheme_dict: dict) -> dict:
+    """{table: {column: kind}} from the "dtype" entries of the yaml schema"""
+    return {table: {column["name"]: column["dtype"] for column in config["columns"] if "dtype" in column}
+            for table, config in scheme_dict["database"]["tables"].items()}
+
+
+def typed_chunk(df: pd.DataFrame, kinds: dict) -> pd.DataFrame:
+    for column in df.columns:
+        kind = kinds.get(column)
+        if kind in ("int", "float"):
+            values = pd.to_numeric(df[column], errors="coerce")
+            if kind == "int" and not values.isna().any():
+                df[column] = values.astype("int64")
+            else:
+                df[column] = values.astype("float64")
+        elif kind == "datetime":
+            df[column] = pd.to_datetime(df[column], format="ISO8601", errors="coerce")
+        elif kind == "category":
+            df[column] = df[column].astype("category")
+    return df
+
+
+def combine(chunks: list, kinds: dict, columns: list) -> pd.DataFrame:
+    """Concatenate typed chunks, merging the categories of category columns"""
+    if not chunks:
+        return typed_chunk(pd.DataFrame(columns=columns), kinds)
+    categorical = [column for column in columns if kinds.get(column) == "category"]
+    df = pd.concat([chunk.drop(columns=categorical) for chunk in chunks], ignore_index=True)
+    for column in categorical:
+        df[column] = pd.api.types.union_categoricals([chunk[column] for chunk in chunks])
+    for column in columns:
+        if kinds.get(column) == "int" and df[column].dtype != np.int64 and not df[column].isna().any():
+            df[column] = df[column].astype("int64")
+        elif kinds.get(column) == "text" and len(df) and df[column].nunique() <= CATEGORY_RATIO * len(df):
+            df[column] = df[column].astype("category")
+    return df[columns]
+
+
+def to_arrow(df: pd.DataFrame) -> pd.DataFrame:
+    """Arrow-backed copy of df, categories become dictionary arrays"""
+    try:
+        import pyarrow as pa
+    except ImportError as error:
+        raise ImportError("Arrow-backed reads need pyarrow, install it with 'pip install pyarrow'") from error
+    return pd.DataFrame({column: pd.arrays.ArrowExtensionArray(pa.array(df[column], from_pandas=True))
+                         for column in df.columns}, index=df.index)
@@ -0,0 +1,102 @@
+"""Currency conversion over the fx_rates table
+
+A row (nominator, denominator, rate) reads as 1 nominator = rate denominator, e.g. (EUR, USD, 1.08).
+Rates valid at a date (the latest quote on or before it) form a graph with both directions of
+every quoted pair. Pairs without a quote are triangulated through the pivot currency, or any
+other chain of quotes as a last resort. Resolved rates are kept in an LRU keyed on (pair, date).
+"""
+from collections import deque
+from functools import lru_cache
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from tools.dbtools import dbManager
+
+
+def date_key(date) -> str:
+    return pd.Timestamp(date).strftime("%Y-%m-%d")
+
+
+def rate_graph(quotes: Iterable[tuple]) -> dict:
+    """{currency: {currency: rate}} with both directions of every (nominator, denominator, rate) quote,
+    a quoted direction wins over the inverse of the opposite quote"""
+    quotes = [(nominator, denominator, float(rate)) for nominator, denominator, rate in quotes]
+    graph = {}
+    for nominator, denominator, rate in quotes:
+        graph.setdefault(nominator, {})[denominator] = rate
+    for nominator, denominator, rate in quotes:
+        graph.setdefault(denominator, {}).setdefault(nominator, 1 / rate)
+    return graph
+
+
+def resolve(graph: dict, nominator: str, denominator: str, pivot: str) -> float:
+    """Rate of nominator in denominator: quoted, through pivot or along the shortest chain of quotes"""
+    if nominator == denominator:
+        return 1.0
+    edges = graph.get(nominator, {})
+    if denominator in edges:
+        return edges[denominator]
+    if pivot in edges and denominator in graph.get(pivot, {}):
+        return edges[pivot] * graph[pivot][denominator]
+    # breadth first search for the shortest chain of quotes
+    queue = deque([(nominator, 1.0)])
+    visited = {nominator}
+    while queue:
+        currency, rate = queue.popleft()
+        for neighbour, edge_rate in graph.get(currency, {}).items():
+            if neighbour == denominator:
+                return rate * edge_rate
+            if neighbour not in visited:
+                visited.add(neighbour)
+                queue.append((neighbour, rate * edge_rate))
+    return np.nan
+
+
+class FxConverter:
+    def __init__(self, db_manager: dbManager, table: str = "fx_rates", pivot: str = "EUR",
+                 cache_size: int = 4096, graph_cache_size: int = 64) -> None:
+        self.db_manager = db_manager
+        self.table = table
+        self.pivot = pivot
+        self.graph = lru_cache(maxsize=graph_cache_size)(self._load_graph)
+        self._cached_rate = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def clear(self) -> None:
+        self.graph.cache_clear()
+        self._cached_rate.cache_clear()
+
+    def _load_graph(self, day: str) -> dict:
+        next_day = date_key(pd.Timestamp(day) + pd.Timedelta(days=1))
+        # bare columns next to MAX() come from the row holding the maximum in SQLite
+        sql = f"""SELECT nominator, denominator, rate, MAX(date) AS date FROM {self.table}
+                  WHERE date < ? AND rate IS NOT NULL AND rate != 0 GROUP BY nominator, denominator"""
+        df = self.db_manager.read_query(sql, [next_day])
+        return rate_graph(zip(df["nominator"], df["denominator"], df["rate"]))
+
+    def _resolve(self, nominator: str, denominator: str, day: str) -> float:
+        return resolve(self.graph(day), nominator, denominator, self.pivot)
+
+    def rate(self, nominator: str, denominator: str, date) -> float:
+        """Units of denominator per one nominator at date, NaN when the pair cannot be resolved"""
+        return self._cached_rate(nominator, denominator, date_key(date))
+
+    def convert(self, amounts, currencies, to_currency: str, dates) -> np.ndarray:
+        """Convert amounts given in currencies to to_currency
+
+        dates is either a single date or one date per amount. Rates are resolved once per distinct
+        (currency, date), the conversion itself is a single vectorized multiplication.
+        """
+        amounts = np.asarray(amounts, dtype="float64")
+        currencies = pd.Series(currencies).to_numpy(dtype=object)
+        if np.ndim(dates) == 0:
+            codes, uniques = pd.factorize(currencies)
+            rates = [self.rate(currency, to_currency, dates) for currency in uniques]
+        else:
+            days = pd.to_datetime(pd.Series(dates), format="ISO8601").dt.strftime("%Y-%m-%d").to_numpy(dtype=object)
+            codes, uniques = pd.MultiIndex.from_arrays([currencies, days]).factorize()
+            rates = [self._cached_rate(currency, to_currency, day) for currency, day in uniques]
+        # missing currencies get code -1, which picks the trailing NaN
+        rates = np.append(np.asarray(rates, dtype="float64"), np.nan)
+        return amounts * rates[codes]
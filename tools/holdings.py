@@ -0,0 +1,98 @@
+"""Materialized holdings
+
+The holdings table keeps one row per (date, acc_id, sec_id) with the account and security labels,
+the quantity of the latest positions snapshot on or before the date and the as-of price. A date is
+materialized with one INSERT ... SELECT over positions, securities, accounts and prices, so reading
+it back is a single lookup on the unique (date, acc_id, sec_id) index. When positions or prices
+change only the rows of the affected accounts or securities are rebuilt, on the materialized dates
+from the change on.
+"""
+from typing import Optional
+
+import pandas as pd
+
+from tools.dbtools import dbManager
+from tools.fx import date_key
+from tools.positions import latest_snapshots
+from tools.prices import MAX_QUERY_PARAMS
+
+COLUMNS = ["date", "acc_id", "sec_id", "account", "security", "type", "subtype", "quantity", "unit_price",
+           "total_price"]
+
+
+def holdings_date(date) -> str:
+    """Key of the holdings of the day of date, like positions snapshots dates"""
+    return dbManager.to_dbtime(pd.Timestamp(date).normalize().to_pydatetime())
+
+
+class HoldingsView:
+    def __init__(self, db_manager: dbManager, tables: Optional[dict] = None) -> None:
+        tables = tables if tables else {}
+        self.db_manager = db_manager
+        self.holdings = tables.get("holdings", "holdings")
+        self.positions = tables.get("positions", "positions")
+        self.securities = tables.get("securities", "securities")
+        self.accounts = tables.get("accounts", "accounts")
+        self.prices = tables.get("prices", "prices")
+
+    def dates(self, since=None) -> list:
+        """Materialized dates, from the day of since on"""
+        sql = f"SELECT DISTINCT date FROM {self.holdings}"
+        params = []
+        if since is not None:
+            sql += " WHERE date >= ?"
+            params.append(date_key(since))
+        return list(self.db_manager.read_query(sql + " ORDER BY date", params)["date"])
+
+    @staticmethod
+    def _in(column: str, values: Optional[list]) -> tuple[str, list]:
+        if values is None:
+            return "", []
+        return f" AND {column} IN ({','.join('?' for _ in values)})", [int(value) for value in values]
+
+    def refresh(self, date, acc_ids: Optional[list] = None, sec_ids: Optional[list] = None) -> int:
+        """Rebuild the holdings of date, only the rows of acc_ids and sec_ids when given; returns the rows written"""
+        if (acc_ids is not None and not len(acc_ids)) or (sec_ids is not None and not len(sec_ids)):
+            return 0
+        if sec_ids is not None and len(sec_ids) > MAX_QUERY_PARAMS:
+            sec_ids = list(sec_ids)
+            return sum(self.refresh(date, acc_ids, sec_ids[start:start + MAX_QUERY_PARAMS])
+                       for start in range(0, len(sec_ids), MAX_QUERY_PARAMS))
+        key = holdings_date(date)
+        next_day = date_key(pd.Timestamp(date) + pd.Timedelta(days=1))
+        account_filter, account_params = self._in("acc_id", acc_ids)
+        security_filter, security_params = self._in("p.sec_id", sec_ids)
+        delete_sql = f"DELETE FROM {self.holdings} WHERE date = ?{account_filter}{self._in('sec_id', sec_ids)[0]}"
+        latest_sql, latest_params = latest_snapshots(self.positions, self.accounts, next_day, acc_ids)
+        # positions of the latest snapshot per account, priced with a correlated as-of lookup on the prices key
+        insert_sql = f"""
+            INSERT INTO {self.holdings} ({', '.join(COLUMNS)})
+            SELECT ?, acc_id, sec_id, account, security, type, subtype, quantity, unit_price, quantity * unit_price
+            FROM (SELECT p.acc_id, p.sec_id, a.short_name AS account, s.short_name AS security, s.type, s.subtype,
+                         p.quantity,
+                         (SELECT pr.unit_price FROM {self.prices} pr WHERE pr.sec_id = p.sec_id AND pr.date < ?
+                          AND pr.unit_price IS NOT NULL ORDER BY pr.date DESC LIMIT 1) AS unit_price
+                  FROM {self.positions} p
+                  JOIN ({latest_sql}) latest ON p.acc_id = latest.acc_id AND p.date = latest.date
+                  LEFT JOIN {self.securities} s ON s.sec_id = p.sec_id
+                  LEFT JOIN {self.accounts} a ON a.id = p.acc_id
+                  WHERE p.quantity != 0{security_filter})"""
+        _, written = self.db_manager.execute_statements(self.holdings, [
+            (delete_sql, [key] + account_params + security_params),
+            (insert_sql, [key, next_day] + latest_params + security_params)])
+        return written
+
+    def refresh_affected(self, since=None, acc_ids: Optional[list] = None, sec_ids: Optional[list] = None) -> int:
+        """Rebuild the rows of acc_ids / sec_ids on every materialized date from since on"""
+        return sum(self.refresh(date, acc_ids, sec_ids) for date in self.dates(since))
+
+    def read(self, date, refresh: bool = False) -> pd.DataFrame:
+        """Holdings of date, materialized first when the date has no rows yet or refresh is set"""
+        key = holdings_date(date)
+        sql = f"SELECT {', '.join(COLUMNS)} FROM {self.holdings} WHERE date = ? ORDER BY acc_id, sec_id"
+        if not refresh:
+            holdings = self.db_manager.read_query(sql, [key])
+            if not holdings.empty:
+                return holdings
+        self.refresh(date)
+        return self.db_manager.read_query(sql, [key])
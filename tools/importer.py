@@ -0,0 +1,131 @@
+"""Streaming import of broker transaction exports into the transactions table"""
+import os
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Optional, Callable
+
+import pandas as pd
+
+from tools.request_builder import SessionManager
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ImportStats:
+    rows_read: int = 0
+    rows_written: int = 0
+    rows_skipped: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+    # rows skipped per reason, they add up to rows_skipped
+    skip_reasons: dict = field(default_factory=dict)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_written / self.seconds if self.seconds else 0.0
+
+
+def log_progress(stats: ImportStats) -> None:
+    logger.info(f"Imported {stats.rows_written} rows ({stats.rows_skipped} skipped) "
+                f"in {stats.seconds:.1f}s, {stats.rows_per_second:.0f} rows/s")
+
+
+class TransactionImporter:
+    """Reads a csv in chunks, maps its columns onto the transactions schema and writes one transaction per chunk
+
+    column_map maps csv headers to transactions columns. The values mapped onto sec_id and acc_id are
+    resolved through securities.<security_key> and accounts.<account_key>, loaded once into dicts.
+    """
+    def __init__(self, session_mgr: SessionManager, column_map: dict, chunksize: int = 50000,
+                 security_key: str = "isin_or_fx", account_key: str = "short_name",
+                 date_format: Optional[str] = None) -> None:
+        self.session_mgr = session_mgr
+        self.column_map = column_map
+        self.chunksize = chunksize
+        self.date_format = date_format
+        self.table = session_mgr.tables["transactions"]
+        self.column_types = self._schema_column_types()
+        unknown = [col for col in column_map.values() if col not in self.column_types]
+        if unknown:
+            raise ValueError(f"Columns {unknown} are not part of the '{self.table}' schema")
+        self.sec_lookup = self._lookup("securities", security_key, "sec_id")
+        self.acc_lookup = self._lookup("accounts", account_key, "id")
+
+    def _schema_column_types(self) -> dict:
+        columns = self.session_mgr.db_scheme()["database"]["tables"][self.table]["columns"]
+        return {col["name"]: col["type"] for col in columns
+                if not col["name"].upper().startswith("FOREIGN KEY") and not col.get("primary_key")}
+
+    def _lookup(self, table: str, key_column: str, id_column: str) -> dict:
+        df = self.session_mgr.read(self.session_mgr.tables[table], columns=[key_column, id_column])
+        return {str(key): int(value) for key, value in zip(df[key_column], df[id_column])}
+
+    def transform(self, chunk: pd.DataFrame, skip_reasons: Optional[dict] = None) -> pd.DataFrame:
+        """Rename, resolve ids and convert types of one chunk
+
+        Rows are dropped when their security or account is unknown, when a date or INTEGER cell is blank,
+        or when a cell cannot be converted to its column type; skip_reasons counts them per reason. One
+        bad row of a broker export never aborts the import.
+        """
+        skip_reasons = skip_reasons if skip_reasons is not None else {}
+        df = chunk.rename(columns=self.column_map)
+
+        def skip(mask: pd.Series, reason: str) -> pd.DataFrame:
+            if mask.any():
+                skip_reasons[reason] = skip_reasons.get(reason, 0) + int(mask.sum())
+            return df.loc[~mask]
+
+        if "sec_id" in df.columns:
+            df["sec_id"] = df["sec_id"].map(self.sec_lookup)
+        if "acc_id" in df.columns:
+            df["acc_id"] = df["acc_id"].map(self.acc_lookup)
+        resolved = [col for col in ("sec_id", "acc_id") if col in df.columns]
+        df = skip(df[resolved].isna().any(axis=1), "security or account could not be resolved")
+        for column in df.columns:
+            column_type = self.column_types[column]
+            if "date" in column.lower():
+                converted = pd.to_datetime(df[column], format=self.date_format, errors="coerce")
+                required = True
+            elif column_type in ("INTEGER", "REAL"):
+                converted = pd.to_numeric(df[column], errors="coerce")
+                # a blank price may stay NULL, a blank quantity may not
+                required = column_type == "INTEGER"
+            else:
+                continue
+            invalid = converted.isna() & (df[column].notna() | required)
+            df = skip(invalid, f"blank or invalid {column}")
+            converted = converted.loc[~invalid]
+            if "date" in column.lower():
+                df[column] = converted.dt.strftime("%Y-%m-%d")
+            elif column_type == "INTEGER":
+                df[column] = converted.astype("int64")
+            else:
+                df[column] = converted.astype("float64")
+        return df
+
+    def run(self, path: os.path, progress: Optional[Callable[[ImportStats], None]] = log_progress) -> ImportStats:
+        stats = ImportStats()
+        recorded_date = self.session_mgr.db_manager.to_dbtime()
+        start = time.perf_counter()
+        reader = pd.read_csv(path, usecols=list(self.column_map.keys()), dtype=str, chunksize=self.chunksize)
+        for chunk in reader:
+            df = self.transform(chunk, stats.skip_reasons)
+            if "recorded_date" in self.column_types and "recorded_date" not in df.columns:
+                df["recorded_date"] = recorded_date
+            stats.rows_read += len(chunk)
+            stats.rows_skipped += len(chunk) - len(df)
+            stats.rows_written += self.session_mgr.db_manager.insert_many(self.table, None, df,
+                                                                          batch_size=max(len(df), 1))
+            stats.chunks += 1
+            stats.seconds = time.perf_counter() - start
+            if progress:
+                progress(stats)
+        if stats.rows_skipped:
+            logger.warning(f"{stats.rows_skipped} rows skipped: "
+                           + ", ".join(f"{count} {reason}" for reason, count in stats.skip_reasons.items()))
+        if stats.rows_written:
+            # the table grew, let the planner see the new sizes
+            self.session_mgr.db_manager.optimize()
+        return stats
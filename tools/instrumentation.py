@@ -0,0 +1,103 @@
+"""Per-statement timing of the SQL run through dbManager
+
+Statements are grouped by their normalized text (literals and parameter lists folded into ?), and
+each group counts calls, total and worst latency, rows returned or written and the bytes of the
+DataFrames built from them (their columns' buffers, string contents are only measured for slow
+statements). A statement slower than slow_threshold seconds is logged together with
+its EXPLAIN QUERY PLAN and kept in a short list of recent offenders.
+"""
+import logging
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SLOW_THRESHOLD = 0.25
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """Statement text with literals replaced by ? and IN lists of any length folded into (?...)"""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PARAMETER_LIST.sub("(?...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+@dataclass
+class QueryStats:
+    sql: str
+    calls: int = 0
+    total_s: float = 0.0
+    max_s: float = 0.0
+    rows: int = 0
+    bytes: int = 0
+
+    @property
+    def mean_s(self) -> float:
+        return self.total_s / self.calls if self.calls else 0.0
+
+
+@dataclass
+class SlowQuery:
+    sql: str
+    seconds: float
+    plan: list
+
+
+class QueryRecorder:
+    def __init__(self, slow_threshold: Optional[float] = SLOW_THRESHOLD, keep_slow: int = 50,
+                 enabled: bool = True) -> None:
+        """slow_threshold None turns the slow query log off"""
+        self.slow_threshold = slow_threshold
+        self.enabled = enabled
+        self.slow = deque(maxlen=keep_slow)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, seconds: float, rows: int = 0, nbytes: int = 0) -> bool:
+        """Add one execution of sql, returns whether it was slow"""
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = QueryStats(key)
+            stats.calls += 1
+            stats.total_s += seconds
+            stats.max_s = max(stats.max_s, seconds)
+            # sqlite reports a row count of -1 for statements without one
+            stats.rows += rows if isinstance(rows, int) and rows > 0 else 0
+            stats.bytes += nbytes
+        return self.slow_threshold is not None and seconds >= self.slow_threshold
+
+    def record_slow(self, sql: str, seconds: float, plan: list) -> None:
+        self.slow.append(SlowQuery(normalize_sql(sql), seconds, plan))
+        logger.warning(f"Slow query ({seconds * 1000:.1f} ms): {normalize_sql(sql)}\n  plan: {' | '.join(plan)}")
+
+    def stats(self) -> pd.DataFrame:
+        """One row per normalized statement, the most expensive in total first"""
+        with self._lock:
+            rows = [(stats.sql, stats.calls, stats.total_s * 1000, stats.mean_s * 1000, stats.max_s * 1000,
+                     stats.rows, stats.bytes) for stats in self._stats.values()]
+        df = pd.DataFrame(rows, columns=["sql", "calls", "total_ms", "mean_ms", "max_ms", "rows", "bytes"])
+        return df.sort_values("total_ms", ascending=False, ignore_index=True)
+
+    def slow_queries(self) -> pd.DataFrame:
+        """The recent slow statements, the latest first"""
+        return pd.DataFrame([(query.sql, query.seconds * 1000, " | ".join(query.plan)) for query in reversed(self.slow)],
+                            columns=["sql", "ms", "plan"])
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self.slow.clear()
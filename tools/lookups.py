@@ -0,0 +1,75 @@
+"""Label lookups for foreign key pickers
+
+Only the key column and a few label columns of the referenced table are read, filtered in SQL by a
+search term and cut off with LIMIT. Results are cached per table and dropped as soon as the table is
+written to through the dbManager, see dbManager.table_version.
+"""
+from collections import OrderedDict
+from typing import Optional
+
+from tools.dbtools import dbManager
+
+DEFAULT_LIMIT = 100
+
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class LookupService:
+    def __init__(self, db_manager: dbManager, cache_size: int = 256) -> None:
+        self.db_manager = db_manager
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def _table_cache(self, table: str) -> OrderedDict:
+        version = self.db_manager.table_version(table)
+        if table not in self._cache or self._cache[table][0] != version:
+            self._cache[table] = (version, OrderedDict())
+        return self._cache[table][1]
+
+    def clear(self, table: Optional[str] = None) -> None:
+        if table is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(table, None)
+
+    def options(self, table: str, key_column: str, label_columns: Optional[list] = None, search: str = "",
+                limit: int = DEFAULT_LIMIT, prefix: bool = False) -> dict:
+        """{"key - label - ...": key} for up to limit rows of table
+
+        With a search term only rows where the key or a label column contains it (starts with it when
+        prefix is set) are returned, rows starting with the term come first.
+        """
+        label_columns = [column for column in (label_columns if label_columns else []) if column != key_column]
+        search = search.strip() if search else ""
+        cache = self._table_cache(table)
+        cache_key = (key_column, tuple(label_columns), search, limit, prefix)
+        if cache_key in cache:
+            cache.move_to_end(cache_key)
+            return cache[cache_key]
+
+        searched = [f"CAST({key_column} AS TEXT)"] + label_columns
+        sql = f"SELECT {', '.join([key_column] + label_columns)} FROM {table}"
+        params = []
+        if search:
+            starts_with = escape_like(search) + "%"
+            pattern = starts_with if prefix else "%" + starts_with
+            sql += " WHERE " + " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in searched)
+            sql += " ORDER BY (" + " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in searched) + ") DESC, "
+            params = [pattern] * len(searched) + [starts_with] * len(searched)
+        else:
+            sql += " ORDER BY "
+        sql += f"{key_column} LIMIT ?"
+        rows = self.db_manager.read_query(sql, params + [limit])
+        # python objects with None for NULL, numpy scalars do not bind as sqlite parameters
+        rows = rows.astype(object).where(rows.notna(), None)
+
+        options = {}
+        for row in rows.itertuples(index=False):
+            label = " - ".join(f"{value}" for value in row if value is not None)
+            options[label] = row[0]
+        cache[cache_key] = options
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return options
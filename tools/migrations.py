@@ -0,0 +1,233 @@
+"""Bring a live database in line with the yaml schema
+
+diff compares every table of the schema with the database and plans the cheapest steps that get
+there: missing tables and indexes are created, new plain columns are added with ALTER TABLE ADD
+COLUMN and indexes whose definition changed are recreated. Indexes the schema does not name are left
+alone. What SQLite cannot alter in place (a changed column type, primary key, AUTOINCREMENT, unique
+constraint, foreign key or table option, a removed column, a new key column) rebuilds that one table
+by copy and swap, as https://www.sqlite.org/lang_altertable.html describes. Tables the schema does
+not know are left alone. Before a new primary key, unique constraint or unique index, rows colliding
+on it are deleted, the newest (largest rowid) of each key is kept, so databases written by older
+versions still open.
+
+The hash of the applied schema is stored in PRAGMA user_version, so opening an up to date database
+costs a single pragma read instead of the comparison.
+"""
+import json
+import logging
+import re
+import sqlite3
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+TABLE_OPTIONS = ("primary_key", "unique", "indexes", "without_rowid", "strict")
+_FOREIGN_KEY = re.compile(r"FOREIGN KEY\s*\((?P<columns>[^)]*)\)", re.I)
+_REFERENCES = re.compile(r"REFERENCES\s+(?P<table>\w+)\s*\((?P<columns>[^)]*)\)", re.I)
+_AUTOINCREMENT = re.compile(r"\bAUTOINCREMENT\b", re.I)
+# declared type of a column, without the constraints that may follow it
+_CONSTRAINT = re.compile(r"\s+(?:CONSTRAINT|PRIMARY|NOT|NULL|UNIQUE|CHECK|DEFAULT|COLLATE|REFERENCES|GENERATED|AS)\b.*",
+                         re.I | re.S)
+
+
+@dataclass
+class Step:
+    table: str
+    action: str  # create_table, add_column, dedupe, create_index, drop_index or rebuild
+    statements: list[str]
+    reason: str = ""
+
+
+def schema_hash(scheme_dict: dict) -> int:
+    """Stable positive 31 bit hash of the tables of the schema, 0 stays the never migrated database"""
+    text = json.dumps(scheme_dict["database"]["tables"], sort_keys=True)
+    return zlib.crc32(text.encode()) & 0x7FFFFFFF or 1
+
+
+def _names(columns: str) -> tuple:
+    return tuple(column.strip() for column in columns.split(","))
+
+
+def _type(declared: str) -> str:
+    return _CONSTRAINT.sub("", declared).strip().upper()
+
+
+def expected_table(db_manager, table: str, definition: dict) -> dict:
+    """The shape a table of the schema should have, in the terms live_table reads the database in"""
+    columns, foreign_keys = {}, set()
+    primary_key = list(definition.get("primary_key") or [])
+    for column in definition["columns"]:
+        foreign_key = _FOREIGN_KEY.match(column["name"])
+        if foreign_key:
+            reference = _REFERENCES.match(column["type"])
+            foreign_keys.add((_names(foreign_key["columns"]), reference["table"], _names(reference["columns"])))
+            continue
+        columns[column["name"]] = column
+        if column.get("primary_key"):
+            primary_key.append(column["name"])
+    return {"columns": columns, "primary_key": tuple(primary_key),
+            "autoincrement": any(column.get("autoincrement") for column in columns.values()),
+            "unique": {tuple(unique) for unique in definition.get("unique") or []},
+            "foreign_keys": foreign_keys,
+            "indexes": {db_manager.index_name(table, index): (tuple(index["columns"]), bool(index.get("unique")))
+                        for index in definition.get("indexes") or []},
+            "without_rowid": bool(definition.get("without_rowid")), "strict": bool(definition.get("strict"))}
+
+
+def live_table(db_manager, table: str) -> Optional[dict]:
+    """Shape of table in the database, None when it does not exist"""
+    master = db_manager.read_query("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", [table])
+    if master.empty:
+        return None
+    info = db_manager.read_query(f"PRAGMA table_info({table})")
+    foreign_keys = db_manager.read_query(f"PRAGMA foreign_key_list({table})")
+    unique, indexes = set(), {}
+    for index in db_manager.read_query(f"PRAGMA index_list({table})").itertuples():
+        columns = tuple(db_manager.read_query(f"PRAGMA index_info({index.name})").sort_values("seqno")["name"])
+        if index.origin == "u":
+            unique.add(columns)
+        elif index.origin == "c":
+            indexes[index.name] = (columns, bool(index.unique))
+    options = master["sql"].iloc[0].rsplit(")", 1)[-1].upper()
+    return {"columns": dict(zip(info["name"], info["type"])),
+            "primary_key": tuple(info[info["pk"] > 0].sort_values("pk")["name"]),
+            "autoincrement": _AUTOINCREMENT.search(master["sql"].iloc[0]) is not None,
+            "unique": unique,
+            "foreign_keys": {(tuple(group["from"]), group["table"].iloc[0], tuple(group["to"]))
+                             for _, group in foreign_keys.sort_values(["id", "seq"]).groupby("id")},
+            "indexes": indexes, "without_rowid": "WITHOUT ROWID" in options, "strict": "STRICT" in options}
+
+
+def rebuild_reason(expected: dict, live: dict) -> str:
+    """Why the table cannot be altered in place, empty when ADD COLUMN and index changes are enough"""
+    removed = [column for column in live["columns"] if column not in expected["columns"]]
+    if removed:
+        return f"columns removed: {', '.join(removed)}"
+    changed = [name for name, column in expected["columns"].items()
+               if name in live["columns"] and _type(column["type"]) != _type(live["columns"][name])]
+    if changed:
+        return f"column types changed: {', '.join(changed)}"
+    keys = set(expected["primary_key"]).union(*expected["unique"])
+    new_keys = [name for name in expected["columns"] if name not in live["columns"] and name in keys]
+    if new_keys:
+        return f"new key columns: {', '.join(new_keys)}"
+    for part in ("primary_key", "autoincrement", "unique", "foreign_keys", "without_rowid", "strict"):
+        if expected[part] != live[part]:
+            return f"{part.replace('_', ' ')} changed"
+    return ""
+
+
+def dedupe_step(table: str, columns: tuple) -> Step:
+    """Delete the rows repeating columns of a newer row (a larger rowid), a new key cannot be added over them
+
+    Rows with a NULL key column are left alone, UNIQUE does not treat NULLs as equal.
+    """
+    keys = ", ".join(columns)
+    not_null = " AND ".join(f"{column} IS NOT NULL" for column in columns)
+    return Step(table, "dedupe", [f"DELETE FROM {table} WHERE {not_null} AND rowid NOT IN "
+                                  f"(SELECT MAX(rowid) FROM {table} GROUP BY {keys})"], f"duplicates on ({keys})")
+
+
+def new_keys(expected: dict, live: dict) -> list[tuple]:
+    """Primary key, unique constraints and unique indexes of expected the live table does not enforce yet"""
+    keys = []
+    if expected["primary_key"] and expected["primary_key"] != live["primary_key"]:
+        keys.append(expected["primary_key"])
+    keys += [unique for unique in expected["unique"] if unique not in live["unique"]]
+    keys += [columns for name, (columns, unique) in expected["indexes"].items()
+             if unique and live["indexes"].get(name) != (columns, unique)]
+    # columns the table does not have yet start out NULL, they cannot collide
+    return [key for key in keys if all(column in live["columns"] for column in key)]
+
+
+def diff(db_manager, scheme_dict: dict) -> list[Step]:
+    """Steps that turn the database into scheme_dict, empty when they already match"""
+    steps = []
+    for table, definition in scheme_dict["database"]["tables"].items():
+        options = {option: definition[option] for option in TABLE_OPTIONS if option in definition and option != "indexes"}
+        expected = expected_table(db_manager, table, definition)
+        index_sql = {db_manager.index_name(table, index): db_manager.index_sql(table, index)
+                     for index in definition.get("indexes") or []}
+        live = live_table(db_manager, table)
+        if live is None:
+            steps.append(Step(table, "create_table",
+                              [db_manager.table_sql(table, definition["columns"], **options), *index_sql.values()]))
+            continue
+        reason = rebuild_reason(expected, live)
+        # tables without rowid already have a primary key, and nothing to tell newer rows from older ones
+        if not live["without_rowid"]:
+            steps += [dedupe_step(table, key) for key in dict.fromkeys(new_keys(expected, live))]
+        if reason:
+            new_table = f"{table}_migrating"
+            common = ", ".join(column for column in expected["columns"] if column in live["columns"])
+            steps.append(Step(table, "rebuild", [
+                f"DROP TABLE IF EXISTS {new_table}",
+                db_manager.table_sql(new_table, definition["columns"], **options),
+                f"INSERT INTO {new_table} ({common}) SELECT {common} FROM {table}",
+                f"DROP TABLE {table}",
+                f"ALTER TABLE {new_table} RENAME TO {table}",
+                *index_sql.values()], reason))
+            continue
+        for name, column in expected["columns"].items():
+            if name not in live["columns"]:
+                steps.append(Step(table, "add_column", [f"ALTER TABLE {table} ADD COLUMN {name} {column['type']}"]))
+        for name, index in live["indexes"].items():
+            if name not in expected["indexes"]:
+                # created by hand or by an earlier schema, either way not ours to drop
+                logger.info(f"Migration: index {name} on {table} is not in the schema, left in place")
+            elif expected["indexes"][name] != index:
+                steps.append(Step(table, "drop_index", [f"DROP INDEX {name}"]))
+        for name, sql in index_sql.items():
+            if live["indexes"].get(name) != expected["indexes"][name]:
+                steps.append(Step(table, "create_index", [sql]))
+    return steps
+
+
+def apply(db_manager, steps: list[Step], version: Optional[int] = None) -> None:
+    """Run steps in one transaction and store version in PRAGMA user_version, all or nothing"""
+    rebuilt = [step.table for step in steps if step.action == "rebuild"]
+    with db_manager.lock:
+        conn = db_manager.conn
+        if conn.in_transaction:
+            conn.commit()
+        # foreign keys would cascade or fail on the DROP TABLE of a rebuild, they are checked at the end instead
+        if rebuilt:
+            conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            conn.execute("BEGIN")
+            for step in steps:
+                logger.info(f"Migration: {step.action} {step.table}{f' ({step.reason})' if step.reason else ''}")
+                for sql in step.statements:
+                    try:
+                        removed = conn.execute(sql).rowcount
+                    except sqlite3.IntegrityError as error:
+                        raise sqlite3.IntegrityError(f"{step.action} of {step.table} failed: {error}") from error
+                    if step.action == "dedupe" and removed > 0:
+                        logger.warning(f"Migration: removed {removed} rows of {step.table} with {step.reason}, "
+                                       f"the newest row of each key was kept")
+            for table in rebuilt:
+                if conn.execute(f"PRAGMA foreign_key_check({table})").fetchone():
+                    raise sqlite3.IntegrityError(f"rebuild of {table} left rows violating its foreign keys")
+            if version is not None:
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            if rebuilt:
+                conn.execute("PRAGMA foreign_keys = ON")
+    for table in {step.table for step in steps}:
+        db_manager._table_written(table)
+
+
+def migrate(db_manager, scheme_dict: dict, force: bool = False) -> list[Step]:
+    """Apply the diff to scheme_dict unless user_version says it was applied already, returns the steps run"""
+    version = schema_hash(scheme_dict)
+    if not force and db_manager.user_version() == version:
+        return []
+    steps = diff(db_manager, scheme_dict)
+    apply(db_manager, steps, version)
+    return steps
@@ -0,0 +1,189 @@
+"""Incremental positions engine
+
+Each account keeps a watermark (last processed tr_id and the date of its latest snapshot).
+A refresh only aggregates transactions dated after that snapshot and adds them to it. A full
+rebuild is done when there is no watermark yet, or when a transaction was inserted since the last
+run with a date at or before the snapshot (backdated); snapshots from that date on are dropped.
+Snapshots requested for dates before the watermark are computed in full and leave it untouched.
+After an update changed_from holds the earliest date whose snapshot changed, None if none did.
+The watermark counts on tr_id only growing, transactions.tr_id is AUTOINCREMENT so the id of a
+deleted transaction is never handed out again.
+"""
+from datetime import datetime
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from tools.dbtools import dbManager
+from tools.prices import MAX_QUERY_PARAMS
+
+
+def latest_snapshots(positions: str, accounts: str, before: str, acc_ids: Optional[list] = None) -> tuple[str, list]:
+    """(sql, params) of a query giving acc_id and date of the latest snapshot before the day before
+
+    The dates are looked up per account on the (acc_id, date, sec_id) key, so the cost does not grow
+    with the length of the history. Accounts without a snapshot get a NULL date.
+    """
+    sql = f"""SELECT a.id AS acc_id, (SELECT MAX(date) FROM {positions} WHERE acc_id = a.id AND date < ?) AS date
+              FROM {accounts} a"""
+    params = [before]
+    if acc_ids:
+        sql += f" WHERE a.id IN ({','.join('?' for _ in acc_ids)})"
+        params += [int(acc_id) for acc_id in acc_ids]
+    return sql, params
+
+
+def security_currencies(db_manager: dbManager, transactions: str, sec_ids: Iterable[int]) -> pd.Series:
+    """Currency per sec_id, the one of its most recent transaction that names one (NaN if none does)
+
+    Securities carry no currency of their own, every valuation takes it from here.
+    """
+    sec_ids = [int(sec_id) for sec_id in dict.fromkeys(sec_ids)]
+    chunks = [pd.DataFrame({"sec_id": pd.Series(dtype="int64"), "currency": pd.Series(dtype=object)})]
+    for start in range(0, len(sec_ids), MAX_QUERY_PARAMS):
+        chunk = sec_ids[start:start + MAX_QUERY_PARAMS]
+        sql = f"""SELECT sec_id, currency FROM (
+                      SELECT sec_id, currency, ROW_NUMBER() OVER (PARTITION BY sec_id ORDER BY date DESC, tr_id DESC) AS n
+                      FROM {transactions} WHERE sec_id IN ({",".join("?" for _ in chunk)}) AND currency IS NOT NULL)
+                  WHERE n = 1"""
+        chunks.append(db_manager.read_query(sql, chunk))
+    currencies = pd.concat(chunks, ignore_index=True).set_index("sec_id")["currency"]
+    return currencies.reindex(sec_ids)
+
+
+class PositionEngine:
+    def __init__(self, db_manager: dbManager, tables: Optional[dict] = None) -> None:
+        tables = tables if tables else {}
+        self.db_manager = db_manager
+        self.transactions = tables.get("transactions", "transactions")
+        self.positions = tables.get("positions", "positions")
+        self.watermarks = tables.get("position_watermarks", "position_watermarks")
+        self.changed_from = None
+
+    def watermark(self, acc_id: int) -> Optional[tuple]:
+        df = self.db_manager.read_query(f"SELECT last_tr_id, snapshot_date FROM {self.watermarks} WHERE acc_id = ?",
+                                        [acc_id])
+        if df.empty:
+            return None
+        return int(df.at[0, "last_tr_id"]), df.at[0, "snapshot_date"]
+
+    def snapshot(self, acc_id: int, date: str) -> pd.Series:
+        """Quantities per sec_id from the latest snapshot taken on or before date"""
+        sql = f"""SELECT sec_id, quantity FROM {self.positions}
+                  WHERE acc_id = ? AND date = (SELECT MAX(date) FROM {self.positions} WHERE acc_id = ? AND date <= ?)"""
+        df = self.db_manager.read_query(sql, [acc_id, acc_id, date])
+        return df.set_index("sec_id")["quantity"].astype("int64")
+
+    def _last_tr_id(self, acc_id: int) -> int:
+        df = self.db_manager.read_query(f"SELECT MAX(tr_id) AS last_tr_id FROM {self.transactions} WHERE acc_id = ?",
+                                        [acc_id])
+        value = df.at[0, "last_tr_id"]
+        return int(value) if pd.notna(value) else 0
+
+    def _backdated_from(self, acc_id: int, last_tr_id: int, snapshot_date: str) -> Optional[str]:
+        """Earliest date of transactions inserted after last_tr_id but dated at or before snapshot_date"""
+        sql = f"SELECT MIN(date) AS date FROM {self.transactions} WHERE acc_id = ? AND tr_id > ? AND date <= ?"
+        value = self.db_manager.read_query(sql, [acc_id, last_tr_id, snapshot_date]).at[0, "date"]
+        return value if pd.notna(value) else None
+
+    def _sum_transactions(self, acc_id: int, to_date: str, max_tr_id: int,
+                          from_date: Optional[str] = None) -> pd.Series:
+        sql = f"SELECT sec_id, SUM(quantity) AS quantity FROM {self.transactions} WHERE acc_id = ? AND date <= ? AND tr_id <= ?"
+        params = [acc_id, to_date, max_tr_id]
+        if from_date:
+            sql += " AND date > ?"
+            params.append(from_date)
+        df = self.db_manager.read_query(sql + " GROUP BY sec_id", params)
+        return df.set_index("sec_id")["quantity"].astype("int64")
+
+    def reset(self, acc_id: int, from_date: Optional[str] = None) -> None:
+        """Drop the watermark of acc_id, and its snapshots from from_date on, the next update rebuilds"""
+        if from_date:
+            self.db_manager.remove_from_table(self.positions, "acc_id = ? AND date >= ?", [acc_id, from_date])
+        self.db_manager.remove_from_table(self.watermarks, "acc_id = ?", [acc_id])
+
+    def update(self, acc_id: int, for_date: datetime) -> pd.DataFrame:
+        """Bring the positions of acc_id up to for_date and return the non-zero snapshot"""
+        db_date = dbManager.to_dbtime(for_date)
+        last_tr_id = self._last_tr_id(acc_id)
+        watermark = self.watermark(acc_id)
+        self.changed_from = None
+        if watermark:
+            backdated_from = self._backdated_from(acc_id, watermark[0], watermark[1])
+            if backdated_from:
+                # every snapshot from the backdated transaction on misses it
+                self.db_manager.remove_from_table(self.positions, "acc_id = ? AND date >= ?", [acc_id, backdated_from])
+                self.changed_from = backdated_from
+                watermark = None
+        if watermark and db_date < watermark[1]:
+            # historical snapshot, the watermark keeps pointing at the latest one
+            current = self._sum_transactions(acc_id, db_date, last_tr_id)
+            self._write_snapshot(acc_id, db_date, current, self.snapshot(acc_id, db_date))
+            return self._as_frame(acc_id, db_date, current)
+        if watermark:
+            previous = self.snapshot(acc_id, watermark[1])
+            delta = self._sum_transactions(acc_id, db_date, last_tr_id, from_date=watermark[1])
+            current = previous.add(delta, fill_value=0).astype("int64")
+            if not delta.empty:
+                self._write_snapshot(acc_id, db_date, current, previous)
+        else:
+            current = self._sum_transactions(acc_id, db_date, last_tr_id)
+            self._write_snapshot(acc_id, db_date, current, self.snapshot(acc_id, db_date))
+        self.db_manager.insert_many(self.watermarks, ["acc_id", "last_tr_id", "snapshot_date", "updated"],
+                                    [[acc_id, last_tr_id, db_date, dbManager.to_dbtime()]], conflict="REPLACE")
+        return self._as_frame(acc_id, db_date, current)
+
+    @staticmethod
+    def _as_frame(acc_id: int, db_date: str, quantities: pd.Series) -> pd.DataFrame:
+        quantities = quantities[quantities != 0]
+        return pd.DataFrame({"date": db_date, "acc_id": acc_id,
+                             "sec_id": quantities.index.astype("int64"), "quantity": quantities.values})
+
+    def _write_snapshot(self, acc_id: int, db_date: str, current: pd.Series, previous: pd.Series) -> None:
+        self.changed_from = min(self.changed_from, db_date) if self.changed_from else db_date
+        self.write_snapshot(acc_id, db_date, current, previous)
+
+    def write_snapshot(self, acc_id: int, db_date: str, current: pd.Series,
+                       previous: Optional[pd.Series] = None) -> int:
+        """Make the snapshot of acc_id at db_date hold exactly the non-zero quantities of current
+
+        Rows are upserted on the unique (date, acc_id, sec_id) key, so writing the same snapshot twice
+        changes nothing, and rows of a previous write of that date that are gone now are deleted. Zero
+        quantities are skipped; only when every position is closed are the closed ones (from current
+        and previous) kept as zero rows, so that the empty snapshot still exists and as-of reads do not
+        fall back to an older, still open, one.
+        """
+        snapshot = current[current != 0]
+        if snapshot.empty:
+            closed = current.index.union(previous[previous != 0].index if previous is not None else [])
+            snapshot = pd.Series(0, index=closed, dtype="int64")
+        rows = [[db_date, acc_id, int(sec_id), int(quantity)] for sec_id, quantity in snapshot.items()]
+        self.db_manager.insert_many(self.positions, ["date", "acc_id", "sec_id", "quantity"], rows,
+                                    upsert_on=["date", "acc_id", "sec_id"])
+        self.db_manager.remove_from_table(self.positions, {"acc_id": acc_id, "date": db_date,
+                                                           "sec_id": {"not_in": [row[2] for row in rows]}})
+        return len(rows)
+
+    def compact(self, acc_id: Optional[int] = None) -> int:
+        """Drop snapshots holding the same open positions as the previous snapshot of their account
+
+        As-of reads pick the latest snapshot on or before a date, so they find the identical earlier one
+        instead. Duplicate rows left by writes before the unique key existed never get here, the schema
+        migration removes them before it creates the key (see tools.migrations). Returns the number of
+        snapshots removed.
+        """
+        account_filter, params = ("acc_id = ?", [acc_id]) if acc_id is not None else ("1", [])
+        rows = self.db_manager.read_query(f"""SELECT acc_id, date, sec_id, quantity FROM {self.positions}
+                                              WHERE {account_filter} ORDER BY acc_id, date, sec_id""", params)
+        redundant = []
+        previous_acc_id, previous = None, None
+        for (snapshot_acc_id, date), snapshot in rows.groupby(["acc_id", "date"], sort=False):
+            held = frozenset((sec_id, quantity) for sec_id, quantity in zip(snapshot["sec_id"], snapshot["quantity"])
+                             if quantity != 0)
+            if snapshot_acc_id == previous_acc_id and held == previous:
+                redundant.append([int(snapshot_acc_id), date])
+            previous_acc_id, previous = snapshot_acc_id, held
+        if redundant:
+            self.db_manager.execute_statements(self.positions, [
+                (f"DELETE FROM {self.positions} WHERE acc_id = ? AND date = ?", snapshot) for snapshot in redundant])
+        return len(redundant)
@@ -0,0 +1,85 @@
+"""As-of price lookups backed by an in-memory, per-security sorted price index"""
+from typing import Optional, Iterable
+
+import numpy as np
+import pandas as pd
+
+from tools.dbtools import dbManager
+
+# stays well below SQLITE_MAX_VARIABLE_NUMBER on older builds
+MAX_QUERY_PARAMS = 900
+
+
+def to_datetime64(dates) -> pd.Series:
+    return pd.to_datetime(pd.Series(dates), format="ISO8601")
+
+
+class PriceIndex:
+    """Price history per sec_id as sorted numpy arrays
+
+    Histories are loaded on first use with one query per MAX_QUERY_PARAMS securities and kept until
+    invalidated, so repeated lookups only pay the binary search.
+    """
+    def __init__(self, db_manager: dbManager, table: str = "prices") -> None:
+        self.db_manager = db_manager
+        self.table = table
+        self._dates = {}
+        self._prices = {}
+
+    def __contains__(self, sec_id: int) -> bool:
+        return sec_id in self._dates
+
+    def load(self, sec_ids: Iterable[int]) -> None:
+        missing = sorted({int(sec_id) for sec_id in sec_ids} - self._dates.keys())
+        for start in range(0, len(missing), MAX_QUERY_PARAMS):
+            chunk = missing[start:start + MAX_QUERY_PARAMS]
+            markers = ",".join("?" for _ in chunk)
+            sql = f"""SELECT sec_id, date, unit_price FROM {self.table}
+                      WHERE sec_id IN ({markers}) AND unit_price IS NOT NULL ORDER BY sec_id, date"""
+            df = self.db_manager.read_query(sql, chunk)
+            sec_column = df["sec_id"].to_numpy(dtype="int64")
+            dates = to_datetime64(df["date"]).to_numpy(dtype="datetime64[ns]")
+            prices = df["unit_price"].to_numpy(dtype="float64")
+            sec_values, starts = np.unique(sec_column, return_index=True)
+            for sec_id, sec_dates, sec_prices in zip(sec_values, np.split(dates, starts[1:]),
+                                                     np.split(prices, starts[1:])):
+                self._dates[int(sec_id)] = sec_dates
+                self._prices[int(sec_id)] = sec_prices
+            for sec_id in set(chunk) - self._dates.keys():
+                self._dates[sec_id] = np.array([], dtype="datetime64[ns]")
+                self._prices[sec_id] = np.array([], dtype="float64")
+
+    def invalidate(self, sec_ids: Optional[Iterable[int]] = None) -> None:
+        if sec_ids is None:
+            self._dates.clear()
+            self._prices.clear()
+            return
+        for sec_id in sec_ids:
+            self._dates.pop(int(sec_id), None)
+            self._prices.pop(int(sec_id), None)
+
+    def lookup(self, sec_id: int, date) -> Optional[tuple]:
+        """(price_date, unit_price) of the latest price on or before date, None if there is none"""
+        self.load([sec_id])
+        dates = self._dates[int(sec_id)]
+        position = np.searchsorted(dates, np.datetime64(pd.Timestamp(date), "ns"), side="right") - 1
+        if position < 0:
+            return None
+        return pd.Timestamp(dates[position]), float(self._prices[int(sec_id)][position])
+
+    def lookup_many(self, pairs: pd.DataFrame) -> pd.DataFrame:
+        """As-of join of (sec_id, date) pairs against the index, rows keep the order of pairs"""
+        requested = pd.DataFrame({"sec_id": pairs["sec_id"].to_numpy(dtype="int64"),
+                                  "date": to_datetime64(pairs["date"]).to_numpy(dtype="datetime64[ns]")})
+        self.load(requested["sec_id"].unique())
+        sec_ids = requested["sec_id"].unique()
+        history = pd.DataFrame({
+            "sec_id": np.repeat(sec_ids, [len(self._dates[int(sec_id)]) for sec_id in sec_ids]).astype("int64"),
+            "price_date": np.concatenate([self._dates[int(sec_id)] for sec_id in sec_ids]
+                                         + [np.array([], dtype="datetime64[ns]")]),
+            "unit_price": np.concatenate([self._prices[int(sec_id)] for sec_id in sec_ids]
+                                         + [np.array([], dtype="float64")])})
+        requested["order"] = np.arange(len(requested))
+        merged = pd.merge_asof(requested.sort_values("date"), history.sort_values("price_date"),
+                               left_on="date", right_on="price_date", by="sec_id", direction="backward")
+        return merged.sort_values("order").drop(columns="order").reset_index(drop=True)
@@ -1,19 +1,55 @@
 """File that sticks together other components"""
 import os
-import yaml
 import logging
-from typing import Optional
+from typing import Optional, Union, TYPE_CHECKING
 import sqlite3
 import datetime
+import weakref
 
+import numpy as np
 import pandas as pd
 
 from tools import dbtools
+from tools import connections
+from tools import lookups
+from tools import dtypes
+from tools import instrumentation
+from tools import migrations
+from tools import backup
+
+# positions, holdings, prices, fx and timeseries are only needed once something is valued, they are
+# imported where they are used so the first page of the app does not wait for them
+if TYPE_CHECKING:
+    from tools import prices
+    from tools import fx
+
+logger = logging.getLogger(__name__)
+
+# next to the tools package, so it is found whatever the working directory
+DEFAULT_DB_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config",
+                                 "default_db.yaml")
+
+# queries on the hot paths that should be served from an index, see SessionManager.check_query_plans
+HOT_QUERIES = {
+    "transactions_by_account": ("SELECT sec_id, SUM(quantity) FROM transactions WHERE acc_id = ? AND date <= ? "
+                                "GROUP BY sec_id", [1, "9999-12-31"]),
+    "price_as_of": ("SELECT unit_price FROM prices WHERE sec_id = ? AND date <= ? ORDER BY date DESC LIMIT 1",
+                    [1, "9999-12-31"]),
+    "fx_rate_as_of": ("SELECT rate FROM fx_rates WHERE nominator = ? AND denominator = ? AND date <= ? "
+                      "ORDER BY date DESC LIMIT 1", ["EUR", "USD", "9999-12-31"]),
+    "positions_as_of": ("SELECT MAX(date) FROM positions WHERE acc_id = ? AND date <= ?", [1, "9999-12-31"]),
+    "types_options": ("SELECT value FROM types WHERE category = ? AND option = ?", ["accounts_col_values", "active"]),
+}
+
+# label columns shown next to the key in foreign key pickers, other tables use their TEXT columns
+LABEL_COLUMNS = {"accounts": ["short_name", "provider"],
+                 "securities": ["isin_or_fx", "short_name", "full_name"]}
 
 
 class SessionManager:
-    def __init__(self, db_path: Optional[os.path] = None, init_db_manager: bool = True) -> None:
-        self.default_db_config = os.path.join("config", "default_db.yaml")
+    def __init__(self, db_path: Optional[os.path] = None, init_db_manager: bool = True, use_pool: bool = False,
+                 connection_profile: Optional[dict] = None) -> None:
+        self.default_db_config = DEFAULT_DB_CONFIG
         self.default_db_name = "accounts"
         self.default_db_path = "db"
         self.tables = {"accounts": "accounts",
@@ -21,109 +57,467 @@ class SessionManager:
                        "transactions": "transactions",
                        "holdings": "holdings",
                        "positions": "positions",
+                       "position_watermarks": "position_watermarks",
                        "prices": "prices",
                        "aggregates": "aggregates",
                        "fx_rates": "fx_rates",
                        "types": "types"
                        }
-        self.db_path = self.default_db_path if db_path else os.path.join(self.default_db_path,
-                                                                         self.default_db_name)
-        self.db_manager = dbtools.dbManager(self.db_path) if init_db_manager else None
+        self.db_path = db_path if db_path else os.path.join(self.default_db_path, self.default_db_name)
+        self.base_currency = "EUR"
+        # with use_pool connections come from the process wide pool of the database, see tools.connections
+        self.use_pool = use_pool
+        self.pool = None
+        # connection pragmas, by default the profile selected in the database.connection section of the config
+        self.connection_profile = connection_profile if connection_profile is not None \
+            else connections.load_profile(self.default_db_config)
+        self.db_manager = self._open_db_manager() if init_db_manager else None
+        self._price_index = None
+        self._fx_converter = None
+        self._lookups = None
+        self._seen_versions = {}
+        self._scheme_dict = None
+        self._schema_cache = {"version": None}
         # self.db_manager = dbmanager_instance
 
+    def _open_db_manager(self) -> dbtools.dbManager:
+        if self.use_pool:
+            self.pool = connections.get_pool(self.db_path, profile=self.connection_profile)
+            # a session that is dropped without close (a Streamlit session ending) still releases the pool
+            self._release_pool = weakref.finalize(self, connections.release_pool, self.db_path)
+            return dbtools.dbManager(self.db_path, pool=self.pool)
+        return dbtools.dbManager(self.db_path, profile=self.connection_profile)
+
+    def close(self) -> None:
+        if self.db_manager:
+            self.db_manager.close()
+            self.db_manager = None
+        if self.pool:
+            # finalize runs once, a later garbage collection does not release the pool again
+            self._release_pool()
+            self.pool = None
+
     def initiate_db(self, db_path: Optional[str] = None, db_scheme: Optional[dict] = None) -> None:
         if not self.db_manager or (self.db_path != db_path and db_path):
-            self.db_path = db_path if db_path else self.db_path
-            self.db_manager = dbtools.dbManager(self.db_path)
+            self.set_db(db_path if db_path else self.db_path)
         scheme_dict = self.db_scheme(db_scheme) if db_scheme\
             else self.db_scheme(self.default_db_config)
-        self.create_tables_from_scheme_dict(scheme_dict)
+        self._scheme_dict = scheme_dict
+        self.db_manager.create_db_from_schema(scheme_dict)
 
     def db_scheme(self, db_scheme_path: Optional[os.path] = None) -> dict:
         if not db_scheme_path:
             db_scheme_path = self.default_db_config
-        with open(db_scheme_path) as file:
-            schema = yaml.safe_load(file)
-        return schema
+        return connections.load_yaml(db_scheme_path)
 
     def create_tables_from_scheme_dict(self, scheme_dict: dict) -> bool:
         for table, columns in scheme_dict['database']['tables'].items():
-            self.db_manager.create_table(table, columns['columns'])
+            options = {option: columns[option] for option in migrations.TABLE_OPTIONS if option in columns}
+            self.db_manager.create_table(table, columns['columns'], **options)
 
-    def add_entry(self, type: str, kwargs: dict, auto_timestamp_col: Optional[str] = None) -> None:
+    def add_entry(self, type: str, kwargs: Union[dict, list[dict]], auto_timestamp_col: Optional[list] = None) -> int:
+        """Write one entry (dict) or a batch of entries (list of dicts sharing the same keys, in any order)"""
         table_name = self.tables[type]
-        columns = [col for col in kwargs.keys()]
-        values = [val for val in kwargs.values()]
+        entries = [kwargs] if isinstance(kwargs, dict) else kwargs
+        if not entries:
+            return 0
+        columns = [col for col in entries[0].keys()]
+        for position, entry in enumerate(entries):
+            if entry.keys() != entries[0].keys():
+                raise ValueError(f"Entry {position} for {table_name} has the keys {sorted(entry)}, "
+                                 f"the batch has {sorted(columns)}")
+        rows = [[entry[col] for col in columns] for entry in entries]
         if auto_timestamp_col:
-            timestamp_column = [self.db_manager.to_dbtime()]
+            timestamp = self.db_manager.to_dbtime()
             columns += auto_timestamp_col
-            values += timestamp_column
-        self.db_manager.update_table(table_name, values, columns)
+            rows = [row + [timestamp] for row in rows]
+        written = self.db_manager.insert_many(table_name, columns, rows)
+        if type == "prices" and "date" in columns:
+            dates = [pd.Timestamp(row[columns.index("date")]) for row in rows]
+            self.refresh_holdings(sec_ids={row[columns.index("sec_id")] for row in rows}, since=min(dates))
+        return written
+
+    def _cached_schema(self, key: str, build) -> object:
+        """Schema derived values, rebuilt only when PRAGMA schema_version moves"""
+        version = self.db_manager.schema_version()
+        if self._schema_cache["version"] != version:
+            self._schema_cache = {"version": version}
+        if key not in self._schema_cache:
+            self._schema_cache[key] = build()
+        return self._schema_cache[key]
 
     def communicate_table_attributes(self, type: Optional[str] = None) -> dict:
-        raw_schema = self.db_manager.get_table_attributes()
-        raw_schema["tbl_scheme"] = raw_schema.apply(lambda row: row["sql"][(row["sql"].find("(") + 1):-1], axis=1)
-        schema = raw_schema[["tbl_name", "tbl_scheme"]].copy()
+        schema = self._cached_schema("table_attributes", self._table_attributes)
         if type:
             table_name = self.tables[type]
-            schema = schema.loc[schema["tbl_name"] == table_name]
+            schema = {key: value for key, value in schema.items() if key == table_name}
+        return schema
+
+    def _table_attributes(self) -> dict:
+        raw_schema = self.db_manager.get_table_attributes()
+        raw_schema = raw_schema.loc[raw_schema["type"] == "table"].copy()
+        raw_schema["tbl_scheme"] = raw_schema.apply(lambda row: row["sql"][(row["sql"].find("(") + 1):
+                                                                           row["sql"].rfind(")")], axis=1)
+        schema = raw_schema[["tbl_name", "tbl_scheme"]].copy()
         schema = {key: value for d in schema.set_index("tbl_name").to_dict().values() for key, value in d.items()}
         return schema
 
+    def table_metadata(self, type: Optional[str] = None) -> dict:
+        """Columns and foreign keys per table from PRAGMA table_info/foreign_key_list
+
+        {table: {"columns": [{"name", "type", "notnull", "pk"}, ...], "foreign_keys": {column: (table, column)}}}
+        """
+        metadata = self._cached_schema("table_metadata", self._table_metadata)
+        if type:
+            return {self.tables[type]: metadata[self.tables[type]]}
+        return metadata
+
+    def _table_metadata(self) -> dict:
+        tables = self.db_manager.read_query("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                            "AND name NOT LIKE 'sqlite_%'")["name"]
+        metadata = {}
+        for table in tables:
+            columns = self.db_manager.table_info(table)
+            foreign_keys = self.db_manager.foreign_key_list(table)
+            metadata[table] = {
+                "columns": [{"name": name, "type": column_type, "notnull": bool(notnull), "pk": int(pk)}
+                            for name, column_type, notnull, pk in
+                            zip(columns["name"], columns["type"], columns["notnull"], columns["pk"])],
+                "foreign_keys": {column: (ref_table, ref_column) for column, ref_table, ref_column in
+                                 zip(foreign_keys["from"], foreign_keys["table"], foreign_keys["to"])}}
+        return metadata
+
+    def form_config(self, type: str) -> tuple[dict, dict]:
+        """(column config, foreign key options) for formfactory, in the format of util.parse_column_config
+        and util.restricted_column_options, built once per schema version"""
+        return self._cached_schema(f"form_config:{type}", lambda: self._form_config(type))
+
+    def _form_config(self, type: str) -> tuple[dict, dict]:
+        metadata = self.table_metadata(type)[self.tables[type]]
+        single_primary_key = sum(1 for column in metadata["columns"] if column["pk"]) == 1
+        parsed_config = {}
+        for column in metadata["columns"]:
+            if column["pk"] and single_primary_key:
+                continue
+            parsed_config[column["name"]] = "DATE" if "date" in column["name"].lower() else column["type"]
+        restricted_value_columns = {}
+        for column, (ref_table, ref_column) in metadata["foreign_keys"].items():
+            parsed_config[f"FOREIGN KEY({column})"] = f"REFERENCES {ref_table}({ref_column})"
+            restricted_value_columns[column] = {ref_table: ref_column}
+        return parsed_config, restricted_value_columns
+
+    def optimize(self, analyze: bool = False) -> None:
+        self.db_manager.optimize(analyze)
+
+    def save_db(self, compress: bool = False, keep: Optional[int] = None, wait: bool = False) -> backup.BackupJob:
+        """Back up the current database on a background thread, see dbManager.save_db"""
+        return self.db_manager.save_db(compress=compress, keep=keep, wait=wait)
+
+    def list_backups(self) -> list[str]:
+        return self.db_manager.list_backups()
+
+    def restore_db(self, backup_path: str) -> int:
+        """Replace the current database with a backup, returns the pages restored
+
+        A backup taken with an older schema is migrated right away, the user_version it brings along
+        would not tell.
+        """
+        pages = self.db_manager.restore_db(backup_path)
+        self.db_manager.create_db_from_schema(self._scheme_dict if self._scheme_dict else self.db_scheme(),
+                                              force=True)
+        self._price_index = None
+        self._fx_converter = None
+        self._lookups = None
+        self._schema_cache = {"version": None}
+        return pages
+
+    def query_recorder(self) -> instrumentation.QueryRecorder:
+        """Statement timings of the current database, see tools.instrumentation"""
+        return self.db_manager.recorder
+
     def list_of_tables_in_db(self) -> list:
         scheme_dict = self.communicate_table_attributes()
         return [key for key in scheme_dict.keys()]
 
+    def check_query_plans(self, queries: Optional[dict] = None) -> dict:
+        """Run EXPLAIN QUERY PLAN on the hot queries and report whether each one is served from an index"""
+        results = {}
+        for name, (sql, params) in (queries if queries else HOT_QUERIES).items():
+            plan = self.db_manager.explain_query_plan(sql, params)
+            full_scan = any(step.startswith("SCAN") and " USING " not in step for step in plan)
+            results[name] = {"plan": plan, "uses_index": not full_scan and any(" USING " in step for step in plan)}
+        return results
+
     def update_positions(self, acc_id: int, for_date: datetime,
                          from_transaction_date: Optional[datetime] = None,
-                         from_latest_holding: Optional[datetime] = None):
-        table = self.tables["transactions"]
-        filters = {"acc_id": acc_id}
+                         from_latest_holding: Optional[datetime] = None) -> pd.DataFrame:
+        """Snapshot of acc_id at for_date, written by the PositionEngine like every other snapshot
+
+        from_transaction_date drops the snapshots from that date on and rebuilds from the transactions,
+        for changes the engine cannot notice (edited or deleted transactions).
+        """
+        from tools import positions
+        engine = positions.PositionEngine(self.db_manager, self.tables)
+        rebuilt_from = self.db_manager.to_dbtime(from_transaction_date) if from_transaction_date else None
         if from_transaction_date:
-            filters["date"] = dbtools.dbManager.to_dbtime(from_transaction_date)
-        transactions = self.db_manager.read_table(table, filters=filters)
-        aggregated = transactions.groupby('sec_id').agg({'quantity': 'sum'}).reset_index()
-        for index, row in aggregated.iterrows():
-            values = [self.db_manager.to_dbtime(for_date), acc_id, int(row['sec_id']), int(row["quantity"])]
-            self.db_manager.update_table(self.tables["positions"], values)
-
-    def read(self, table: str, columns: Optional[list] = None, filters: Optional[dict] = None) -> pd.DataFrame:
-        df = self.db_manager.read_table(table=table, columns=columns, filters=filters)
+            engine.reset(acc_id, rebuilt_from)
+        snapshot = engine.update(acc_id, for_date)
+        changed = [date for date in (rebuilt_from, engine.changed_from) if date]
+        if changed:
+            self.refresh_holdings(acc_ids=[acc_id], since=min(changed))
+        return snapshot
+
+    def refresh_positions(self, acc_id: int, for_date: datetime.datetime) -> pd.DataFrame:
+        """Bring the positions of acc_id up to for_date incrementally, see tools.positions"""
+        return self.update_positions(acc_id, for_date)
+
+    def compact_positions(self, acc_id: Optional[int] = None) -> int:
+        """Drop position snapshots that repeat the previous one, see PositionEngine.compact"""
+        from tools import positions
+        return positions.PositionEngine(self.db_manager, self.tables).compact(acc_id)
+
+    def refresh_holdings(self, date: Optional[datetime.datetime] = None, acc_ids: Optional[list] = None,
+                         sec_ids: Optional[list] = None, since: Optional[datetime.datetime] = None) -> int:
+        """Rebuild materialized holdings, see tools.holdings
+
+        With a date that date is materialized, otherwise the already materialized dates from since on
+        are brought up to date. acc_ids / sec_ids limit the rebuild to the rows of those accounts or
+        securities. Returns the number of rows written.
+        """
+        from tools import holdings
+        view = holdings.HoldingsView(self.db_manager, self.tables)
+        if date is not None:
+            return view.refresh(date, acc_ids, sec_ids)
+        return view.refresh_affected(since, acc_ids, sec_ids)
+
+    def read_page(self, table: str, columns: Optional[list] = None, order_by: Optional[str] = None,
+                  descending: bool = False, after: Optional[tuple] = None, page_size: int = 100) -> dbtools.Page:
+        return self.db_manager.read_page(table, columns, order_by, descending, after, page_size)
+
+    def estimate_count(self, table: str) -> int:
+        return self.db_manager.estimate_count(table)
+
+    def table_columns(self, table: str) -> list:
+        return [column["name"] for column in self.table_metadata()[table]["columns"]]
+
+    def column_kinds(self, table: str) -> dict:
+        """{column: kind} of table for typed reads, from the declared column types and the yaml dtype hints"""
+        if self._scheme_dict is None and os.path.exists(self.default_db_config):
+            self._scheme_dict = self.db_scheme()
+        return self._cached_schema(f"column_kinds:{table}", lambda: dtypes.column_kinds(
+            self.table_metadata()[table]["columns"],
+            dtypes.schema_hints(self._scheme_dict).get(table) if self._scheme_dict else None))
+
+    def read(self, table: str, columns: Optional[list] = None, filters: Optional[dict] = None,
+             order_by: Optional[Union[str, list]] = None, limit: Optional[int] = None,
+             typed: bool = False, arrow: bool = False) -> pd.DataFrame:
+        """Filtered read of table, see dbtools.where_clause for the filter format
+
+        typed gives numeric, datetime64 and category columns (see tools.dtypes) instead of objects,
+        arrow the same as Arrow-backed columns.
+        """
+        if typed or arrow:
+            return self.db_manager.read_table(table=table, columns=columns, filters=filters, order_by=order_by,
+                                              limit=limit, dtypes=self.column_kinds(table), arrow=arrow)
+        df = self.db_manager.read_table(table=table, columns=columns, filters=filters, order_by=order_by, limit=limit)
         return df
 
-    def generate_summary(self) -> pd.DataFrame:
-        raise NotImplemented
+    def generate_summary(self, date: Optional[datetime.datetime] = None,
+                         base_currency: Optional[str] = None) -> pd.DataFrame:
+        """Valuation subtotals per account/type/currency, per account, per type, per currency and in total
 
-    def generate_chart(self):
-        raise NotImplemented
+        Rows of a coarser grouping have "All" in the columns they are not grouped by.
+        market_value is only summed within one currency, base_value is in base_currency. unvalued counts
+        the positions left out of the sums for a missing price or FX rate, they are logged as a warning.
+        """
+        valued = self.aggregate_accounts(date, base_currency=base_currency)
+        unvalued = valued.loc[valued["missing"].notna()]
+        if not unvalued.empty:
+            logger.warning(f"Summary leaves out {len(unvalued)} positions without a value: "
+                           + ", ".join(f"sec_id {sec_id} ({missing})"
+                                       for sec_id, missing in zip(unvalued["sec_id"], unvalued["missing"])))
+        valued["unvalued"] = valued["missing"].notna().astype("int64")
+        levels = ["account", "type", "currency"]
+        for level in levels:
+            valued[level] = valued[level].astype(object).fillna("n/a").astype("category")
+        grouping_sets = [levels, ["account"], ["type"], ["currency"], []]
+        summaries = []
+        for grouping in grouping_sets:
+            if grouping:
+                grouped = valued.groupby(grouping, sort=True, observed=True).agg(
+                    positions=("sec_id", "size"), unvalued=("unvalued", "sum"), market_value=("market_value", "sum"),
+                    base_value=("base_value", "sum")).reset_index()
+            else:
+                grouped = pd.DataFrame({"positions": [len(valued)], "unvalued": [valued["unvalued"].sum()],
+                                        "market_value": [np.nan], "base_value": [valued["base_value"].sum()]})
+            for level in levels:
+                grouped[level] = grouped[level].astype(object) if level in grouping else "All"
+            if "currency" not in grouping:
+                grouped["market_value"] = np.nan
+            summaries.append(grouped)
+        summary = pd.concat(summaries, ignore_index=True)[levels + ["positions", "unvalued", "market_value",
+                                                                    "base_value"]]
+        summary["base_currency"] = base_currency if base_currency else self.base_currency
+        return summary
+
+    def value_history(self, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+                      base_currency: Optional[str] = None, acc_ids: Optional[list] = None) -> pd.DataFrame:
+        """Daily value per account and in total, see tools.timeseries"""
+        from tools import timeseries
+        history = timeseries.PortfolioHistory(self.db_manager, self.tables, pivot=self.base_currency)
+        return history.values(start, end, base_currency if base_currency else self.base_currency, acc_ids)
+
+    def generate_chart(self, kind: str = "history", start: Optional[datetime.date] = None,
+                       end: Optional[datetime.date] = None, base_currency: Optional[str] = None):
+        """"history": daily value per account as stacked bars, "allocation": current value per security type"""
+        # altair takes longer to import than the rest of the data layer, only charts need it
+        from tools import display
+        base_currency = base_currency if base_currency else self.base_currency
+        if kind == "allocation":
+            valued = self.aggregate_accounts(end, base_currency=base_currency)
+            allocation = valued.groupby(valued["type"].fillna("n/a"))["base_value"].sum().reset_index()
+            return display.create_pie_chart(allocation, theta="base_value", color="type",
+                                            title=f"Allocation ({base_currency})")
+        history = self.value_history(start, end, base_currency).drop(columns="total")
+        accounts = self.read(self.tables["accounts"], columns=["id", "short_name"])
+        history = history.rename(columns=dict(zip(accounts["id"], accounts["short_name"])))
+        long = history.reset_index().melt(id_vars="date", var_name="account", value_name="value")
+        return display.create_bar_chart(long, x="date", y="value", color="account",
+                                        title=f"Portfolio value ({base_currency})")
 
     def browse_data(self) -> pd.DataFrame:
         raise NotImplemented
 
-    def get_closest_price(self):
-        raise NotImplemented
+    def _written_since_last_check(self, type: str) -> bool:
+        version = self.db_manager.table_version(self.tables[type])
+        written = self._seen_versions.get(type, version) != version
+        self._seen_versions[type] = version
+        return written
+
+    def price_index(self) -> "prices.PriceIndex":
+        if self._price_index is None:
+            from tools import prices
+            self._price_index = prices.PriceIndex(self.db_manager, self.tables["prices"])
+        if self._written_since_last_check("prices"):
+            self._price_index.invalidate()
+        return self._price_index
+
+    def fx_converter(self) -> "fx.FxConverter":
+        if self._fx_converter is None:
+            from tools import fx
+            self._fx_converter = fx.FxConverter(self.db_manager, self.tables["fx_rates"], pivot=self.base_currency)
+        if self._written_since_last_check("fx_rates"):
+            self._fx_converter.clear()
+        return self._fx_converter
+
+    def label_columns(self, table: str) -> list:
+        if table in LABEL_COLUMNS:
+            return LABEL_COLUMNS[table]
+        columns = self.table_metadata()[table]["columns"]
+        return [column["name"] for column in columns
+                if column["type"].upper() == "TEXT" and not column["pk"] and "date" not in column["name"].lower()][:2]
+
+    def lookup_options(self, table: str, column: str, search: str = "", limit: int = lookups.DEFAULT_LIMIT) -> dict:
+        """{label: value of column} for foreign key pickers, at most limit rows matching search"""
+        if self._lookups is None:
+            self._lookups = lookups.LookupService(self.db_manager)
+        return self._lookups.options(table, column, self.label_columns(table), search=search, limit=limit)
+
+    def get_closest_price(self, sec_ids: Union[pd.DataFrame, list], date: Optional[datetime.datetime] = None
+                          ) -> pd.DataFrame:
+        """Latest price on or before the date for every (sec_id, date) pair
+
+        sec_ids is either a DataFrame with sec_id and date columns, a list of (sec_id, date) tuples
+        or a list of sec_ids looked up at date. Returns sec_id, date, price_date and unit_price per pair,
+        price_date/unit_price are NaN where no earlier price exists.
+        """
+        if isinstance(sec_ids, pd.DataFrame):
+            pairs = sec_ids[["sec_id", "date"]]
+        elif date is not None:
+            pairs = pd.DataFrame({"sec_id": list(sec_ids), "date": date})
+        else:
+            pairs = pd.DataFrame(list(sec_ids), columns=["sec_id", "date"])
+        return self.price_index().lookup_many(pairs)
 
     def add_sec_info(self):
         raise NotImplemented
 
-    def aggregate_accounts(self, date, account):
-        raise NotImplemented
-        # collect open positions
-        # get prices
-        # get FX rates
-        # aggregate
+    def positions_at(self, date: Optional[datetime.datetime] = None, acc_ids: Optional[list] = None) -> pd.DataFrame:
+        """Open positions from the latest snapshot of each account on or before date, with the security's
+        details, its as-of price and its currency (see positions.security_currencies)
 
-    def get_holdings(self, date: datetime.datetime) -> pd.DataFrame:
-        raise NotImplemented
+        The position rows only carry ids and quantities; the text columns are read once per security and
+        account and aligned to them with an index lookup, which keeps the wide result out of SQLite. Prices
+        come from the in-memory PriceIndex, price_date is NaN where a security has no price up to date.
+        """
+        from tools import fx
+        from tools import positions
+        day = pd.Timestamp(date if date else datetime.datetime.now()).normalize()
+        next_day = fx.date_key(day + pd.Timedelta(days=1))
+        latest_sql, params = positions.latest_snapshots(self.tables["positions"], self.tables["accounts"], next_day,
+                                                        acc_ids)
+        held_sql = f"""SELECT p.acc_id, p.sec_id, p.quantity FROM {self.tables["positions"]} p
+                       JOIN ({latest_sql}) latest ON p.acc_id = latest.acc_id AND p.date = latest.date
+                       WHERE p.quantity != 0"""
+        held = self.db_manager.read_query(held_sql, params)
+        sec_ids = held["sec_id"].unique()
+        securities = self.db_manager.read_table(self.tables["securities"], ["sec_id", "short_name", "type", "subtype"],
+                                                filters={"sec_id": [int(sec_id) for sec_id in sec_ids]})
+        securities = securities.rename(columns={"short_name": "security"}).set_index("sec_id").reindex(sec_ids)
+        securities["currency"] = positions.security_currencies(self.db_manager, self.tables["transactions"], sec_ids)
+        as_of = self.price_index().lookup_many(pd.DataFrame({"sec_id": sec_ids, "date": day}))
+        securities["price_date"] = as_of["price_date"].to_numpy()
+        securities["unit_price"] = as_of["unit_price"].to_numpy()
+        accounts = self.db_manager.read_query(f"SELECT id, short_name AS account FROM {self.tables['accounts']}")
+        accounts = accounts.set_index("id")["account"]
+        positions_at = pd.DataFrame({"acc_id": held["acc_id"], "account": held["acc_id"].map(accounts),
+                                     "sec_id": held["sec_id"]})
+        security_rows = securities.index.get_indexer(held["sec_id"])
+        for column in ["security", "type", "subtype"]:
+            positions_at[column] = securities[column].to_numpy()[security_rows]
+        positions_at["quantity"] = held["quantity"]
+        for column in ["currency", "price_date", "unit_price"]:
+            positions_at[column] = securities[column].to_numpy()[security_rows]
+        return positions_at
 
-    def insert_custom_value(self):
-        raise NotImplemented
+    def aggregate_accounts(self, date: Optional[datetime.datetime] = None, account: Optional[Union[int, list]] = None,
+                           base_currency: Optional[str] = None) -> pd.DataFrame:
+        """Value every open position at date in one pass: positions, as-of prices and FX rates come in as
+        aligned columns and are combined without a loop per security
 
-    def generate_chart(self):
-        raise NotImplemented
+        missing names what a position without a base_value lacks, "price" or "fx_rate", NaN when it has one.
+        """
+        date = date if date else datetime.datetime.now()
+        base_currency = base_currency if base_currency else self.base_currency
+        acc_ids = [account] if isinstance(account, int) else account
+        valued = self.positions_at(date, acc_ids)
+        valued["unit_price"] = valued["unit_price"].astype("float64")
+        valued["market_value"] = valued["quantity"].to_numpy(dtype="float64") * valued["unit_price"].to_numpy()
+        valued["base_value"] = self.fx_converter().convert(valued["market_value"], valued["currency"],
+                                                           base_currency, date)
+        valued["missing"] = np.where(valued["base_value"].notna(), None,
+                                     np.where(valued["unit_price"].isna(), "price", "fx_rate"))
+        return valued
 
-    def set_db(self):
+    def get_holdings(self, date: Optional[datetime.datetime] = None, refresh: bool = False) -> pd.DataFrame:
+        """Holdings per account and security at date from the holdings table, materialized on first use"""
+        from tools import holdings
+        view = holdings.HoldingsView(self.db_manager, self.tables)
+        return view.read(date if date else datetime.datetime.now(), refresh)
+
+    def insert_custom_value(self):
         raise NotImplemented
 
+    def set_db(self, db_path: os.path) -> None:
+        """Close the current connections and continue on db_path"""
+        self.close()
+        self.db_path = db_path
+        self.db_manager = self._open_db_manager()
+        self._price_index = None
+        self._fx_converter = None
+        self._lookups = None
+        self._seen_versions = {}
+        self._schema_cache = {"version": None}
+
     def filter_df(self, input_df: pd.DataFrame) -> pd.DataFrame:
         raise NotImplemented
@@ -0,0 +1,130 @@
+"""Seeded synthetic portfolios for benchmarks and load tests
+
+Fills a database created from the yaml schema with accounts, securities, transactions and daily
+prices and FX rates that look like the real thing: a handful of currencies, securities of the usual
+types, mostly buys with occasional sells, and prices and rates following random walks over business
+days. The same seed and scale always give the same database. Rows are generated and written in
+chunks, so millions of transactions do not have to fit in memory as python objects.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# EUR is the base currency, the others start at roughly realistic rates against it
+CURRENCIES = {"EUR": 1.0, "USD": 1.1, "HUF": 390.0, "GBP": 0.86, "CHF": 0.95}
+SECURITY_TYPES = {"Stock": ["Large cap", "Small cap"], "ETF": ["Equity", "Bond"], "Bond": ["Government", "Corporate"],
+                  "Fund": ["Mixed", "Money market"]}
+PROVIDERS = ["bank", "broker", "pension"]
+
+
+@dataclass
+class Scale:
+    accounts: int = 5
+    securities: int = 100
+    transactions: int = 10000
+    start: str = "2020-01-01"
+    end: str = "2023-12-31"
+
+
+# scale points of the benchmark suite
+SCALES = {"small": Scale(5, 50, 10000, "2022-01-01", "2023-12-31"),
+          "medium": Scale(20, 500, 200000, "2019-01-01", "2023-12-31"),
+          "large": Scale(50, 2000, 2000000, "2014-01-01", "2023-12-31")}
+
+
+class SyntheticData:
+    def __init__(self, session_mgr, scale: Scale, seed: int = 0, chunksize: int = 100000) -> None:
+        self.session_mgr = session_mgr
+        self.scale = scale
+        self.chunksize = chunksize
+        self.rng = np.random.default_rng(seed)
+        self.days = pd.bdate_range(scale.start, scale.end)
+        self.day_keys = self.days.strftime("%Y-%m-%d").to_numpy()
+        self.currencies = self.rng.choice(list(CURRENCIES), size=scale.securities, p=[0.4, 0.35, 0.1, 0.1, 0.05])
+
+    def _write(self, type: str, df: pd.DataFrame) -> int:
+        """Insert the columns of df the table actually has, so the generator follows the schema"""
+        table = self.session_mgr.tables[type]
+        known = self.session_mgr.table_columns(table)
+        return self.session_mgr.db_manager.insert_many(table, None, df[[col for col in df.columns if col in known]])
+
+    def accounts(self) -> int:
+        acc_ids = np.arange(1, self.scale.accounts + 1)
+        return self._write("accounts", pd.DataFrame({
+            "id": acc_ids, "short_name": [f"Account {acc_id}" for acc_id in acc_ids],
+            "provider": self.rng.choice(PROVIDERS, size=len(acc_ids)), "active": 1,
+            "change_date": self.day_keys[0]}))
+
+    def securities(self) -> int:
+        sec_ids = np.arange(1, self.scale.securities + 1)
+        types = self.rng.choice(list(SECURITY_TYPES), size=len(sec_ids))
+        subtypes = [SECURITY_TYPES[kind][index] for kind, index in zip(types, self.rng.integers(0, 2, len(sec_ids)))]
+        return self._write("securities", pd.DataFrame({
+            "sec_id": sec_ids, "isin_or_fx": [f"XS{sec_id:010d}" for sec_id in sec_ids],
+            "short_name": [f"SEC{sec_id}" for sec_id in sec_ids],
+            "full_name": [f"Synthetic security {sec_id}" for sec_id in sec_ids],
+            "type": types, "subtype": subtypes, "recorded_date": self.day_keys[0]}))
+
+    def prices(self) -> int:
+        """Daily prices per security as a geometric random walk, written security by security"""
+        written = 0
+        batch = max(1, self.chunksize // len(self.days))
+        for first in range(1, self.scale.securities + 1, batch):
+            sec_ids = np.arange(first, min(first + batch, self.scale.securities + 1))
+            steps = self.rng.normal(0.0002, 0.015, size=(len(sec_ids), len(self.days)))
+            walk = self.rng.uniform(10, 500, size=(len(sec_ids), 1)) * np.exp(np.cumsum(steps, axis=1))
+            written += self._write("prices", pd.DataFrame({
+                "sec_id": np.repeat(sec_ids, len(self.days)), "date": np.tile(self.day_keys, len(sec_ids)),
+                "unit_price": walk.round(4).ravel(), "source": "synthetic"}))
+        return written
+
+    def fx_rates(self) -> int:
+        rates = []
+        for currency, start in CURRENCIES.items():
+            if currency == "EUR":
+                continue
+            walk = start * np.exp(np.cumsum(self.rng.normal(0, 0.004, size=len(self.days))))
+            rates.append(pd.DataFrame({"nominator": "EUR", "denominator": currency, "rate": walk.round(6),
+                                       "date": self.day_keys, "source": "synthetic"}))
+        return self._write("fx_rates", pd.concat(rates, ignore_index=True))
+
+    def transactions(self) -> int:
+        """Buys with occasional partial sells, dated in order and in chunks of chunksize"""
+        written = 0
+        total = self.scale.transactions
+        for first in range(0, total, self.chunksize):
+            count = min(self.chunksize, total - first)
+            # every chunk covers its share of the period, so dates increase with tr_id like real bookings
+            first_day = first * len(self.days) // total
+            last_day = max((first + count) * len(self.days) // total, first_day + 1)
+            day_index = np.sort(self.rng.integers(first_day, last_day, size=count))
+            sec_ids = self.rng.integers(1, self.scale.securities + 1, size=count)
+            quantities = self.rng.integers(1, 100, size=count) * np.where(self.rng.random(count) < 0.2, -1, 1)
+            unit_prices = self.rng.uniform(10, 500, size=count).round(4)
+            written += self._write("transactions", pd.DataFrame({
+                "sec_id": sec_ids, "acc_id": self.rng.integers(1, self.scale.accounts + 1, size=count),
+                "date": self.day_keys[day_index], "type": np.where(quantities > 0, "buy", "sell"),
+                "quantity": quantities, "unit_price": unit_prices, "total_price": (quantities * unit_prices).round(2),
+                "costs": (np.abs(quantities * unit_prices) * 0.001).round(2), "currency": self.currencies[sec_ids - 1],
+                "recorded_date": self.day_keys[day_index]}))
+        return written
+
+    def generate(self) -> dict:
+        """Write every table, returns the rows written per table"""
+        counts = {}
+        for type, build in (("accounts", self.accounts), ("securities", self.securities),
+                            ("fx_rates", self.fx_rates), ("prices", self.prices),
+                            ("transactions", self.transactions)):
+            counts[type] = build()
+            logger.info(f"Synthetic data: {counts[type]} rows in {type}")
+        return counts
+
+
+def generate(session_mgr, scale: Optional[Scale] = None, seed: int = 0) -> dict:
+    """Fill the (empty, initiated) database of session_mgr with synthetic data of the given scale"""
+    return SyntheticData(session_mgr, scale if scale else Scale(), seed).generate()
@@ -0,0 +1,125 @@
+"""Daily portfolio value history computed as whole-matrix operations
+
+Quantities come from a cumulative sum of the date-sorted transactions per (account, security),
+prices and FX rates are forward-filled on the same daily grid, so the history is a days x positions
+product instead of a valuation per day. The positions are valued CHUNK_SECURITIES securities at a
+time and summed into accounts right away, ten years of a few thousand positions would otherwise be
+a matrix of gigabytes.
+"""
+import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from tools.dbtools import dbManager
+from tools.fx import date_key, rate_graph, resolve
+from tools.positions import security_currencies
+from tools.prices import MAX_QUERY_PARAMS
+
+# securities valued per step, bounds the days x positions matrices of values
+CHUNK_SECURITIES = 256
+
+
+def to_days(dates) -> pd.Series:
+    return pd.to_datetime(pd.Series(dates), format="ISO8601").dt.normalize()
+
+
+def on_grid(wide: pd.DataFrame, grid: pd.DatetimeIndex) -> pd.DataFrame:
+    """Forward-fill a date indexed frame onto grid, carrying values quoted before the grid starts"""
+    return wide.reindex(wide.index.union(grid)).ffill().reindex(grid)
+
+
+class PortfolioHistory:
+    def __init__(self, db_manager: dbManager, tables: Optional[dict] = None, pivot: str = "EUR") -> None:
+        tables = tables if tables else {}
+        self.db_manager = db_manager
+        self.transactions = tables.get("transactions", "transactions")
+        self.prices = tables.get("prices", "prices")
+        self.fx_rates = tables.get("fx_rates", "fx_rates")
+        self.pivot = pivot
+
+    def quantities(self, transactions: pd.DataFrame, grid: pd.DatetimeIndex) -> pd.DataFrame:
+        """Daily quantity per (acc_id, sec_id) column, transactions before the grid count from its first day"""
+        days = to_days(transactions["date"]).clip(lower=grid[0])
+        deltas = pd.DataFrame({"day": days.to_numpy(), "acc_id": transactions["acc_id"].to_numpy(),
+                               "sec_id": transactions["sec_id"].to_numpy(),
+                               "quantity": transactions["quantity"].to_numpy(dtype="float64")})
+        deltas = deltas.loc[deltas["day"] <= grid[-1]]
+        wide = deltas.pivot_table(index="day", columns=["acc_id", "sec_id"], values="quantity", aggfunc="sum")
+        return wide.reindex(grid).fillna(0).cumsum()
+
+    def price_matrix(self, sec_ids: np.ndarray, grid: pd.DatetimeIndex) -> pd.DataFrame:
+        next_day = date_key(grid[-1] + pd.Timedelta(days=1))
+        chunks = []
+        for start in range(0, len(sec_ids), MAX_QUERY_PARAMS):
+            chunk = [int(sec_id) for sec_id in sec_ids[start:start + MAX_QUERY_PARAMS]]
+            sql = f"""SELECT sec_id, date, unit_price FROM {self.prices}
+                      WHERE sec_id IN ({",".join("?" for _ in chunk)}) AND date < ? AND unit_price IS NOT NULL"""
+            chunks.append(self.db_manager.read_query(sql, chunk + [next_day]))
+        df = pd.concat(chunks, ignore_index=True)
+        if df.empty:
+            return pd.DataFrame(np.nan, index=grid, columns=sec_ids)
+        df["day"] = to_days(df["date"]).to_numpy()
+        wide = df.pivot_table(index="day", columns="sec_id", values="unit_price", aggfunc="last")
+        return on_grid(wide, grid).reindex(columns=sec_ids)
+
+    def fx_matrix(self, currencies: np.ndarray, base_currency: str, grid: pd.DatetimeIndex) -> pd.DataFrame:
+        """Daily rate of every currency into base_currency, resolved like FxConverter on each day a quote changes"""
+        next_day = date_key(grid[-1] + pd.Timedelta(days=1))
+        df = self.db_manager.read_query(f"""SELECT nominator, denominator, date, rate FROM {self.fx_rates}
+                                            WHERE date < ? AND rate IS NOT NULL AND rate != 0 ORDER BY date""",
+                                        [next_day])
+        if df.empty:
+            return pd.DataFrame(np.nan, index=grid, columns=currencies)
+        # quotes from before the grid are all in force on its first day
+        days = to_days(df["date"]).clip(lower=grid[0]).to_numpy()
+        latest, rates = {}, {}
+        for day, quotes in df.groupby(days, sort=True):
+            latest.update(zip(zip(quotes["nominator"], quotes["denominator"]), quotes["rate"]))
+            graph = rate_graph((nominator, denominator, rate) for (nominator, denominator), rate in latest.items())
+            rates[day] = [resolve(graph, currency, base_currency, self.pivot) for currency in currencies]
+        return on_grid(pd.DataFrame.from_dict(rates, orient="index", columns=currencies), grid)
+
+    def values(self, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+               base_currency: str = "EUR", acc_ids: Optional[list] = None) -> pd.DataFrame:
+        """Daily value in base_currency per acc_id column plus a "total" column
+
+        Positions without a known price or FX rate on a day count as zero for that day.
+        """
+        sql = f"SELECT acc_id, sec_id, date, quantity, currency FROM {self.transactions} WHERE quantity IS NOT NULL"
+        params = []
+        if acc_ids:
+            sql += f" AND acc_id IN ({','.join('?' for _ in acc_ids)})"
+            params = list(acc_ids)
+        transactions = self.db_manager.read_query(sql + " ORDER BY date, tr_id", params)
+        end = pd.Timestamp(end if end else datetime.date.today()).normalize()
+        if transactions.empty:
+            return pd.DataFrame({"total": pd.Series(dtype="float64")}, index=pd.DatetimeIndex([], name="date"))
+        start = pd.Timestamp(start).normalize() if start else to_days(transactions["date"]).min()
+        grid = pd.date_range(start, end, freq="D", name="date")
+
+        sec_ids = np.unique(transactions["sec_id"].to_numpy())
+        # the base currency for securities whose transactions never name one
+        currency_of = security_currencies(self.db_manager, self.transactions, sec_ids).fillna(base_currency)
+        fx_rates = self.fx_matrix(currency_of.unique(), base_currency, grid)
+        accounts = pd.Index(np.unique(transactions["acc_id"].dropna().to_numpy()))
+        per_account = np.zeros((len(grid), len(accounts)))
+        for start in range(0, len(sec_ids), CHUNK_SECURITIES):
+            chunk = sec_ids[start:start + CHUNK_SECURITIES]
+            quantities = self.quantities(transactions.loc[transactions["sec_id"].isin(chunk)], grid)
+            if quantities.empty:
+                continue
+            pair_sec_ids = quantities.columns.get_level_values("sec_id").to_numpy()
+            prices = self.price_matrix(chunk, grid)
+            price_columns = prices.columns.get_indexer(pair_sec_ids)
+            fx_columns = fx_rates.columns.get_indexer(currency_of.reindex(pair_sec_ids).to_numpy())
+            values = quantities.to_numpy() * prices.to_numpy()[:, price_columns] * fx_rates.to_numpy()[:, fx_columns]
+            # summing position columns into accounts as a product with a one-hot (positions x accounts) matrix
+            account_codes = accounts.get_indexer(quantities.columns.get_level_values("acc_id"))
+            one_hot = np.zeros((len(account_codes), len(accounts)))
+            one_hot[np.arange(len(account_codes)), account_codes] = 1.0
+            per_account += np.nan_to_num(values) @ one_hot
+        per_account = pd.DataFrame(per_account, index=grid, columns=accounts)
+        per_account["total"] = per_account.sum(axis=1)
+        return per_account
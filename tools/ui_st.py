@@ -5,11 +5,17 @@ which will then articulate it to the other moduls
 session state setup at start to include hide/show operator keys
 """
 
+import time
+
+import pandas as pd
 import streamlit as st
 
-from tools.util import st_state_changer, formfactory, show_any_tbl
+from tools.util import st_state_changer, formfactory, fk_search_inputs, show_any_tbl
 import tools.request_builder as rb
 
+# streamlit reruns this whole script on every interaction, see the end of the script for the timing
+run_started = time.perf_counter()
+
 states = {"CurrentDB": None,
           "View": False,
           "Summary": False,
@@ -25,6 +31,7 @@ states = {"CurrentDB": None,
           "Settings": False,
           "DBSettings": False,
           "OtherSettings": False,
+          "Diagnostics": False,
           "Browse-Show": False,
           "Browse-Edit": False,
           "Browse-Add": False}
@@ -33,7 +40,23 @@ for state, value in states.items():
     if state not in st.session_state:
         st.session_state[state] = value
 
-app_session = rb.SessionManager()
+
+@st.cache_resource(show_spinner="Opening database...")
+def open_database(db_path: str):
+    """Once per process and database file: create or migrate the tables, later sessions and reruns skip it"""
+    session_mgr = rb.SessionManager(db_path, use_pool=True)
+    session_mgr.initiate_db()
+    # kept in the cache and never closed, its reference keeps the pool of the database open for the
+    # lifetime of the app while browser sessions come and go
+    return session_mgr
+
+
+# one SessionManager per browser session, its connections come from the pool shared by all sessions;
+# switching the database (set_db) or the end of the session releases its reference on the pool
+if "app_session" not in st.session_state:
+    st.session_state["app_session"] = rb.SessionManager(use_pool=True)
+app_session = st.session_state["app_session"]
+open_database(app_session.db_path)
 st.session_state["CurrentDB"] = app_session.db_path
 
 st.markdown("""
@@ -99,7 +122,7 @@ if st.session_state["View"]:
         centercols = st.columns([1, 1, 1])
         try:
             chart = app_session.generate_chart()
-            # centercols[1].dataframe(summary_df)
+            st.altair_chart(chart, use_container_width=True)
         finally:
             st_state_changer("Chart")
 
@@ -136,11 +159,14 @@ if st.session_state["Edit"]:
 
     if st.session_state["AddTrade"]:
         sub_centercols = st.columns([1, 1, 1])
-        with st.form("add_trade_form") as account_form:
-            values = formfactory("transactions", "Record Trade", app_session)
-            if values:
-                st.write(values)
-                app_session.add_entry("transactions", values)
+        # the search boxes filter the pickers of the form, they sit in one frame with it
+        with st.container(border=True):
+            search_terms = fk_search_inputs("transactions", app_session)
+            with st.form("add_trade_form", border=False) as account_form:
+                values = formfactory("transactions", "Record Trade", app_session, search_terms)
+                if values:
+                    st.write(values)
+                    app_session.add_entry("transactions", values)
 
 # popup menu for "Update" options
 if st.session_state["Update"]:
@@ -167,7 +193,7 @@ if st.session_state["Settings"]:
     # Save database?
     # TBD
 
-    col1,col2,col3 = st.columns(3)
+    col1,col2,col3,col4 = st.columns(4)
     with col1:
         if st.button("Database Settings"):
             st_state_changer("DBSettings")
@@ -178,18 +204,80 @@ if st.session_state["Settings"]:
         if st.button("Initiate new DB"):
             app_session.initiate_db()
 
+    with col4:
+        if st.button("Diagnostics"):
+            st_state_changer("Diagnostics")
+
     if st.session_state["DBSettings"]:
         centercols = st.columns([1, 1, 1])
         st.session_state["db_tables"] = app_session.communicate_table_attributes()
         centercols[1].write(f"""Active Database: {st.session_state["CurrentDB"]}""")
+        new_db_path = centercols[1].text_input("Switch to database file", value=st.session_state["CurrentDB"])
+        if centercols[1].button("Open database") and new_db_path != st.session_state["CurrentDB"]:
+            app_session.set_db(new_db_path)
+            st.session_state["CurrentDB"] = app_session.db_path
         # centercols[1].write(f"""Current schema: {st.session_state["db_tables"]}""")
         centercols[1].write(f"""Current schema""")
         centercols[1].dataframe(st.session_state["db_tables"])
         if centercols[1].button("Initiate DataBase tables from Schema"):
             app_session.initiate_db()
+        if centercols[1].button("Optimize database (ANALYZE)"):
+            app_session.optimize(analyze=True)
+        if centercols[1].button("Compact position snapshots"):
+            removed = app_session.compact_positions()
+            centercols[1].write(f"Removed {removed} unchanged snapshots")
+        # backups run on a thread of their own, the page keeps working while a large database is copied
+        compress = centercols[1].checkbox("Compress backup", value=True)
+        keep = centercols[1].number_input("Backups to keep", min_value=1, value=5)
+        if centercols[1].button("Back up database"):
+            st.session_state["BackupJob"] = app_session.save_db(compress=compress, keep=keep)
+        if "BackupJob" in st.session_state:
+            job = st.session_state["BackupJob"]
+            if job.done():
+                try:
+                    centercols[1].write(f"Backup written to {job.result().path}")
+                except Exception as error:
+                    centercols[1].error(f"Backup failed: {error}")
+            else:
+                centercols[1].progress(job.progress, text="Backup running...")
+        backups = app_session.list_backups()
+        if backups:
+            restore_from = centercols[1].selectbox("Restore from backup", backups)
+            if centercols[1].button("Restore database"):
+                pages = app_session.restore_db(restore_from)
+                centercols[1].write(f"Restored {pages} pages from {restore_from}")
         # try:
         #     summary_df = app_session.generate_summary()
         #     centercols[1].dataframe(summary_df)
         # finally:
         #     st_state_changer("DBSettings")
 
+    # statement timings of the active database, see tools/instrumentation.py
+    if st.session_state["Diagnostics"]:
+        recorder = app_session.query_recorder()
+        if "FirstRunMs" in st.session_state:
+            st.caption(f"Script run: {st.session_state['FirstRunMs']:.0f} ms on first paint, "
+                       f"{st.session_state['LastRunMs']:.0f} ms last rerun")
+        st.caption("Query statistics, grouped by statement")
+        diag_cols = st.columns([2, 1, 1])
+        threshold_ms = diag_cols[0].number_input("Slow query threshold (ms)", min_value=1, step=50,
+                                                 value=int(recorder.slow_threshold * 1000)
+                                                 if recorder.slow_threshold else 250)
+        recorder.slow_threshold = threshold_ms / 1000
+        recorder.enabled = diag_cols[1].checkbox("Record statements", value=recorder.enabled)
+        if diag_cols[2].button("Reset statistics"):
+            recorder.reset()
+        st.dataframe(recorder.stats(), hide_index=True)
+        st.caption("Slow queries with their query plan")
+        st.dataframe(recorder.slow_queries(), hide_index=True)
+        if st.button("Check hot query plans"):
+            st.dataframe(pd.DataFrame([{"query": name, "uses_index": result["uses_index"],
+                                        "plan": " | ".join(result["plan"])}
+                                       for name, result in app_session.check_query_plans().items()]),
+                         hide_index=True)
+
+# wall time of this run, the first run of a session is what a new visitor waits for before the first paint
+run_ms = (time.perf_counter() - run_started) * 1000
+if "FirstRunMs" not in st.session_state:
+    st.session_state["FirstRunMs"] = run_ms
+st.session_state["LastRunMs"] = run_ms
@@ -1,7 +1,9 @@
 import re
+from typing import Optional
 
 import streamlit as st
 
+from tools import lookups
 from tools.dbtools import dbManager
 from tools.request_builder import SessionManager
 
@@ -14,11 +16,12 @@ def st_state_changer(state_value: str, ):
         st.session_state[state_value] = True
 
 def parse_column_config(table_config: dict, table_name: str) -> dict:
-    tbl_attributes_list = table_config[table_name].split(sep=",")
+    # split on commas outside of parentheses, composite keys like "PRIMARY KEY (sec_id, date)" stay in one piece
+    tbl_attributes_list = re.split(r",(?![^()]*\))", table_config[table_name])
     parsed_values = {}
     for column in tbl_attributes_list:
         column = column.strip()
-        if bool(re.search(r"PRIMARY KEY", column, re.IGNORECASE)):
+        if bool(re.search(r"PRIMARY KEY|^UNIQUE", column, re.IGNORECASE)):
             continue
         elif bool(re.search(r"FOREIGN KEY", column, re.IGNORECASE)):
             col_to_list = column.split(sep=" ")
@@ -42,36 +45,42 @@ def restricted_column_options(table_config: dict) -> dict:
                 options[column] = {parsed_val[1]: parsed_val[2]}
     return options
 
-def option_list_from_table_values(session_mgr: SessionManager,table: str, column: str) -> list:
-    df = session_mgr.read(session_mgr.tables[table])
-    if df.empty:
-        return [f"No selectable values found in table '{table}'"]
-    dict_of_options = {}
-    for d in df.to_dict(orient='records'):
-        formatted = ' - '.join([f"{value}" for value in d.values()])
-        dict_of_options[formatted] = d[column]
+def option_list_from_table_values(session_mgr: SessionManager, table: str, column: str, search: str = "",
+                                  limit: int = lookups.DEFAULT_LIMIT) -> dict:
+    dict_of_options = session_mgr.lookup_options(session_mgr.tables[table], column, search=search, limit=limit)
+    if not dict_of_options:
+        if search:
+            return {f"No values matching '{search}' found in table '{table}'": None}
+        return {f"No selectable values found in table '{table}'": None}
     return dict_of_options
 
 def build_form_configs(table_name: str, session_mgr: SessionManager) -> (dict, dict):
-    table_config = session_mgr.communicate_table_attributes(table_name)
-    parsed_config = parse_column_config(table_config, table_name)
-    restricted_value_columns = restricted_column_options(parsed_config)
+    parsed_config, restricted_value_columns = session_mgr.form_config(table_name)
     return parsed_config, restricted_value_columns
 
 def build_val_column_selection(restricted_value_columns: dict, column: str,
-                                          session_mgr: SessionManager) -> (dict, list):
+                               session_mgr: SessionManager, search: str = "") -> (dict, list):
     table, column = next(iter(restricted_value_columns[column].items()))
-    options = option_list_from_table_values(session_mgr, table, column)
+    options = option_list_from_table_values(session_mgr, table, column, search=search)
     options_display = [option for option in options.keys()]
     return options, options_display
 
-def formfactory(table_name: str, submit_text: str, session_mgr: SessionManager) -> dict:
+def fk_search_inputs(table_name: str, session_mgr: SessionManager) -> dict:
+    """Search boxes for the foreign key pickers of a form, to be placed right before the st.form in
+    a container shared with it, as widgets inside a form only report their values on submit"""
+    _, restricted_value_columns = build_form_configs(table_name, session_mgr)
+    return {column: st.text_input(f"Search {column}", key=f"{table_name}-{column}-search")
+            for column in restricted_value_columns}
+
+def formfactory(table_name: str, submit_text: str, session_mgr: SessionManager,
+                search_terms: Optional[dict] = None) -> dict:
     parsed_config, restricted_value_columns = build_form_configs(table_name, session_mgr)
+    search_terms = search_terms if search_terms else {}
     values = {}
     for key, value in parsed_config.items():
         if key in restricted_value_columns.keys():
             options, options_display = build_val_column_selection(restricted_value_columns, key,
-                                                                  session_mgr)
+                                                                  session_mgr, search=search_terms.get(key, ""))
             selection_value = st.selectbox(key, options_display)
             values[key] = options[selection_value]
         elif value in ("TEXT"):
@@ -89,11 +98,16 @@ def formfactory(table_name: str, submit_text: str, session_mgr: SessionManager)
             values[key] = db_time
     submitted = st.form_submit_button(submit_text)
     if submitted:
+        # the "No values found" placeholder of a picker maps to None, a foreign key is never submitted empty
+        unselected = [key for key in restricted_value_columns if key in values and values[key] is None]
+        if unselected:
+            st.error(f"Select a value for {', '.join(unselected)}, adjust the search if none is offered")
+            return None
         return values
 
 def columns_value_options_from_db(table_name: str, column_name: str, session_mngr: SessionManager) -> list:
-    df = session_mngr.read(session_mngr.tables["types"])
-    df = df[(df["category"] == table_name + "_col_values") & (df["option"] == column_name)]
+    df = session_mngr.read(session_mngr.tables["types"], columns=["value"],
+                           filters={"category": table_name + "_col_values", "option": column_name})
     if not df.empty:
         return df["value"].to_list()
     return []
@@ -138,9 +152,34 @@ def show_any_tbl(session_mngr: SessionManager):
 def edit_table(session_mngr: SessionManager) -> None:
     raise NotImplemented
 
-def show_table(session_mngr: SessionManager) -> None:
-    table_df = session_mngr.read(st.session_state["Browse-Show"])
-    st.dataframe(table_df)
+def show_table(session_mngr: SessionManager, page_size: int = 100) -> None:
+    """Browse a table one keyset page at a time, the cursors of the visited pages are kept in the
+    session state so Previous steps back without re-reading earlier pages"""
+    table = st.session_state["Browse-Show"]
+    all_columns = session_mngr.table_columns(table)
+    columns = st.multiselect("Columns", all_columns, default=all_columns)
+    order_by = st.selectbox("Sort by", [None] + all_columns)
+    descending = st.checkbox("Descending")
+    view = (table, tuple(columns), order_by, descending)
+    if st.session_state.get("Browse-Page", {}).get("view") != view:
+        st.session_state["Browse-Page"] = {"view": view, "cursors": [None], "last": None}
+    paging = st.session_state["Browse-Page"]
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.form_submit_button("Previous page") and len(paging["cursors"]) > 1:
+            paging["cursors"].pop()
+    with col2:
+        if st.form_submit_button("Next page") and paging["last"] is not None:
+            paging["cursors"].append(paging["last"])
+
+    page = session_mngr.read_page(table, columns if columns else None, order_by, descending,
+                                  after=paging["cursors"][-1], page_size=page_size)
+    paging["last"] = page.last if page.has_next else None
+    st.dataframe(page.rows)
+    first_row = (len(paging["cursors"]) - 1) * page_size
+    st.caption(f"Rows {first_row + 1 if len(page.rows) else 0}-{first_row + len(page.rows)} "
+               f"of about {session_mngr.estimate_count(table)}")
 
 def append_table(session_mngr: SessionManager) -> None:
     table_to_append = st.session_state["Browse-Add"]